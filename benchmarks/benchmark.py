@@ -0,0 +1,398 @@
+"""
+Benchmarks of the save/load throughput, latency and peak memory of varpack.
+
+Each case runs an operation (see OPERATIONS) on a synthetic pack (see GENERATORS) a number of times and records the
+wall time of each run, the peak resident memory during the runs (and its increase over the memory before the run)
+and the size of the pack. Results are saved as JSON and can be compared with a previous run (a baseline):
+
+    python benchmarks/benchmark.py --output baseline.json
+    python benchmarks/benchmark.py --compare baseline.json --output new.json
+
+Cache modes:
+    warm: the files of the pack are in the page cache (they are read once before the runs)
+    cold: the files of the pack are evicted from the page cache before each run (with posix_fadvise, where supported)
+"""
+import os
+import sys
+import gc
+import copy
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+
+import numpy as np
+
+# make sure the varpack package in this repository is used
+varpack_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if varpack_path not in sys.path:
+    sys.path.insert(0, varpack_path)
+
+import varpack as vp
+
+MB = 2 ** 20
+MAX_DICT_KEYS = 1000  # default max_dict_keys of Varpack.save()
+SAVE_OPTIONS = {'pack_array_dicts': True}  # options of the saves, so that large dictionaries use packed storage
+DEFAULT_THRESHOLD = 0.1  # relative slowdown (of the median time) reported as a regression
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# synthetic packs
+
+def make_arrays(num_vars, array_bytes):
+    # num_vars float64 arrays of array_bytes each
+    varpack = vp.Varpack()
+    rng = np.random.default_rng(0)
+    for i in range(num_vars):
+        setattr(varpack, 'arr%d' % i, rng.random(array_bytes // 8))
+    return varpack
+
+
+def make_dict(num_keys, array_bytes):
+    # a dictionary of num_keys float32 arrays of array_bytes each (placeholders below max_dict_keys, packed above)
+    varpack = vp.Varpack()
+    rng = np.random.default_rng(0)
+    varpack.embeddings = {'key%d' % i: rng.random(array_bytes // 4, dtype=np.float32) for i in range(num_keys)}
+    return varpack
+
+
+def make_pickled(num_objects):
+    # a list of num_objects small dictionaries, which are pickled
+    varpack = vp.Varpack()
+    varpack.records = [{'id': i, 'name': 'record-%d' % i, 'values': [i, i + 1.5, None]} for i in range(num_objects)]
+    return varpack
+
+
+GENERATORS = {
+    'arrays': make_arrays,
+    'dict': make_dict,
+    'pickled': make_pickled,
+}
+
+# (generator, parameters) of each scale. Dictionary widths are around max_dict_keys, where saving switches from one
+# placeholder file per array to packed storage.
+SCALES = {
+    'quick': [
+        ('arrays', {'num_vars': 1, 'array_bytes': 8 * MB}),
+        ('arrays', {'num_vars': 100, 'array_bytes': 64 * 2 ** 10}),
+        ('dict', {'num_keys': MAX_DICT_KEYS // 2, 'array_bytes': 4 * 2 ** 10}),
+        ('dict', {'num_keys': MAX_DICT_KEYS * 2, 'array_bytes': 4 * 2 ** 10}),
+        ('pickled', {'num_objects': 10 ** 4}),
+    ],
+    'default': [
+        ('arrays', {'num_vars': 1, 'array_bytes': 8 * MB}),
+        ('arrays', {'num_vars': 1, 'array_bytes': 256 * MB}),
+        ('arrays', {'num_vars': 10, 'array_bytes': 16 * MB}),
+        ('arrays', {'num_vars': 1000, 'array_bytes': 64 * 2 ** 10}),
+        ('dict', {'num_keys': MAX_DICT_KEYS // 2, 'array_bytes': 16 * 2 ** 10}),
+        ('dict', {'num_keys': MAX_DICT_KEYS - 1, 'array_bytes': 16 * 2 ** 10}),
+        ('dict', {'num_keys': MAX_DICT_KEYS, 'array_bytes': 16 * 2 ** 10}),
+        ('dict', {'num_keys': MAX_DICT_KEYS * 10, 'array_bytes': 4 * 2 ** 10}),
+        ('pickled', {'num_objects': 10 ** 4}),
+        ('pickled', {'num_objects': 10 ** 6}),
+    ],
+}
+SCALES['full'] = SCALES['default'] + [
+    ('arrays', {'num_vars': 1, 'array_bytes': 2048 * MB}),
+    ('arrays', {'num_vars': 10000, 'array_bytes': 4 * 2 ** 10}),
+    ('dict', {'num_keys': MAX_DICT_KEYS * 100, 'array_bytes': 1024}),
+    ('pickled', {'num_objects': 10 ** 7}),
+]
+
+
+def case_name(generator, params):
+    return '%s-%s' % (generator, '-'.join('%s=%s' % (k, params[k]) for k in sorted(params)))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# memory and page cache
+
+def reset_peak_rss():
+    # resets the peak resident memory of the process (Linux), returns whether it was reset
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except EnvironmentError:
+        return False
+
+
+def _proc_status(field):
+    # a memory field of /proc/self/status in bytes (Linux), or None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except EnvironmentError:
+        pass
+    return None
+
+
+def current_rss():
+    return _proc_status('VmRSS')
+
+
+def peak_rss():
+    # peak resident memory of the process in bytes, since the last reset_peak_rss()
+    peak = _proc_status('VmHWM')
+    if peak is not None:
+        return peak
+    try:
+        import resource
+        # not resettable: the peak since the start of the process (in kB on Linux, in bytes on macOS)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+    except ImportError:
+        return None
+
+
+def pack_files(path):
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(root, f) for root, _, files in os.walk(path) for f in files]
+
+
+def evict_from_cache(path):
+    # removes the files of a pack from the page cache, returns whether it is supported
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    for filename in pack_files(path):
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            return False
+        finally:
+            os.close(fd)
+    return True
+
+
+def warm_cache(path):
+    for filename in pack_files(path):
+        with open(filename, 'rb') as f:
+            while f.read(16 * MB):
+                pass
+
+
+def pack_bytes(path):
+    return sum(os.path.getsize(f) for f in pack_files(path))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# operations: each is a function (source, saved, scratch) that prepares the operation and returns a function without
+# arguments, which is timed. source is the generated pack (not attached), saved the folder where it has been saved and
+# scratch an empty folder.
+
+def unattached_copy(source):
+    # copy of the generated pack that is not attached to a folder: saving a pack attaches it and replaces its arrays
+    # with memory maps, after which saving it into another folder copies its files instead of serializing them
+    varpack = vp.Varpack()
+    for name, value in vars(source).items():
+        if name != '__internal__':
+            setattr(varpack, name, copy.deepcopy(value))
+    return varpack
+
+
+def op_save(source, saved, scratch):
+    # full save into a new folder, of a fresh copy of the pack each run
+    varpack = unattached_copy(source)
+    return lambda: varpack.save(save_folder=os.path.join(scratch, 'save'), **SAVE_OPTIONS)
+
+
+def op_resave(source, saved, scratch):
+    # incremental save of a loaded pack without changes, only varpack.json is rewritten
+    return vp.Varpack(saved).save
+
+
+def op_load(source, saved, scratch):
+    return lambda: vp.Varpack(saved, numpy_mmap_mode='r')
+
+
+def op_load_read(source, saved, scratch):
+    # load, then read all the arrays (through the memory maps)
+    def load_read():
+        loaded = vp.Varpack(saved, numpy_mmap_mode='r')
+        for value in vars(loaded).values():
+            _touch(value)
+    return load_read
+
+
+def op_detach(source, saved, scratch):
+    return vp.Varpack(saved, numpy_mmap_mode='r').detach
+
+
+def op_save_then_copy(source, saved, scratch):
+    loaded = vp.Varpack(saved)
+    return lambda: loaded.save_then_copy(os.path.join(scratch, 'copy'))
+
+
+def op_total_obj_size(source, saved, scratch):
+    return lambda: vp.get_total_obj_size(source)
+
+
+def op_estimate_obj_size(source, saved, scratch):
+    return lambda: vp.estimate_obj_size(source)
+
+
+def _touch(value):
+    if isinstance(value, np.ndarray):
+        value.sum()
+    elif isinstance(value, dict) or isinstance(value, vp.PackedArrayDict):
+        for v in value.values():
+            _touch(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _touch(v)
+
+
+# name -> (function, whether the cache mode applies, i.e. it reads the saved pack)
+OPERATIONS = {
+    'save': (op_save, False),
+    'resave': (op_resave, True),
+    'load': (op_load, True),
+    'load_read': (op_load_read, True),
+    'detach': (op_detach, True),
+    'save_then_copy': (op_save_then_copy, True),
+    'get_total_obj_size': (op_total_obj_size, False),
+    'estimate_obj_size': (op_estimate_obj_size, False),
+}
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# running and comparing
+
+def run_case(operation, source, saved, cache, repeat, tmp_root):
+    function, reads_pack = OPERATIONS[operation]
+    seconds = list()
+    peak = 0
+    peak_increase = None
+    peak_is_reset = False
+    for _ in range(repeat):
+        scratch = tempfile.mkdtemp(dir=tmp_root)
+        try:
+            timed_function = function(source, saved, scratch)
+            if reads_pack and cache == 'cold':
+                if not evict_from_cache(saved):
+                    return None  # not supported on this platform
+            elif reads_pack:
+                warm_cache(saved)
+            gc.collect()
+            peak_is_reset = reset_peak_rss()
+            rss_before = current_rss()
+            start = time.perf_counter()
+            timed_function()
+            seconds.append(time.perf_counter() - start)
+            peak = max(peak, peak_rss() or 0)
+            if peak_is_reset and rss_before is not None:
+                peak_increase = max(peak_increase or 0, peak - rss_before)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return {'seconds': seconds, 'median': statistics.median(seconds), 'min': min(seconds),
+            'peak_rss_bytes': peak, 'peak_rss_increase_bytes': peak_increase, 'peak_rss_reset': peak_is_reset}
+
+
+def run(scale='quick', operations=None, cache_modes=('warm',), repeat=3, tmp_root=None, only=None):
+    """
+    :param scale: 'quick', 'default' or 'full', see SCALES.
+    :param operations: list of the operations to run. Default: all of OPERATIONS.
+    :param cache_modes: 'warm' and/or 'cold'.
+    :param repeat: number of runs of each case.
+    :param tmp_root: folder where the packs are saved (the page cache of its filesystem is measured).
+    :param only: run only the cases whose name contains this string.
+    :return: dictionary with the metadata of the run and the results of each case.
+    """
+    operations = list(OPERATIONS) if operations is None else operations
+    vp.set_verbose(False)
+    results = dict()
+    try:
+        for generator, params in SCALES[scale]:
+            name = case_name(generator, params)
+            if only is not None and only not in name:
+                continue
+            source = GENERATORS[generator](**params)
+            folder = tempfile.mkdtemp(dir=tmp_root)
+            try:
+                saved = os.path.join(folder, 'pack')
+                unattached_copy(source).save(save_folder=saved, **SAVE_OPTIONS)
+                size = pack_bytes(saved)
+                for operation in operations:
+                    modes = cache_modes if OPERATIONS[operation][1] else ['warm']
+                    for cache in modes:
+                        result = run_case(operation, source, saved, cache, repeat, folder)
+                        if result is None:
+                            continue
+                        result.update({'operation': operation, 'pack': name, 'cache': cache, 'pack_bytes': size,
+                                       'mb_per_s': size / MB / result['median'] if result['median'] > 0 else None})
+                        key = '%s/%s/%s' % (operation, name, cache)
+                        results[key] = result
+                        print('%-70s %10.4f s %10.1f MB/s %8.1f MB peak RSS (+%.1f MB)' % (
+                            key, result['median'], result['mb_per_s'] or 0, result['peak_rss_bytes'] / MB,
+                            (result['peak_rss_increase_bytes'] or 0) / MB))
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+            del source
+    finally:
+        vp.set_verbose(True)
+
+    return {'meta': {'time': time.time(), 'python': platform.python_version(), 'numpy': np.__version__,
+                     'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'scale': scale,
+                     'repeat': repeat},
+            'results': results}
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare the median times of the cases of two runs.
+    :return: list of (case, baseline median, current median, ratio, status) for the cases of both runs, where status
+             is 'regression' if the current run is slower by more than threshold, 'improvement' if it is faster by
+             more than threshold, else 'same'.
+    """
+    rows = list()
+    for key in sorted(set(baseline['results']) & set(current['results'])):
+        before = baseline['results'][key]['median']
+        after = current['results'][key]['median']
+        ratio = after / before if before > 0 else float('inf')
+        status = 'regression' if ratio > 1 + threshold else 'improvement' if ratio < 1 - threshold else 'same'
+        rows.append((key, before, after, ratio, status))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='quick')
+    parser.add_argument('--operations', nargs='+', choices=list(OPERATIONS), default=None)
+    parser.add_argument('--cache', choices=['warm', 'cold', 'both'], default='warm')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', default=None, help='only run the cases whose name contains this string')
+    parser.add_argument('--tmp', default=None, help='folder where the packs are saved')
+    parser.add_argument('--output', default=None, help='save the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='compare the results with this JSON file (a baseline)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative change of the median time reported as a regression or improvement')
+    args = parser.parse_args(argv)
+
+    cache_modes = ['warm', 'cold'] if args.cache == 'both' else [args.cache]
+    current = run(args.scale, args.operations, cache_modes, args.repeat, args.tmp, args.only)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=4)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(baseline, current, args.threshold)
+        print()
+        for key, before, after, ratio, status in rows:
+            print('%-70s %10.4f s -> %10.4f s  x%.2f  %s' % (key, before, after, ratio, status))
+        if any(row[4] == 'regression' for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,6 +11,17 @@ if varpack_path not in sys.path:  # add parent dir to paths
 import numpy as np
 import varpack as vp
 import tempfile
+import json
+import copy
+import pickle
+from unittest import mock
+
+
+class Model:
+    # custom object holding numpy arrays, for testing pickling
+    def __init__(self):
+        self.layers = [np.ones((100, 1000)), np.zeros(500)]
+        self.name = 'model'
 
 
 class TestVarPack(TestCase):
@@ -104,3 +115,1020 @@ class TestVarPack(TestCase):
 
                 loaded_varpack2 = vp.Varpack(tmpdirname2)
                 self.assertTrue(hasattr(loaded_varpack2, 'np_arr'))
+
+    def test_incremental_save(self):
+        varpack = vp.Varpack()
+        varpack.scalar = 10
+        varpack.np_arr = np.arange(100000)
+        varpack.big_list = list(range(10000))
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save()
+            self.assertGreater(varpack.last_save_bytes_written(), varpack.np_arr.nbytes)
+
+            # nothing changed: only the json file is rewritten
+            mtime = os.path.getmtime(os.path.join(tmpdirname, 'np_arr.npy'))
+            varpack.save()
+            self.assertEqual(varpack.last_save_bytes_written(),
+                             os.path.getsize(os.path.join(tmpdirname, vp.JSON_FILENAME)))
+            self.assertEqual(mtime, os.path.getmtime(os.path.join(tmpdirname, 'np_arr.npy')))
+
+            # in-place changes are detected through content fingerprints
+            varpack.np_arr[0] = -1
+            varpack.big_list.append(-1)
+            varpack.save()
+            self.assertGreater(varpack.last_save_bytes_written(), varpack.np_arr.nbytes)
+
+            loaded_varpack = vp.Varpack(tmpdirname)
+            self.assertEqual(loaded_varpack.np_arr[0], -1)
+            self.assertEqual(loaded_varpack.big_list[-1], -1)
+            self.assertEqual(loaded_varpack.scalar, 10)
+
+            # with trust_assignments only re-assigned variables are considered
+            loaded_varpack.big_list.append(-2)
+            loaded_varpack.scalar = 11
+            loaded_varpack.save(trust_assignments=True)
+            reloaded_varpack = vp.Varpack(tmpdirname)
+            self.assertEqual(reloaded_varpack.scalar, 11)
+            self.assertEqual(reloaded_varpack.big_list[-1], -1)
+
+    def test_lazy_load(self):
+        varpack = vp.Varpack()
+        varpack.scalar = 10
+        varpack.text = 'test'
+        varpack.big_list = list(range(10000))
+        varpack.np_arr = np.arange(1000)
+        varpack.dict_of_np_arr = {'key1': np.ones(20000), 'key2': 'value'}
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save()
+
+            loaded_varpack = vp.Varpack(tmpdirname, lazy=True)
+            self.assertNotIn('big_list', vars(loaded_varpack))
+            self.assertNotIn('scalar', vars(loaded_varpack))
+            self.assertIn('np_arr', vars(loaded_varpack))
+            self.assertIn('big_list', dir(loaded_varpack))
+
+            # first access loads the variable, misc. variables are loaded together
+            self.assertEqual(loaded_varpack.scalar, 10)
+            self.assertIn('text', vars(loaded_varpack))
+            self.assertNotIn('big_list', vars(loaded_varpack))
+
+            loaded_varpack.prefetch(['dict_of_np_arr'])
+            self.assertIsInstance(vars(loaded_varpack)['dict_of_np_arr']['key1'], np.memmap)
+
+            # variables that are still not loaded are kept when saving
+            loaded_varpack.scalar = 11
+            loaded_varpack.save()
+            reloaded_varpack = vp.Varpack(tmpdirname, lazy=True)
+            self.assertListEqual(reloaded_varpack.big_list, varpack.big_list)
+            self.assertEqual(reloaded_varpack.scalar, 11)
+            self.assertEqual(reloaded_varpack.text, 'test')
+            self.assertFalse(hasattr(reloaded_varpack, 'not_a_var'))
+
+    def test_parallel_save_load(self):
+        varpack = vp.Varpack()
+        for i in range(10):
+            setattr(varpack, 'np_arr%d' % i, np.full(1000, i))
+            setattr(varpack, 'list%d' % i, [i] * 2000)
+        varpack.dict_of_np_arr = {'key%d' % i: np.full(20000, i) for i in range(10)}
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(workers=4)
+
+            loaded_varpack = vp.Varpack(tmpdirname, workers=4)
+            for i in range(10):
+                self.assertTrue(np.all(getattr(loaded_varpack, 'np_arr%d' % i) == i))
+                self.assertListEqual(getattr(loaded_varpack, 'list%d' % i), [i] * 2000)
+                self.assertTrue(np.all(loaded_varpack.dict_of_np_arr['key%d' % i] == i))
+
+            # a corrupted file is reported and skipped when stop_on_error is False
+            with open(os.path.join(tmpdirname, 'list3.pickle'), 'wb') as f:
+                f.write(b'corrupted')
+            loaded_varpack = vp.Varpack()
+            loaded_varpack.load(tmpdirname, stop_on_error=False, workers=4)
+            self.assertFalse(hasattr(loaded_varpack, 'list3'))
+            self.assertListEqual(loaded_varpack.list4, [4] * 2000)
+
+        # the files of the different kinds of variables written concurrently are matched to their variables
+        varpack = vp.Varpack()
+        varpack.ids = np.array(['a', 'bc'] * 1000, dtype=object)
+        varpack.objects = np.array([None, {1: 2}] * 1000, dtype=object)  # cannot be saved as .npy, pickled instead
+        varpack.embeddings = {i: np.full(4, i, dtype=np.float32) for i in range(20)}
+        varpack.np_arr = np.arange(1000)
+        varpack.nested = {'weights': np.ones(20000)}
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(workers=4, max_dict_keys=10, string_arrays='offsets', pack_array_dicts=True)
+            var_info = varpack.__internal__['var_info']
+            self.assertEqual(var_info['ids']['filename'], 'ids.strings.npy')
+            self.assertEqual(var_info['objects']['filename'], 'objects.pickle')
+            self.assertEqual(var_info['embeddings']['filename'], 'embeddings.packed.npy')
+            self.assertEqual(var_info['np_arr']['filename'], 'np_arr.npy')
+            self.assertTrue(var_info['nested']['uses_numpy_placeholders'])
+
+            loaded_varpack = vp.Varpack(tmpdirname)
+            self.assertListEqual(list(loaded_varpack.ids), ['a', 'bc'] * 1000)
+            self.assertEqual(loaded_varpack.objects[1], {1: 2})
+            self.assertTrue(np.all(loaded_varpack.embeddings[7] == 7))
+            self.assertTrue(np.all(loaded_varpack.np_arr == np.arange(1000)))
+
+            # storage options are checked like keyword arguments
+            with self.assertRaises(TypeError):
+                varpack.save(compresion='zlib')
+
+    def test_estimate_obj_size(self):
+        arr = np.ones(100000)
+        self.assertGreaterEqual(vp.estimate_obj_size(arr), arr.nbytes)
+        self.assertGreaterEqual(vp.estimate_obj_size({'a': arr, 'b': 'text'}), arr.nbytes)
+
+        # large homogeneous containers are sampled, the estimate should still be close to the exact size
+        tuples = [(i, str(i)) for i in range(100000)]
+        exact_size = vp.get_total_obj_size(tuples)
+        self.assertAlmostEqual(vp.estimate_obj_size(tuples) / exact_size, 1, delta=0.1)
+
+        # with an exhausted budget, the remaining elements are extrapolated
+        mixed = [i if i % 2 else str(i) for i in range(10000)]
+        self.assertAlmostEqual(vp.estimate_obj_size(mixed, max_elements=100) / vp.get_total_obj_size(mixed), 1,
+                               delta=0.5)
+
+        # the estimate drives placing variables in separate pickle files
+        varpack = vp.Varpack()
+        varpack.small_list = [1, 2, 3]
+        varpack.small_dict = {'a': [1, 2, 3]}
+        varpack.list_of_arrays = [np.ones(10), np.ones(5000)]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(sep_var_min_size=10000)
+            self.assertIn('list_of_arrays.pickle', os.listdir(tmpdirname))
+            self.assertNotIn('small_list.pickle', os.listdir(tmpdirname))
+
+            # including for variables modified in place since the previous save
+            varpack.small_dict['a'] = list(range(100000))
+            varpack.save(sep_var_min_size=10000)
+            self.assertIn('small_dict.pickle', os.listdir(tmpdirname))
+
+    def test_placeholder_filenames_and_gc(self):
+        varpack = vp.Varpack()
+        varpack.dict_of_np_arr = {'key1': np.ones(20000), 'key2': np.zeros(20000), 3: np.zeros(20000)}
+        varpack.np_arr = np.ones(100)
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save()
+
+            # file names do not depend on the (randomized) hash of the keys
+            filenames = set(os.listdir(tmpdirname))
+            for key in ['key1', 'key2', 3]:
+                self.assertIn(vp.placeholder_filename('dict_of_np_arr', (key,)), filenames)
+
+            # re-saving from a new instance reuses the same files
+            loaded_varpack = vp.Varpack(tmpdirname)
+            loaded_varpack.dict_of_np_arr['key1'] = np.full(20000, 2.)
+            del loaded_varpack.dict_of_np_arr['key2']
+            del loaded_varpack.np_arr
+            loaded_varpack.save()
+
+            filenames_after = set(os.listdir(tmpdirname))
+            self.assertNotIn(vp.placeholder_filename('dict_of_np_arr', ('key2',)), filenames_after)
+            self.assertNotIn('np_arr.npy', filenames_after)
+            self.assertEqual(filenames_after, filenames - {vp.placeholder_filename('dict_of_np_arr', ('key2',)),
+                                                           'np_arr.npy'})
+
+            reloaded_varpack = vp.Varpack(tmpdirname)
+            self.assertTrue(np.all(reloaded_varpack.dict_of_np_arr['key1'] == 2))
+            self.assertFalse(hasattr(reloaded_varpack, 'np_arr'))
+
+            # files unknown to the pack are removed by gc()
+            np.save(os.path.join(tmpdirname, 'orphan.npy'), np.ones(3))
+            self.assertListEqual(reloaded_varpack.gc(), ['orphan.npy'])
+            self.assertNotIn('orphan.npy', os.listdir(tmpdirname))
+
+    def test_single_file_format(self):
+        varpack = vp.Varpack()
+        varpack.scalar = 10
+        varpack.np_arr = np.arange(100000).reshape(1000, 100)
+        varpack.record_arr = np.zeros(10, dtype=[('a', 'i4'), ('b', 'f8', (2,))])
+        varpack.zero_dim = np.array(3.5)
+        varpack.big_list = list(range(10000))
+        varpack.dict_of_np_arr = {'key1': np.ones(20000), 'key2': 'value'}
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            filename = os.path.join(tmpdirname, 'pack.vp')
+            varpack.save(save_folder=filename, format='single')
+            self.assertTrue(os.path.isfile(filename))
+
+            loaded_varpack = vp.Varpack(filename)
+            self.assertIsInstance(loaded_varpack.np_arr, np.memmap)
+            self.assertTrue(np.all(loaded_varpack.np_arr == varpack.np_arr))
+            self.assertEqual(loaded_varpack.record_arr.dtype, varpack.record_arr.dtype)
+            self.assertEqual(loaded_varpack.zero_dim, 3.5)
+            self.assertIsInstance(loaded_varpack.dict_of_np_arr['key1'], np.memmap)
+            self.assertEqual(loaded_varpack.dict_of_np_arr['key2'], 'value')
+            self.assertListEqual(loaded_varpack.big_list, varpack.big_list)
+            self.assertEqual(loaded_varpack.np_arr.offset % vp.singlefile.SEGMENT_ALIGNMENT, 0)
+
+            # re-saving in place keeps previously memory-mapped arrays valid
+            loaded_varpack.scalar = 11
+            loaded_varpack.save()
+            self.assertTrue(np.all(loaded_varpack.np_arr == varpack.np_arr))
+
+            # skipped and lazily loaded variables are kept
+            partial_varpack = vp.Varpack(filename, skip_loading=['np_arr'], lazy=True)
+            partial_varpack.save()
+            reloaded_varpack = vp.Varpack(filename)
+            self.assertEqual(reloaded_varpack.scalar, 11)
+            self.assertTrue(np.all(reloaded_varpack.np_arr == varpack.np_arr))
+            self.assertListEqual(reloaded_varpack.big_list, varpack.big_list)
+
+            # conversion back and forth between the two formats
+            folder = os.path.join(tmpdirname, 'folder')
+            vp.convert_pack(filename, folder, format='folder')
+            self.assertTrue(os.path.isfile(os.path.join(folder, vp.JSON_FILENAME)))
+            filename2 = os.path.join(tmpdirname, 'pack2.vp')
+            vp.convert_pack(folder, filename2, format='single')
+            converted_varpack = vp.Varpack(filename2)
+            self.assertTrue(np.all(converted_varpack.dict_of_np_arr['key1'] == 1))
+            self.assertEqual(converted_varpack.scalar, 11)
+
+            # the file is only flushed to disk by durable saves
+            for durable in [False, True]:
+                with mock.patch.object(vp.singlefile.os, 'fsync') as fsync:
+                    converted_varpack.save(durable=durable)
+                self.assertEqual(fsync.called, durable)
+
+    def test_out_of_band_buffers(self):
+        varpack = vp.Varpack()
+        varpack.model = Model()
+        varpack.nested = {'a': {'b': [np.arange(100000)]}}
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save()
+            self.assertIn('model.buffer0.bin', os.listdir(tmpdirname))
+
+            # the large nested arrays are backed by memory-mapped files, the small ones are pickled in-band
+            loaded_varpack = vp.Varpack(tmpdirname)
+            base = loaded_varpack.model.layers[0]
+            while base.base is not None and not isinstance(base, np.memmap):
+                base = base.base
+            self.assertIsInstance(base, np.memmap)
+            self.assertTrue(np.all(loaded_varpack.model.layers[0] == 1))
+            self.assertTrue(np.all(loaded_varpack.model.layers[1] == 0))
+            self.assertTrue(np.all(loaded_varpack.nested['a']['b'][0] == np.arange(100000)))
+
+            # re-saving a changed variable keeps the memory-mapped buffers of the previous version valid
+            loaded_varpack.model.name = 'renamed'
+            loaded_varpack.save()
+            self.assertTrue(np.all(loaded_varpack.model.layers[0] == 1))
+            self.assertEqual(vp.Varpack(tmpdirname).model.name, 'renamed')
+
+            # in-place modifications of the buffers are not written to their files, but they are saved by save()
+            loaded_varpack.model.layers[0][0, 0] = -1
+            self.assertEqual(vp.Varpack(tmpdirname).model.layers[0][0, 0], 1)
+            loaded_varpack.save()
+            self.assertEqual(vp.Varpack(tmpdirname).model.layers[0][0, 0], -1)
+
+            loaded_varpack = vp.Varpack(tmpdirname, numpy_mmap_mode='r')
+            self.assertFalse(loaded_varpack.model.layers[0].flags.writeable)
+
+    def test_nested_placeholders(self):
+        varpack = vp.Varpack()
+        cyclic = {'arr': np.ones(20000)}
+        cyclic['self'] = cyclic
+        varpack.nested = {'layer1': {'weights': np.ones(20000), 'bias': np.zeros(10)},
+                          'layers': [np.zeros(20000), (np.arange(20000), 'name')],
+                          'cyclic': cyclic}
+        varpack.tuple_of_np_arr = (np.ones(20000), 5)
+        varpack.deep = {'a': {'b': {'c': {'d': {'e': np.ones(20000)}}}}}
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(placeholder_depth=4)
+
+            filenames = set(os.listdir(tmpdirname))
+            for var_name, key_path in [('nested', ('layer1', 'weights')), ('nested', ('layers', 0)),
+                                       ('nested', ('layers', 1, 0)), ('nested', ('cyclic', 'arr')),
+                                       ('tuple_of_np_arr', (0,))]:
+                self.assertIn(vp.placeholder_filename(var_name, key_path), filenames)
+            # arrays deeper than placeholder_depth are pickled with their container
+            self.assertNotIn(vp.placeholder_filename('deep', ('a', 'b', 'c', 'd', 'e')), filenames)
+
+            # the arrays of the saved variables are replaced with memory-mapped arrays, tuples are rebuilt
+            self.assertIsInstance(varpack.nested['layers'][1][0], np.memmap)
+            self.assertIsInstance(varpack.tuple_of_np_arr, tuple)
+            self.assertIsInstance(varpack.tuple_of_np_arr[0], np.memmap)
+
+            loaded_varpack = vp.Varpack(tmpdirname)
+            self.assertTrue(np.all(loaded_varpack.nested['layer1']['weights'] == 1))
+            self.assertTrue(np.all(loaded_varpack.nested['layers'][1][0] == np.arange(20000)))
+            self.assertEqual(loaded_varpack.nested['layers'][1][1], 'name')
+            self.assertIs(loaded_varpack.nested['cyclic']['self'], loaded_varpack.nested['cyclic'])
+            self.assertTrue(np.all(loaded_varpack.nested['cyclic']['arr'] == 1))
+            self.assertEqual(loaded_varpack.tuple_of_np_arr[1], 5)
+            self.assertTrue(np.all(loaded_varpack.deep['a']['b']['c']['d']['e'] == 1))
+
+            # the single-file format supports the same nesting
+            filename = os.path.join(tmpdirname, 'pack.vp')
+            varpack.save(filename, format='single')
+            single_file_varpack = vp.Varpack(filename)
+            self.assertTrue(np.all(single_file_varpack.nested['layers'][1][0] == np.arange(20000)))
+            self.assertIsInstance(single_file_varpack.nested['layers'][1][0], np.memmap)
+
+    def test_packed_array_dict(self):
+        varpack = vp.Varpack()
+        varpack.embeddings = {'user%d' % i: np.full(8, i, dtype=np.float32) for i in range(5000)}
+        varpack.embeddings['matrix'] = np.ones((2, 3), dtype=np.float32)
+        varpack.mixed_dtypes = {i: np.zeros(2, dtype=np.float64 if i % 2 else np.int64) for i in range(2000)}
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(max_dict_keys=1000, pack_array_dicts=True)
+            filenames = set(os.listdir(tmpdirname))
+            self.assertTrue({'embeddings.packed.npy', 'embeddings.packed-index.npy',
+                             'embeddings.packed-keys.pickle'} <= filenames)
+            self.assertNotIn('mixed_dtypes.packed.npy', filenames)
+
+            loaded_varpack = vp.Varpack(tmpdirname)
+            embeddings = loaded_varpack.embeddings
+            self.assertIsInstance(embeddings, vp.PackedArrayDict)
+            self.assertIsInstance(embeddings.data, np.memmap)
+            self.assertEqual(len(embeddings), 5001)
+            self.assertListEqual(list(embeddings)[:2], ['user0', 'user1'])
+            self.assertTrue(np.all(embeddings['user4321'] == 4321))
+            self.assertEqual(embeddings['matrix'].shape, (2, 3))
+            self.assertIn('user0', embeddings)
+            self.assertNotIn('user5000', embeddings)
+            with self.assertRaises(ValueError):
+                embeddings['user1'][0] = 0
+
+            # unchanged packed dictionaries are not rewritten (loaded packed dictionaries stay packed)
+            loaded_varpack.save(max_dict_keys=1000)
+            self.assertLess(loaded_varpack.last_save_bytes_written(), 5000)
+
+            # packed dictionaries can be saved to another folder and into a single-file pack
+            copied_varpack = loaded_varpack.save(os.path.join(tmpdirname, 'copy'))
+            self.assertTrue(np.all(vp.Varpack(os.path.join(tmpdirname, 'copy')).embeddings['user7'] == 7))
+            filename = os.path.join(tmpdirname, 'pack.vp')
+            copied_varpack.save(filename, format='single')
+            single_file_embeddings = vp.Varpack(filename).embeddings
+            self.assertIsInstance(single_file_embeddings.data, np.memmap)
+            self.assertTrue(np.all(single_file_embeddings['user7'] == 7))
+
+        # by default, dictionaries of arrays are saved as dictionaries and stay writable
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack = vp.Varpack()
+            varpack.embeddings = {'user%d' % i: np.full(8, i, dtype=np.float32) for i in range(2000)}
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save()
+            embeddings = vp.Varpack(tmpdirname).embeddings
+            self.assertIs(type(embeddings), dict)
+            embeddings['user1'][0] = 0
+            embeddings['new'] = np.zeros(8)
+
+    def test_save_async(self):
+        varpack = vp.Varpack()
+        varpack.np_arr = np.zeros(100000)
+        varpack.dict_of_np_arr = {'key1': np.ones(20000)}
+        varpack.scalar = 1
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            future = varpack.save_async()
+
+            # modifications made while saving are not part of the save
+            varpack.np_arr[:] = 1
+            varpack.dict_of_np_arr['key1'][:] = 2
+            varpack.scalar = 2
+
+            self.assertGreater(future.result(timeout=60), 0)
+            self.assertIs(future.varpack, varpack)
+            done, total = future.progress()
+            self.assertEqual(done, total)
+            self.assertGreaterEqual(total, 3)
+
+            loaded_varpack = vp.Varpack(tmpdirname)
+            self.assertTrue(np.all(loaded_varpack.np_arr == 0))
+            self.assertTrue(np.all(loaded_varpack.dict_of_np_arr['key1'] == 1))
+            self.assertEqual(loaded_varpack.scalar, 1)
+
+            # overlapping saves into the same folder are run one after the other, in order: the last one wins
+            futures = list()
+            finished = list()
+            for i in range(5):
+                varpack.scalar = 10 + i
+                futures.append(varpack.save_async())
+                futures[-1].add_done_callback(lambda f, i=i: finished.append(i))
+            for future in futures:
+                future.result(timeout=60)
+            self.assertListEqual(finished, list(range(5)))
+            self.assertTrue(np.all(vp.Varpack(tmpdirname).np_arr == 1))
+            self.assertEqual(vp.Varpack(tmpdirname).scalar, 14)
+
+            # a synchronous save waits for the queued async saves, which do not overwrite it with older snapshots
+            varpack.z = 1
+            futures = [varpack.save_async(), varpack.save_async()]
+            varpack.z = 2
+            varpack.save()
+            for future in futures:
+                future.result(timeout=60)
+            self.assertEqual(vp.Varpack(tmpdirname).z, 2)
+            varpack.scalar = 15
+            varpack.save(trust_assignments=True)  # the pack has the var_info of its last save
+            self.assertEqual(vp.Varpack(tmpdirname).z, 2)
+            self.assertEqual(vp.Varpack(tmpdirname).scalar, 15)
+
+            # with trust_assignments, arrays that were not assigned since the last save are not copied
+            loaded_varpack = vp.Varpack(tmpdirname, memory_budget=10 ** 9)  # arrays are read into memory
+            self.assertNotIsInstance(loaded_varpack.np_arr, np.memmap)
+            with mock.patch.object(vp, '_snapshot_value', wraps=vp._snapshot_value) as snapshot_value:
+                loaded_varpack.save_async(trust_assignments=True).result(timeout=60)
+            self.assertFalse(any(call.args[0] is loaded_varpack.np_arr for call in snapshot_value.call_args_list))
+            self.assertGreater(len(snapshot_value.call_args_list), 0)  # the other variables are copied
+
+            # errors are raised by result()
+            varpack.bad = lambda: None
+            with self.assertRaises(Exception):
+                varpack.save_async().result(timeout=60)
+            self.assertIn('bad', varpack.__internal__['assigned_vars'])
+
+    def test_copy_to_folder(self):
+        varpack = vp.Varpack()
+        varpack.np_arr = np.arange(100000)
+        varpack.dict_of_np_arr = {'key1': np.ones(20000)}
+        varpack.big_list = list(range(10000))
+        varpack.scalar = 1
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            folder = os.path.join(tmpdirname, 'pack')
+            varpack.set_attached_folder(folder)
+            varpack.save()
+
+            # memory-mapped arrays are copied as files, not loaded into memory, and lazy variables are not loaded
+            loaded_varpack = vp.Varpack(folder, lazy=True)
+            loaded_varpack.scalar = 2
+            copy_folder = os.path.join(tmpdirname, 'copy')
+            copied_varpack = loaded_varpack.save(copy_folder)
+            self.assertIn('big_list', copied_varpack.__internal__['lazy_vars'])
+            self.assertEqual(os.path.dirname(copied_varpack.np_arr.filename), os.path.abspath(copy_folder))
+            self.assertEqual(os.path.dirname(copied_varpack.dict_of_np_arr['key1'].filename),
+                             os.path.abspath(copy_folder))
+            self.assertEqual(os.path.dirname(loaded_varpack.np_arr.filename), os.path.abspath(folder))
+
+            reloaded_varpack = vp.Varpack(copy_folder)
+            self.assertTrue(np.all(reloaded_varpack.np_arr == np.arange(100000)))
+            self.assertTrue(np.all(reloaded_varpack.dict_of_np_arr['key1'] == 1))
+            self.assertListEqual(reloaded_varpack.big_list, list(range(10000)))
+            self.assertEqual(reloaded_varpack.scalar, 2)
+            self.assertEqual(vp.Varpack(folder).scalar, 1)
+
+            # the two packs do not share their arrays
+            copied_varpack.np_arr[0] = -1
+            self.assertEqual(loaded_varpack.np_arr[0], 0)
+
+            loaded_varpack.save_then_copy(os.path.join(tmpdirname, 'copy2'))
+            self.assertEqual(vp.Varpack(os.path.join(tmpdirname, 'copy2')).scalar, 2)
+
+            self.assertIn(vp.fastcopy.copy_file(os.path.join(folder, 'np_arr.npy'),
+                                                os.path.join(tmpdirname, 'np_arr.npy')),
+                          ['reflink', 'copy_file_range', 'sendfile', 'chunked'])
+
+    def test_detach(self):
+        varpack = vp.Varpack()
+        varpack.np_arr = np.arange(100000)
+        varpack.dict_of_np_arr = {'key1': np.ones(20000), 'key2': [np.zeros(20000)]}
+        varpack.np_arr_2d = np.asfortranarray(np.ones((300, 200)))
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save()
+            loaded_varpack = vp.Varpack(tmpdirname)
+
+            detached_varpack = loaded_varpack.detach()
+            self.assertIsNone(detached_varpack.get_attached_folder())
+            self.assertNotIsInstance(detached_varpack.np_arr, np.memmap)
+            self.assertNotIsInstance(detached_varpack.dict_of_np_arr['key2'][0], np.memmap)
+            self.assertTrue(np.all(detached_varpack.np_arr == np.arange(100000)))
+            self.assertTrue(np.all(detached_varpack.np_arr_2d == 1))
+            self.assertIsNot(detached_varpack.dict_of_np_arr, loaded_varpack.dict_of_np_arr)
+
+            # copy-on-write memory maps: modifications are kept in memory, and saved with the detached pack
+            cow_varpack = loaded_varpack.detach(mmap_mode='c')
+            self.assertIsInstance(cow_varpack.np_arr, np.memmap)
+            self.assertEqual(cow_varpack.np_arr.mode, 'c')
+            cow_varpack.np_arr[0] = -1
+            cow_varpack.dict_of_np_arr['key1'][0] = -1
+            self.assertEqual(vp.Varpack(tmpdirname).np_arr[0], 0)
+
+            cow_folder = os.path.join(tmpdirname, 'cow')
+            cow_varpack.save(cow_folder)
+            self.assertEqual(vp.Varpack(cow_folder).np_arr[0], -1)
+            self.assertEqual(vp.Varpack(cow_folder).dict_of_np_arr['key1'][0], -1)
+
+            # the same holds for packs loaded with copy-on-write memory maps
+            cow_loaded_varpack = vp.Varpack(tmpdirname, numpy_mmap_mode='c')
+            cow_loaded_varpack.np_arr[1] = -1
+            cow_loaded_varpack.save()
+            self.assertEqual(cow_loaded_varpack.np_arr[1], -1)
+            self.assertEqual(vp.Varpack(tmpdirname).np_arr[1], -1)
+
+    def test_create_and_append_array(self):
+        varpack = vp.Varpack()
+        varpack.scalar = 1
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save()
+
+            results = varpack.create_array('results', (1000, 50), dtype=np.float32)
+            self.assertIsInstance(results, np.memmap)
+            for start in range(0, 1000, 100):
+                results[start:start + 100] = start
+            varpack.results.flush()
+
+            # registered right away, no need to save
+            loaded_varpack = vp.Varpack(tmpdirname)
+            self.assertEqual(loaded_varpack.results.shape, (1000, 50))
+            self.assertEqual(loaded_varpack.results.dtype, np.float32)
+            self.assertTrue(np.all(loaded_varpack.results[150] == 100))
+            self.assertEqual(loaded_varpack.scalar, 1)
+
+            # growable arrays
+            for i in range(5):
+                varpack.append('stream', np.full((10, 3), i, dtype=np.int64))
+            varpack.append('results', np.ones((10, 50)))
+            self.assertEqual(varpack.stream.shape, (50, 3))
+            self.assertEqual(varpack.results.shape, (1010, 50))
+
+            loaded_varpack = vp.Varpack(tmpdirname)
+            self.assertEqual(loaded_varpack.stream.shape, (50, 3))
+            self.assertTrue(np.all(loaded_varpack.stream[40:] == 4))
+            self.assertTrue(np.all(loaded_varpack.results[1000:] == 1))
+            self.assertTrue(np.all(loaded_varpack.results[999] == 900))
+
+            with self.assertRaises(ValueError):
+                varpack.append('stream', np.zeros((10, 4)))
+            with self.assertRaises(ValueError):
+                varpack.append('scalar', np.zeros(10))
+
+            # saving the pack keeps the arrays in place
+            varpack.save()
+            self.assertEqual(vp.Varpack(tmpdirname).stream.shape, (50, 3))
+
+    def test_compressed_arrays(self):
+        varpack = vp.Varpack()
+        varpack.sparse = np.zeros((100000, 20))
+        varpack.sparse[::1000] = np.arange(20)
+        varpack.ints = np.arange(1000000) % 7
+        varpack.raw = np.ones(1000)
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(compression={'sparse': 'zlib', 'ints': 'lzma'})
+            self.assertLess(os.path.getsize(os.path.join(tmpdirname, 'sparse.zchunks')), varpack.sparse.nbytes / 10)
+            self.assertGreater(len(varpack.__internal__['var_info']['sparse']['compression']['chunks']), 1)
+            self.assertIn('raw.npy', os.listdir(tmpdirname))
+
+            loaded_varpack = vp.Varpack(tmpdirname)
+            sparse = loaded_varpack.sparse
+            self.assertIsInstance(sparse, vp.CompressedArray)
+            self.assertEqual(sparse.shape, (100000, 20))
+            self.assertTrue(np.array_equal(sparse[99000], np.arange(20)))
+            self.assertTrue(np.array_equal(sparse[-1000, 3:5], [3, 4]))
+            self.assertEqual(len(sparse._cache), 1)  # only the chunks that were read were decompressed
+            self.assertTrue(np.array_equal(sparse[50000:60000:1000, 1], np.ones(10)))
+            self.assertTrue(np.array_equal(sparse[[2000, 0, 98000]], varpack.sparse[[2000, 0, 98000]]))
+            self.assertTrue(np.array_equal(sparse[1000:3001], varpack.sparse[1000:3001]))
+            self.assertTrue(np.array_equal(sparse[::-5000], varpack.sparse[::-5000]))
+            self.assertTrue(np.array_equal(np.asarray(loaded_varpack.ints), varpack.ints))
+            with self.assertRaises(IndexError):
+                sparse[100000]
+
+            # unchanged compressed arrays are not rewritten, and can be copied to another folder
+            loaded_varpack.save()
+            self.assertLess(loaded_varpack.last_save_bytes_written(), 10000)
+            copied_varpack = loaded_varpack.save(os.path.join(tmpdirname, 'copy'))
+            self.assertTrue(np.array_equal(vp.Varpack(os.path.join(tmpdirname, 'copy')).sparse[99000],
+                                           np.arange(20)))
+            self.assertIsNotNone(copied_varpack)
+
+    def test_partial_read(self):
+        varpack = vp.Varpack()
+        varpack.np_arr = np.arange(100000).reshape(10000, 10)
+        varpack.dict_of_np_arr = {'key1': np.arange(20000), 'nested': {'key2': np.ones((100, 200))}}
+        varpack.embeddings = {i: np.full(4, i) for i in range(2000)}
+        varpack.sparse = np.zeros((10000, 3))
+        varpack.scalar = 1
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(compression={'sparse': 'zlib'}, pack_array_dicts=True)
+
+            self.assertTrue(np.array_equal(vp.read(tmpdirname, 'np_arr', index=5), np.arange(50, 60)))
+            self.assertTrue(np.array_equal(vp.read(tmpdirname, 'np_arr', index=(slice(10, 20, 3), 2)),
+                                           varpack.np_arr[10:20:3, 2]))
+            self.assertTrue(np.array_equal(vp.read(tmpdirname, 'np_arr', index=slice(-3, None)),
+                                           varpack.np_arr[-3:]))
+            rows = np.array([9999, 3, 3, 500])
+            self.assertTrue(np.array_equal(vp.read(tmpdirname, 'np_arr', index=rows), varpack.np_arr[rows]))
+            batch = vp.read(tmpdirname, 'np_arr', index=[slice(0, 2), slice(100, 103), slice(5, 6)])
+            self.assertEqual(len(batch), 3)
+            self.assertTrue(np.array_equal(batch[1], varpack.np_arr[100:103]))
+            self.assertTrue(np.array_equal(vp.read(tmpdirname, 'np_arr'), varpack.np_arr))
+
+            # arrays of dictionaries, packed dictionaries and compressed arrays
+            self.assertTrue(np.array_equal(vp.read(tmpdirname, 'dict_of_np_arr', key='key1', index=slice(5, 8)),
+                                           [5, 6, 7]))
+            self.assertEqual(vp.read(tmpdirname, 'dict_of_np_arr', key=['nested', 'key2'], index=(3, 4)), 1)
+            self.assertTrue(np.array_equal(vp.read(tmpdirname, 'embeddings', key=1234), np.full(4, 1234)))
+            self.assertEqual(vp.read(tmpdirname, 'sparse', index=slice(0, 5)).shape, (5, 3))
+
+            with self.assertRaises(IndexError):
+                vp.read(tmpdirname, 'np_arr', index=10000)
+            with self.assertRaises(ValueError):
+                vp.read(tmpdirname, 'scalar')
+            with self.assertRaises(KeyError):
+                vp.read(tmpdirname, 'dict_of_np_arr', key='key3')
+
+            # variables skipped during load can still be read, also from single-file packs
+            loaded_varpack = vp.Varpack(tmpdirname, skip_loading=['np_arr'])
+            self.assertTrue(np.array_equal(loaded_varpack.read('np_arr', index=7), np.arange(70, 80)))
+            filename = os.path.join(tmpdirname, 'pack.vp')
+            varpack.save(filename, format='single')
+            self.assertTrue(np.array_equal(vp.read(filename, 'np_arr', index=rows), varpack.np_arr[rows]))
+            self.assertTrue(np.array_equal(vp.read(filename, 'dict_of_np_arr', key='key1', index=[1, 2]), [1, 2]))
+
+    def test_inspect_and_binary_index(self):
+        varpack = vp.Varpack()
+        varpack.np_arr = np.ones((10, 3), dtype=np.float32)
+        varpack.dict_of_np_arr = {'key%d' % i: np.ones(20000) for i in range(3)}
+        varpack.scalar = 1
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(binary_index=True)
+            self.assertIn(vp.BINARY_INDEX_FILENAME, os.listdir(tmpdirname))
+
+            # data files are not needed to inspect a pack
+            os.remove(os.path.join(tmpdirname, 'np_arr.npy'))
+            variables = vp.Varpack.inspect(tmpdirname)
+            self.assertEqual(variables['np_arr']['kind'], 'array')
+            self.assertEqual(variables['np_arr']['shape'], (10, 3))
+            self.assertEqual(variables['np_arr']['dtype'], 'float32')
+            self.assertListEqual(variables['np_arr']['files'], ['np_arr.npy'])
+            self.assertEqual(variables['dict_of_np_arr']['num_placeholders'], 3)
+            self.assertEqual(len(variables['dict_of_np_arr']['files']), 4)
+            self.assertEqual(variables['scalar']['kind'], 'pickle')
+            self.assertListEqual(variables['scalar']['files'], [vp.MISC_VAR_FILENAME])
+
+            # the binary index is kept up to date by later saves, and ignored once varpack.json is changed by others
+            varpack.save()
+            varpack.new_var = 2
+            varpack.save()
+            self.assertIn('new_var', vp.Varpack.inspect(tmpdirname))
+            with open(os.path.join(tmpdirname, vp.JSON_FILENAME)) as f:
+                var_info = json.load(f)
+            del var_info['new_var']
+            with open(os.path.join(tmpdirname, vp.JSON_FILENAME), 'w') as f:
+                json.dump(var_info, f)
+            self.assertNotIn('new_var', vp.Varpack.inspect(tmpdirname))
+
+            filename = os.path.join(tmpdirname, 'pack.vp')
+            varpack.save(filename, format='single')
+            self.assertEqual(vp.Varpack.inspect(filename)['np_arr']['shape'], (10, 3))
+
+    def test_load_planner(self):
+        varpack = vp.Varpack()
+        varpack.small_arr = np.ones(100)
+        varpack.big_arr = np.ones(300000)
+        varpack.hot_arr = np.ones(200000)
+        varpack.seq_arr = np.ones(1000)
+        varpack.big_list = ['item %d' % i for i in range(100000)]
+        varpack.scalar = 1
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save()
+
+            hints = {'hot_arr': 'hot', 'seq_arr': 'sequential', 'big_arr': 'random'}
+            loaded = vp.Varpack(tmpdirname, memory_budget=2 * 10 ** 6, access_hints=hints, background_prefetch=True)
+            self.assertNotIsInstance(loaded.hot_arr, np.memmap)
+            self.assertNotIsInstance(loaded.small_arr, np.memmap)
+            self.assertIsInstance(loaded.seq_arr, np.memmap)
+            self.assertIsInstance(loaded.big_arr, np.memmap)
+            # the large pickled variable does not fit in the remaining budget, it is loaded on first access
+            self.assertIn('big_list', loaded.__internal__['lazy_vars'])
+            self.assertNotIn('scalar', loaded.__internal__['lazy_vars'])
+            self.assertEqual(len(loaded.big_list), 100000)
+            np.testing.assert_array_equal(loaded.hot_arr, varpack.hot_arr)
+
+            # without a budget, arrays are memory-mapped and pickled variables are loaded, as before
+            loaded = vp.Varpack(tmpdirname)
+            self.assertIsInstance(loaded.small_arr, np.memmap)
+            self.assertEqual(len(loaded.__internal__['lazy_vars']), 0)
+
+            with self.assertRaises(ValueError):
+                vp.planner.plan_load(loaded.__internal__['var_info'], access_hints={'big_arr': 'often'})
+
+    def test_pickle_as_handle(self):
+        varpack = vp.Varpack()
+        varpack.np_arr = np.arange(100000, dtype=np.float64)
+        varpack.dict_of_np_arr = {'key1': np.ones(20000)}
+        varpack.scalar = 1
+        varpack.skipped = 2
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(sep_vars=['skipped'])
+            loaded = vp.Varpack(tmpdirname, skip_loading=['skipped'])
+
+            # the pickle of a saved pack only holds its folder and loaded variables, not the arrays
+            data = pickle.dumps(loaded)
+            self.assertLess(len(data), 1000)
+            unpickled = pickle.loads(data)
+            self.assertIsInstance(unpickled.np_arr, np.memmap)
+            self.assertEqual(unpickled.np_arr.mode, 'r')
+            np.testing.assert_array_equal(unpickled.np_arr, varpack.np_arr)
+            np.testing.assert_array_equal(unpickled.dict_of_np_arr['key1'], varpack.dict_of_np_arr['key1'])
+            self.assertEqual(unpickled.scalar, 1)
+            self.assertFalse(hasattr(unpickled, 'skipped'))
+
+            # unsaved changes are pickled with the variables, including modifications in place
+            loaded.dict_of_np_arr['key2'] = [1, 2, 3]
+            self.assertListEqual(pickle.loads(pickle.dumps(loaded)).dict_of_np_arr['key2'], [1, 2, 3])
+            del loaded.dict_of_np_arr['key2']
+            self.assertLess(len(pickle.dumps(loaded)), 1000)
+            loaded.scalar = 3
+            self.assertEqual(pickle.loads(pickle.dumps(loaded)).scalar, 3)
+            self.assertGreater(len(pickle.dumps(loaded)), varpack.np_arr.nbytes)
+
+            # copies are independent of the pack and of its folder
+            saved = vp.Varpack(tmpdirname)
+            saved.list = [1, 2, 3]
+            saved.save()
+            saved.list.append(4)
+            copied = copy.deepcopy(saved)
+            self.assertListEqual(copied.list, [1, 2, 3, 4])
+            copied.dict_of_np_arr['key1'][0] = 5
+            self.assertEqual(saved.dict_of_np_arr['key1'][0], 1)
+            self.assertIs(copy.copy(saved).list, saved.list)
+
+            for processes in [False, True]:
+                results = vp.map_arrays(varpack, np.sum, names=['np_arr'], chunk_rows=30000, workers=2,
+                                        processes=processes)
+                self.assertEqual(len(results['np_arr']), 4)
+                self.assertEqual(sum(results['np_arr']), varpack.np_arr.sum())
+
+    def test_versioned_store(self):
+        varpack = vp.Varpack()
+        varpack.np_arr = np.arange(100000, dtype=np.float64)
+        varpack.dict_of_np_arr = {'key1': np.ones(20000), 'key2': np.zeros(20000)}
+        varpack.scalar = 1
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            store = vp.VersionedStore(os.path.join(tmpdirname, 'store'))
+            self.assertEqual(store.save(varpack), 'v1')
+
+            def num_blobs():
+                return sum(len(files) for _, _, files in os.walk(os.path.join(store.root, vp.versioned.BLOBS_FOLDER)))
+            blobs_v1 = num_blobs()
+
+            # only the changed variables are stored again, whether the pack is in memory or loaded from a version
+            varpack.scalar = 2
+            self.assertEqual(store.save(varpack, tag='scalar2'), 'scalar2')
+            self.assertEqual(num_blobs(), blobs_v1 + 1)
+
+            loaded = store.load('scalar2')
+            self.assertIsInstance(loaded.np_arr, np.memmap)
+            self.assertEqual(loaded.np_arr.mode, 'r')
+            loaded.dict_of_np_arr['key2'] = np.full(20000, 2.0)
+            store.save(loaded, tag='key2')
+            self.assertEqual(num_blobs(), blobs_v1 + 2)  # only the new placeholder array
+
+            manifests = store.list_versions()
+            self.assertListEqual([m['tag'] for m in manifests], ['v1', 'scalar2', 'key2'])
+            self.assertEqual(manifests[2]['parent'], 'scalar2')
+            self.assertEqual(manifests[0]['files']['np_arr.npy'], manifests[2]['files']['np_arr.npy'])
+            self.assertTrue(os.path.samefile(os.path.join(store.version_path('v1'), 'np_arr.npy'),
+                                             os.path.join(store.version_path('key2'), 'np_arr.npy')))
+
+            self.assertEqual(store.load('v1').scalar, 1)
+            self.assertEqual(store.load().scalar, 2)
+            np.testing.assert_array_equal(store.load().dict_of_np_arr['key2'], np.full(20000, 2.0))
+            np.testing.assert_array_equal(store.load('v1').dict_of_np_arr['key2'], np.zeros(20000))
+
+            # versions opened directly (with the default mode 'r+') do not write into the blobs shared by the versions
+            version = vp.Varpack(store.version_path('scalar2'))
+            self.assertEqual(version.np_arr.mode, 'c')
+            version.np_arr[0] = -1
+            version.np_arr.flush()
+            self.assertEqual(store.load('v1').np_arr[0], 0)
+            with self.assertRaises(ValueError):
+                version.append('np_arr', np.ones(10))
+
+            with self.assertRaises(ValueError):
+                store.save(varpack, tag='v1')
+
+            with self.assertRaises(ValueError):
+                store.prune()  # would remove all the versions
+            self.assertListEqual(store.prune(keep_last=1), ['v1', 'scalar2'])
+            self.assertListEqual([m['tag'] for m in store.list_versions()], ['key2'])
+            self.assertEqual(num_blobs(), len(set(store.list_versions()[0]['files'].values())))
+            np.testing.assert_array_equal(store.load().np_arr, varpack.np_arr)
+
+    def test_string_arrays(self):
+        ids = np.array(['id-%d' % i for i in range(10000)] + ['naïve', ''], dtype=object)
+        varpack = vp.Varpack()
+        varpack.ids = ids
+        varpack.raw = np.array([b'a', b'bc', b'd\x00'] * 10, dtype=object).reshape(10, 3)
+        varpack.mixed = np.array(['a', 1], dtype=object)
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(string_arrays='offsets')
+            self.assertEqual(vp.Varpack.inspect(tmpdirname)['ids']['kind'], 'strings')
+            self.assertEqual(vp.Varpack.inspect(tmpdirname)['mixed']['kind'], 'pickle')
+
+            loaded = vp.Varpack(tmpdirname)
+            self.assertIsInstance(loaded.ids, vp.StringArray)
+            self.assertIsInstance(loaded.ids.data, np.memmap)
+            self.assertEqual(loaded.ids[5], 'id-5')
+            self.assertEqual(loaded.ids[-2], 'naïve')
+            self.assertListEqual(list(loaded.ids[9998:]), ['id-9998', 'id-9999', 'naïve', ''])
+            self.assertListEqual(list(loaded.ids[[3, 1, 10000]]), ['id-3', 'id-1', 'naïve'])
+            np.testing.assert_array_equal(np.asarray(loaded.ids), ids)
+            np.testing.assert_array_equal(np.asarray(loaded.raw), varpack.raw)
+            self.assertEqual(loaded.raw[2, 2], b'd\x00')
+            self.assertListEqual(list(vp.read(tmpdirname, 'ids', index=slice(1, 3))), ['id-1', 'id-2'])
+
+            # unchanged arrays of strings are not rewritten
+            loaded.save()
+            self.assertEqual(loaded.last_save_bytes_written(), os.path.getsize(os.path.join(tmpdirname,
+                                                                                          vp.JSON_FILENAME)))
+
+            # with 'auto', arrays of short strings are converted to fixed-width strings when that is smaller
+            filename = os.path.join(tmpdirname, 'pack.vp')
+            varpack.short = np.array(['a', 'b'] * 1000, dtype=object)
+            varpack.save(filename, format='single', string_arrays='auto')
+            loaded = vp.Varpack(filename)
+            self.assertEqual(loaded.short.dtype, np.dtype('<U1'))
+            self.assertIsInstance(loaded.ids, vp.StringArray)
+            self.assertIsInstance(loaded.raw, vp.StringArray)  # numpy would strip the trailing NUL byte
+            np.testing.assert_array_equal(np.asarray(loaded.ids), ids)
+
+    def test_io_stats(self):
+        varpack = vp.Varpack()
+        varpack.np_arr = np.arange(100000)
+        varpack.dict_of_np_arr = {'key1': np.zeros(20000), 'key2': np.ones(20000)}
+        varpack.scalar = 3
+
+        finished = list()
+        vp.add_stats_hook(finished.append)
+        try:
+            with tempfile.TemporaryDirectory() as tmpdirname:
+                varpack.set_attached_folder(tmpdirname)
+                varpack.save(sep_vars={'dict_of_np_arr'})
+                save_stats = varpack.last_save_stats()
+                self.assertEqual(save_stats.operation, 'save')
+                self.assertEqual(save_stats.variables['np_arr'].kind, 'array')
+                self.assertEqual(save_stats.variables['dict_of_np_arr'].kind, 'pickle')
+                self.assertEqual(save_stats.variables['np_arr'].bytes_written,
+                                 os.path.getsize(os.path.join(tmpdirname, 'np_arr.npy')))
+                self.assertEqual(save_stats.bytes_written, varpack.last_save_bytes_written())
+                self.assertIn('write', save_stats.phase_totals())
+                self.assertIn(save_stats.slowest(1)[0][0], save_stats.variables)
+
+                loaded = vp.Varpack(tmpdirname, numpy_mmap_mode='r', memory_budget=10 ** 6)
+                load_stats = loaded.last_load_stats()
+                self.assertEqual(load_stats.operation, 'load')
+                self.assertIn('read', load_stats.variables['np_arr'].timings)
+                self.assertEqual(load_stats.variables['np_arr'].bytes_read, varpack.np_arr.nbytes)
+                self.assertIn('mmap', load_stats.variables['dict_of_np_arr'].timings)
+                self.assertListEqual([s.operation for s in finished], ['save', 'load'])
+
+                # unchanged files are counted, not rewritten
+                loaded.save()
+                self.assertEqual(loaded.last_save_stats().variables['np_arr'].files_unchanged, 1)
+                self.assertEqual(loaded.last_save_stats().variables['np_arr'].bytes_written, 0)
+
+                # progress messages are logged to the 'varpack' logger and can be silenced
+                vp.set_verbose(False)
+                try:
+                    with self.assertLogs('varpack', level='WARNING') as logs:
+                        vp.Varpack(tmpdirname)
+                        vp.logger.warning('only warnings')
+                    self.assertEqual(len(logs.output), 1)
+                finally:
+                    vp.set_verbose(True)
+        finally:
+            vp.remove_stats_hook(finished.append)
+
+    def test_columnar_tables(self):
+        records = np.zeros(1000, dtype=[('id', 'i8'), ('price', 'f4'), ('symbol', 'O')])
+        records['id'] = np.arange(1000)
+        records['price'] = np.linspace(0, 1, 1000)
+        records['symbol'] = ['s%d' % (i % 7) for i in range(1000)]
+        varpack = vp.Varpack()
+        varpack.records = records
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save(columnar_tables=True)
+            self.assertEqual(vp.Varpack.inspect(tmpdirname)['records']['kind'], 'table')
+            self.assertListEqual(vp.Varpack.inspect(tmpdirname)['records']['columns'], ['id', 'price', 'symbol'])
+
+            loaded = vp.Varpack(tmpdirname, numpy_mmap_mode='r')
+            self.assertIsInstance(loaded.records, vp.Table)
+            self.assertEqual(len(loaded.records), 1000)
+            self.assertIsInstance(loaded.records['price'], np.memmap)
+            self.assertIsInstance(loaded.records['symbol'], vp.StringArray)
+            np.testing.assert_array_equal(loaded.records.materialize(), records)
+            np.testing.assert_array_equal(vp.read(tmpdirname, 'records', key='id', index=slice(5, 8)), [5, 6, 7])
+
+            # only the selected columns are loaded
+            subset = vp.Varpack(tmpdirname, columns={'records': ['price']})
+            self.assertListEqual(subset.records.columns, ['price'])
+            with self.assertRaises(KeyError):
+                subset.records['id']
+            with self.assertRaises(ValueError):
+                vp.Varpack(tmpdirname, columns={'missing': ['price']})
+
+            # only the columns that changed are rewritten
+            loaded.save()
+            self.assertEqual(loaded.last_save_bytes_written(), os.path.getsize(os.path.join(tmpdirname,
+                                                                                          vp.JSON_FILENAME)))
+            changed = records.copy()
+            changed['price'] *= 2
+            loaded.records = changed
+            loaded.save(columnar_tables=True)
+            self.assertEqual(loaded.last_save_stats().variables['records'].files_unchanged, 4)
+            np.testing.assert_array_equal(vp.Varpack(tmpdirname).records.materialize(), changed)
+            np.testing.assert_array_equal(loaded.detach().records['price'], changed['price'])
+
+            try:
+                import pandas as pd
+            except ImportError:
+                return
+            df = pd.DataFrame({'price': np.arange(5.0), 'symbol': list('abcde'),
+                               'category': pd.Categorical(list('xyzxy'))},
+                              index=pd.Index([10, 20, 30, 40, 50], name='id'))
+            varpack.df = df
+            filename = os.path.join(tmpdirname, 'pack.vp')
+            for path, format in [(tmpdirname, 'folder'), (filename, 'single')]:
+                varpack.save(path, format=format, columnar_tables=True)
+                loaded = vp.Varpack(path)
+                self.assertIsInstance(loaded.df['price'], np.memmap)
+                pd.testing.assert_frame_equal(loaded.df.materialize(), df)
+                pd.testing.assert_frame_equal(vp.Varpack(path, columns={'df': ['symbol']}).df.materialize(),
+                                              df[['symbol']])
+
+    def test_transactional_save(self):
+        varpack = vp.Varpack()
+        varpack.np_arr = np.arange(100000)
+        varpack.scalar = 3
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            varpack.set_attached_folder(tmpdirname)
+            varpack.save()
+            mapped = vp.Varpack(tmpdirname, numpy_mmap_mode='r').np_arr
+
+            # a failed save leaves the files of the previous save intact, no staged files, and the arrays of
+            # dictionaries in place of their placeholders
+            varpack.np_arr = np.arange(100000) * 2
+            varpack.dict_of_np_arr = {'key1': np.ones(20000)}
+            varpack.unpicklable = lambda x: x
+            with self.assertRaises(Exception):
+                varpack.save(sep_vars={'unpicklable'})
+            del varpack.unpicklable
+            self.assertIs(type(varpack.dict_of_np_arr['key1']), np.ndarray)
+            self.assertTrue(np.array_equal(np.load(os.path.join(tmpdirname, 'np_arr.npy')), np.arange(100000)))
+            self.assertListEqual([f for f in os.listdir(tmpdirname) if f.endswith('.tmp')], [])
+            self.assertFalse(hasattr(vp.Varpack(tmpdirname), 'unpicklable'))
+
+            # a durable save flushes the files, memory maps of the previous version stay valid
+            varpack.save(durable=True)
+            self.assertIn('fsync', varpack.last_save_stats().variables['np_arr'].timings)
+            self.assertTrue(np.array_equal(mapped, np.arange(100000)))
+            self.assertTrue(np.array_equal(vp.Varpack(tmpdirname).np_arr, np.arange(100000) * 2))
+
+            # a save interrupted after its commit point is completed when the folder is next opened
+            varpack.np_arr = np.arange(100000) * 3
+            with mock.patch.object(vp.transaction, '_roll_forward', side_effect=OSError('interrupted')):
+                with self.assertRaises(OSError):
+                    varpack.save()
+            self.assertTrue(os.path.isfile(os.path.join(tmpdirname, vp.transaction.JOURNAL_FILENAME)))
+            self.assertTrue(np.array_equal(np.load(os.path.join(tmpdirname, 'np_arr.npy')), np.arange(100000) * 2))
+            with open(os.path.join(tmpdirname, 'scalar.pickle.tx000000000000.tmp'), 'wb') as f:
+                f.write(b'not committed')
+            self.assertTrue(np.array_equal(vp.Varpack(tmpdirname).np_arr, np.arange(100000) * 3))
+
+            # varpack.json replaces the previous one after the data files, so that it is never read with them
+            with mock.patch.object(vp.transaction.os, 'replace') as replace:
+                vp.transaction._roll_forward(tmpdirname, {f: f + '.tmp' for f in [vp.JSON_FILENAME, 'w.npy', 'a.npy',
+                                                                                  vp.BINARY_INDEX_FILENAME]})
+            self.assertListEqual([os.path.basename(call.args[1]) for call in replace.call_args_list],
+                                 ['a.npy', 'w.npy', vp.BINARY_INDEX_FILENAME, vp.JSON_FILENAME])
+            self.assertListEqual([f for f in os.listdir(tmpdirname)
+                                  if f.endswith('.tmp') or f == vp.transaction.JOURNAL_FILENAME], [])
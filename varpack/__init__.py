@@ -3,18 +3,347 @@ import pickle
 import os
 import json
 import sys
-import shutil
 import copy
+import hashlib
+import functools
+import itertools
+import time
+import mmap
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait
+
+from . import singlefile
+from . import packed
+from . import fastcopy
+from .packed import PackedArrayDict
+from . import compressed
+from .compressed import CompressedArray
+from . import partial
+from . import planner
+from . import strings
+from . import stats
+from .stats import logger, set_verbose, add_stats_hook, remove_stats_hook, IOStats
+from .strings import StringArray
+from . import tables
+from .tables import Table
+from . import transaction
 
 # min required Python 3.4
 
 MISC_VAR_FILENAME = '__misc_vars__.pickle'
 JSON_FILENAME = 'varpack.json'
+
+# binary copy of varpack.json, which is much faster to read for packs with many variables and placeholders. It records
+# the size and modification time of varpack.json it was written with, and is ignored if varpack.json has changed since
+# (e.g. edited by hand or written by an older version).
+BINARY_INDEX_FILENAME = 'varpack.index'
+JSON_INDENT_MAX_ENTRIES = 10000  # varpack.json is written without indentation for packs with more entries than this
 PICKLE_PROTOCOL = 4
+
+# separately pickled variables are pickled with protocol 5 (when available), and the buffers of at least
+# OOB_BUFFER_MIN_SIZE bytes (e.g. of numpy arrays nested anywhere in the variable) are saved out-of-band in their own
+# raw files, which are memory-mapped on load.
+OOB_PICKLE_PROTOCOL = 5
+OOB_BUFFER_MIN_SIZE = 2 ** 16
+FINGERPRINT_CHUNK_BYTES = 64 * 2 ** 20  # arrays are hashed in blocks of about this size
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)  # default number of threads used to read and write files
+
+# budget of estimate_obj_size(): containers larger than SIZE_ESTIMATE_SAMPLE_SIZE with elements of a single type are
+# estimated from a sample, and after visiting SIZE_ESTIMATE_MAX_ELEMENTS objects or spending SIZE_ESTIMATE_TIME_BUDGET
+# seconds the remaining elements of all containers are estimated from the average size of the visited ones.
+SIZE_ESTIMATE_SAMPLE_SIZE = 1000
+SIZE_ESTIMATE_MAX_ELEMENTS = 100000
+SIZE_ESTIMATE_TIME_BUDGET = 0.5
+
+# size of the header of the .npy files created by create_array(), which leaves room for the shape to grow with
+# append() and keeps the data page-aligned
+NPY_HEADER_SIZE = 4096
+APPEND_CHUNK_BYTES = 64 * 2 ** 20  # rows are appended in blocks of about this size
+MAP_CHUNK_BYTES = 64 * 2 ** 20  # arrays are split into chunks of about this size by map_arrays()
+
+# options of save() that choose how the variables are stored, and their defaults, see save()
+STORAGE_OPTIONS = {'out_of_band_buffers': True, 'placeholder_depth': 4, 'pack_array_dicts': False,
+                   'compression': None, 'string_arrays': None, 'columnar_tables': False}
 from typing import Union, Dict, List
 import typing
 
 
+def _storage_options(storage_options):
+    # the storage options of a save, with the defaults of those that are not given
+    unknown = set(storage_options) - set(STORAGE_OPTIONS)
+    if len(unknown) > 0:
+        raise TypeError('save() got unexpected keyword arguments: %s' % ', '.join(sorted(unknown)))
+    assert storage_options.get('string_arrays') in [None, 'offsets', 'auto'], \
+        "string_arrays must be None, 'offsets' or 'auto'."
+    return dict(STORAGE_OPTIONS, **storage_options)
+
+
+def _hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _run_parallel(tasks, workers=None):
+    """
+    Runs a list of functions (taking no arguments), concurrently in a thread pool if workers > 1.
+    :param tasks: list of functions.
+    :param workers: maximum number of threads. Default: DEFAULT_WORKERS.
+    :return: a (result, exception) tuple for each task, in the same order as tasks, so that errors can be reported
+             in a deterministic way regardless of which task finished first.
+    """
+    def run(task):
+        try:
+            return task(), None
+        except Exception as e:
+            return None, e
+
+    if workers is None:
+        workers = DEFAULT_WORKERS
+
+    if workers <= 1 or len(tasks) <= 1:
+        return [run(task) for task in tasks]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        return list(executor.map(run, tasks))
+
+
+# locks of the folders (and single-file packs) being saved into, see _folder_lock()
+_folder_locks = dict()
+_folder_locks_guard = threading.Lock()
+
+# SaveFuture of the save running in the current thread, see save_async()
+_save_progress = threading.local()
+
+# SaveFuture of the last save_async() into each folder: each save waits for the previous one, so that they are
+# committed in the order they were started (the folder lock alone does not guarantee an order)
+_async_saves = dict()
+_async_saves_guard = threading.Lock()
+# order of the saves of packs, a save_async() only updates its pack if no save of it was started after it
+_save_tickets = itertools.count(1)
+
+
+def _folder_lock(folder):
+    """
+    :param folder: folder or single-file pack.
+    :return: a re-entrant lock that is held while saving into folder, so that saves into the same folder (e.g. from
+             save_async()) do not overlap.
+    """
+    key = None if folder is None else os.path.abspath(folder)
+    with _folder_locks_guard:
+        if key not in _folder_locks:
+            _folder_locks[key] = threading.RLock()
+        return _folder_locks[key]
+
+
+def _wait_for_async_saves(folder):
+    """
+    Wait for the save_async() calls into folder that are running or queued, e.g. before a save into the folder, so that
+    they do not overwrite it with older snapshots afterwards. Does nothing in the thread of an async save.
+    """
+    if folder is None or getattr(_save_progress, 'future', None) is not None:
+        return
+    with _async_saves_guard:
+        future = _async_saves.get(os.path.abspath(folder))
+    if future is not None:
+        wait([future])  # each async save waits for the previous one, so all of them are done
+
+
+def _locks_save_folder(save):
+    # decorator of Varpack.save(), holds the lock of the folder being saved into (after the pending async saves)
+    @functools.wraps(save)
+    def locked_save(self, save_folder=None, *args, **kwargs):
+        folder = save_folder if save_folder is not None else self.__internal__['attached_folder']
+        _wait_for_async_saves(folder)
+        self.__internal__['save_ticket'] = next(_save_tickets)
+        with _folder_lock(folder):
+            try:
+                return save(self, save_folder, *args, **kwargs)
+            finally:
+                # a save that failed before committing its transaction leaves the files of the previous save intact
+                if folder is not None:
+                    transaction.end(folder, commit=False)
+    return locked_save
+
+
+def _with_save_progress(tasks):
+    # counts the tasks of the save running in the current thread in the progress of its SaveFuture, if any
+    future = getattr(_save_progress, 'future', None)
+    if future is None:
+        return tasks
+    future._add_files(len(tasks))
+
+    def run(task):
+        try:
+            return task()
+        finally:
+            future._file_done()
+
+    return [functools.partial(run, task) for task in tasks]
+
+
+def _snapshot_value(x, memo):
+    """
+    Copy of a variable that is not affected by later in-place modifications of its arrays and containers, see
+    save_async(). In-memory numpy arrays are copied, dicts, lists, tuples and sets are copied (recursively), other
+    objects are shared with the variable.
+    :param memo: dictionary from id of the already copied objects to their copies.
+    """
+    if id(x) in memo:
+        return memo[id(x)]
+
+    if isinstance(x, np.ndarray):
+        if isinstance(x, np.memmap) or not x.flags.writeable:
+            y = x  # memory-mapped arrays are saved from their files
+        else:
+            y = x.copy()
+    elif type(x) is dict:
+        y = dict()
+        memo[id(x)] = y
+        for k, v in x.items():
+            y[k] = _snapshot_value(v, memo)
+    elif type(x) is list:
+        y = list()
+        memo[id(x)] = y
+        y.extend(_snapshot_value(v, memo) for v in x)
+    elif type(x) in (tuple, set):
+        y = type(x)(_snapshot_value(v, memo) for v in x)
+    else:
+        y = x
+
+    memo[id(x)] = y
+    return y
+
+
+class SaveFuture(Future):
+    """
+    Future of a save running in the background, returned by Varpack.save_async(). Its result is the number of bytes
+    written by the save.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._progress_lock = threading.Lock()
+        self.files_done = 0
+        self.files_total = 0
+        self.varpack = None  # the saved pack, once the save is done
+
+    def _add_files(self, num_files):
+        with self._progress_lock:
+            self.files_total += num_files
+
+    def _file_done(self):
+        with self._progress_lock:
+            self.files_done += 1
+
+    def progress(self):
+        """
+        :return: (number of files written or found unchanged, number of files scheduled so far). The number of
+                 scheduled files grows as the save goes on, single-file packs report their progress when done.
+        """
+        with self._progress_lock:
+            return self.files_done, self.files_total
+
+
+def _copy_files(src_folder, dst_folder, filenames, hardlink=False, workers=None):
+    """
+    Copies files between folders concurrently, see fastcopy.copy_file().
+    :return: dictionary with the method used to copy each file.
+    """
+    filenames = sorted(filenames)
+    results = _run_parallel([functools.partial(fastcopy.copy_file, os.path.join(src_folder, filename),
+                                               os.path.join(dst_folder, filename), hardlink)
+                             for filename in filenames], workers)
+    methods = dict()
+    for filename, (method, error) in zip(filenames, results):
+        if error is not None:
+            raise error
+        methods[filename] = method
+    return methods
+
+
+def _pickle_with_buffers(obj, out_of_band_buffers):
+    """
+    Pickles an object, optionally keeping its large buffers out-of-band (see OOB_BUFFER_MIN_SIZE).
+    :return: the pickled bytes and the list of out-of-band pickle.PickleBuffer objects.
+    """
+    buffers = list()
+    if not out_of_band_buffers or pickle.HIGHEST_PROTOCOL < OOB_PICKLE_PROTOCOL:
+        return pickle.dumps(obj, protocol=PICKLE_PROTOCOL), buffers
+
+    def buffer_callback(buf):
+        try:
+            if buf.raw().nbytes >= OOB_BUFFER_MIN_SIZE:
+                buffers.append(buf)
+                return False  # out-of-band
+        except BufferError:  # not contiguous
+            pass
+        return True
+
+    return pickle.dumps(obj, protocol=OOB_PICKLE_PROTOCOL, buffer_callback=buffer_callback), buffers
+
+
+def _write_file_replace(path, data):
+    # write to a temporary file which then replaces path (or is staged by the transaction of the save, see
+    # transaction.py), so that memory maps of the previous file stay valid. Returns the number of bytes written.
+    tmp_path = transaction.temp_path(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        num_bytes = f.tell()
+    transaction.finish(tmp_path, path)
+    return num_bytes
+
+
+def _save_npy_replace(path, np_arr, allow_pickle=False):
+    # np.save() into a temporary file which then replaces path (or is staged, as above), so that memory maps of the
+    # previous file (including np_arr itself) stay valid. Returns the number of bytes written.
+    tmp_path = transaction.temp_path(path)
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np_arr, allow_pickle=allow_pickle)
+        num_bytes = f.tell()
+    transaction.finish(tmp_path, path)
+    return num_bytes
+
+
+def _npy_header(shape, dtype, header_size, version=(1, 0)):
+    """
+    Header of a C-ordered .npy file, padded with spaces to header_size bytes so that it can later be rewritten in place
+    with a different shape.
+    :return: the header bytes.
+    """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                                       tuple(shape))
+    preamble = np.lib.format.MAGIC_PREFIX + bytes(version)
+    length_format = '<H' if version == (1, 0) else '<I'
+    padding = header_size - len(preamble) - struct.calcsize(length_format) - len(header) - 1
+    if padding < 0:
+        raise ValueError('The shape %s does not fit in a .npy header of %d bytes.' % (tuple(shape), header_size))
+    return preamble + struct.pack(length_format, header_size - len(preamble) - struct.calcsize(length_format)) + \
+        (header + ' ' * padding + '\n').encode('latin1')
+
+
+def get_fingerprint(obj):
+    """
+    Computes a content fingerprint of a variable, used to detect whether it has changed since it was last saved.
+    Numpy arrays are hashed directly from their memory buffer (in blocks, to avoid copying large non-contiguous
+    arrays at once), other objects are hashed from their pickled representation.
+    :param obj: numpy array or any picklable object.
+    :return: fingerprint as a hex string.
+    """
+    if isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(('%s%s' % (obj.dtype.str, obj.shape)).encode())
+        if obj.ndim == 0 or obj.size == 0:
+            h.update(np.ascontiguousarray(obj).tobytes())
+        else:
+            rows_per_block = max(1, FINGERPRINT_CHUNK_BYTES // max(1, obj[0].nbytes))
+            for start in range(0, obj.shape[0], rows_per_block):
+                block = np.ascontiguousarray(obj[start:start + rows_per_block])
+                h.update(block.reshape(-1).view(np.uint8))
+        return h.hexdigest()
+
+    return _hash_bytes(pickle.dumps(obj, protocol=PICKLE_PROTOCOL))
+
+
 def mmap_var_to_memory(x):
     """
     Converts a memory-mapped numpy array, or a python dictionary with mmap values, to a regular in-memory array
@@ -25,15 +354,83 @@ def mmap_var_to_memory(x):
         y = dict()
         for k in x:
             y[k] = mmap_var_to_memory(x[k])
+    elif isinstance(x, PackedArrayDict):
+        y = PackedArrayDict(mmap_var_to_memory(x.data), mmap_var_to_memory(x.index), x.key_list)
+    elif isinstance(x, StringArray):
+        y = StringArray(mmap_var_to_memory(x.data), mmap_var_to_memory(x.offsets), x.shape, x.kind)
+    elif isinstance(x, Table):
+        y = x.map_columns(mmap_var_to_memory)
     elif type(x) is np.memmap:
-        y = np.zeros(shape=x.shape, dtype=x.dtype)
-        y[:] = x[:]
+        y = _read_memmap(x)
     else:
         y = x
 
     return y
 
 
+def _read_memmap(x):
+    # reads a memory-mapped array into memory, in blocks of about FINGERPRINT_CHUNK_BYTES so that the pages of the
+    # file can be released as it is read, and without zero-filling the new array first
+    y = np.empty_like(x, subok=False)
+    if x.ndim == 0 or x.size == 0:
+        y[...] = x
+    else:
+        rows_per_block = max(1, FINGERPRINT_CHUNK_BYTES // max(1, x[0].nbytes))
+        for start in range(0, x.shape[0], rows_per_block):
+            y[start:start + rows_per_block] = x[start:start + rows_per_block]
+    return y
+
+
+def _detach_value(x, memo, mmap_mode=None):
+    """
+    Copy of a variable that does not use the files of the pack, see Varpack.detach(). Memory-mapped arrays are read
+    into memory once (or mapped copy-on-write), other numpy arrays and dicts, lists, tuples and sets are copied, and
+    other objects are deep-copied.
+    :param memo: dictionary from id of the already copied objects to their copies.
+    :param mmap_mode: None, or 'c' to map memory-mapped arrays copy-on-write instead of reading them.
+    """
+    if id(x) in memo:
+        return memo[id(x)]
+
+    if isinstance(x, np.memmap):
+        y = None
+        # only arrays that map the whole file region (i.e. not slices) can be mapped again
+        if mmap_mode == 'c' and x.filename is not None and isinstance(x.base, mmap.mmap):
+            try:
+                y = np.memmap(x.filename, dtype=x.dtype, mode='c', offset=x.offset, shape=x.shape,
+                              order='F' if np.isfortran(x) else 'C')
+            except (ValueError, EnvironmentError):
+                y = None
+        if y is None:
+            y = _read_memmap(x)
+    elif isinstance(x, np.ndarray):
+        y = x.copy()
+    elif isinstance(x, PackedArrayDict):
+        y = PackedArrayDict(_detach_value(x.data, memo, mmap_mode), _detach_value(x.index, memo, mmap_mode),
+                            x.key_list)
+    elif isinstance(x, StringArray):
+        y = StringArray(_detach_value(x.data, memo, mmap_mode), _detach_value(x.offsets, memo, mmap_mode), x.shape,
+                        x.kind)
+    elif isinstance(x, Table):
+        y = x.map_columns(lambda values: _detach_value(values, memo, mmap_mode))
+    elif type(x) is dict:
+        y = dict()
+        memo[id(x)] = y
+        for k, v in x.items():
+            y[k] = _detach_value(v, memo, mmap_mode)
+    elif type(x) is list:
+        y = list()
+        memo[id(x)] = y
+        y.extend(_detach_value(v, memo, mmap_mode) for v in x)
+    elif type(x) in (tuple, set):
+        y = type(x)(_detach_value(v, memo, mmap_mode) for v in x)
+    else:
+        y = copy.deepcopy(x, memo)
+
+    memo[id(x)] = y
+    return y
+
+
 def get_total_obj_size(obj, seen=None, count_mmap_size=False):
     """Recursively finds size of objects, includes the size of embedded objects."""
     size = sys.getsizeof(obj)
@@ -60,38 +457,224 @@ def get_total_obj_size(obj, seen=None, count_mmap_size=False):
     return size
 
 
+class _SizeEstimationBudget:
+    # number of visited objects and time spent by estimate_obj_size(), shared by the whole recursion
+
+    def __init__(self, sample_size, max_elements, time_budget):
+        self.sample_size = sample_size
+        self.max_elements = max_elements
+        self.deadline = time.perf_counter() + time_budget
+        self.num_elements = 0
+
+    def exhausted(self):
+        # checking the time is comparatively costly, only do it every few elements
+        if self.num_elements >= self.max_elements:
+            return True
+        return self.num_elements % 256 == 0 and time.perf_counter() > self.deadline
+
+
+def _estimate_elements_size(elements, num_elements, seen, budget):
+    # estimates the total size of the elements of a container with num_elements elements (iterated by elements)
+    if num_elements > budget.sample_size:
+        sample = list(itertools.islice(elements, budget.sample_size))
+        if len({type(e) for e in sample}) == 1:
+            # large homogeneous container: extrapolate from a sample of its elements
+            return sum(_estimate_size(e, seen, budget) for e in sample) * num_elements / len(sample)
+        elements = itertools.chain(sample, elements)
+
+    size = 0
+    num_visited = 0
+    for e in elements:
+        if budget.exhausted():
+            return size + size / max(1, num_visited) * (num_elements - num_visited)
+        size += _estimate_size(e, seen, budget)
+        num_visited += 1
+    return size
+
+
+def _estimate_size(obj, seen, budget):
+    obj_id = id(obj)
+    if obj_id in seen:
+        return 0
+    seen.add(obj_id)
+    budget.num_elements += 1
+
+    if isinstance(obj, np.ndarray):
+        # sys.getsizeof() includes the data buffer only if the array owns it (not for views and memmaps)
+        size = sys.getsizeof(obj) + (0 if obj.flags.owndata and not isinstance(obj, np.memmap) else obj.nbytes)
+        if obj.dtype.hasobject:
+            size += _estimate_elements_size(iter(obj.flat), obj.size, seen, budget)
+        return size
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, complex, bool)) or obj is None:
+        return size
+
+    if isinstance(obj, dict):
+        size += _estimate_elements_size(itertools.chain.from_iterable(obj.items()), 2 * len(obj), seen, budget)
+    elif isinstance(obj, (list, tuple)) and len(obj) > budget.sample_size:
+        # sample evenly spread elements of large sequences, rather than the first ones
+        sample = obj[::len(obj) // budget.sample_size]
+        if len({type(e) for e in sample}) == 1:
+            size += sum(_estimate_size(e, seen, budget) for e in sample) * len(obj) / len(sample)
+        else:
+            size += _estimate_elements_size(iter(obj), len(obj), seen, budget)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += _estimate_elements_size(iter(obj), len(obj), seen, budget)
+    elif hasattr(obj, '__dict__'):
+        size += _estimate_size(obj.__dict__, seen, budget)
+    return size
+
+
+def estimate_obj_size(obj, sample_size=None, max_elements=None, time_budget=None):
+    """
+    Estimates the total in-memory size of an object, including the size of the objects it contains, similarly to
+    get_total_obj_size() but in bounded time: numpy arrays (including memmaps), strings and bytes are sized in O(1),
+    large containers whose elements are all of the same type are estimated from a sample, and once the element or
+    time budget is exhausted the remaining elements are extrapolated from the average size of the visited ones.
+    :param obj: object to size.
+    :param sample_size: number of elements sampled from large homogeneous containers.
+                        Default: SIZE_ESTIMATE_SAMPLE_SIZE.
+    :param max_elements: maximum number of objects to visit. Default: SIZE_ESTIMATE_MAX_ELEMENTS.
+    :param time_budget: maximum time in seconds to spend on visiting objects. Default: SIZE_ESTIMATE_TIME_BUDGET.
+    :return: estimated size in bytes.
+    """
+    budget = _SizeEstimationBudget(SIZE_ESTIMATE_SAMPLE_SIZE if sample_size is None else sample_size,
+                                   SIZE_ESTIMATE_MAX_ELEMENTS if max_elements is None else max_elements,
+                                   SIZE_ESTIMATE_TIME_BUDGET if time_budget is None else time_budget)
+    return int(_estimate_size(obj, set(), budget))
+
+
+def _find_in_containers(obj, predicate, max_depth, max_keys, key_path=(), visited=None):
+    """
+    Finds the values matching predicate inside nested dicts, lists and tuples.
+    :param obj: object to search.
+    :param predicate: function called with each value.
+    :param max_depth: maximum number of nested containers to go through.
+    :param max_keys: containers with at least this number of elements are not searched.
+    :return: list of (key path, value) tuples, where key path is the tuple of keys/indices leading to the value.
+    """
+    if visited is None:
+        visited = set()
+
+    found = list()
+    if len(key_path) >= max_depth or type(obj) not in (dict, list, tuple) or len(obj) >= max_keys or \
+            id(obj) in visited:  # also prevents infinite recursion on cyclic references
+        return found
+    visited.add(id(obj))
+
+    for k, v in (obj.items() if type(obj) is dict else enumerate(obj)):
+        if predicate(v):
+            found.append((key_path + (k,), v))
+        else:
+            found.extend(_find_in_containers(v, predicate, max_depth, max_keys, key_path + (k,), visited))
+    return found
+
+
+def _replace_in_containers(obj, replacements, copy_containers=False, depth=0):
+    """
+    Replaces values inside nested dicts, lists and tuples, e.g. found by _find_in_containers().
+    :param obj: object to modify.
+    :param replacements: a dictionary with key paths as keys and new values as values.
+    :param copy_containers: copy the dicts and lists leading to the replaced values instead of modifying them in place.
+    :return: obj, or a new object if obj is a tuple (or if copy_containers).
+    """
+    children = dict()
+    for key_path, value in replacements.items():
+        children.setdefault(key_path[depth], dict())[key_path] = value
+
+    is_tuple = type(obj) is tuple
+    if is_tuple or copy_containers:
+        obj = list(obj) if type(obj) is not dict else dict(obj)
+
+    for k, child_replacements in children.items():
+        if (k,) == next(iter(child_replacements))[depth:]:
+            obj[k] = child_replacements[next(iter(child_replacements))]
+        else:
+            obj[k] = _replace_in_containers(obj[k], child_replacements, copy_containers, depth + 1)
+
+    return tuple(obj) if is_tuple else obj
+
+
+def _key_repr(key_path):
+    # readable and deterministic representation of the keys leading to a value inside a variable, e.g. "['key1']"
+    return ''.join('[%r]' % k for k in key_path)
+
+
+def placeholder_filename(var_name, key_path, used_filenames=None):
+    """
+    Deterministic name of the .npy file of a numpy array placeholder, so that re-saving a variable in a new process
+    reuses the files of the previous save. Unlike the built-in hash() of strings, it does not change between processes.
+    :param var_name: name of the variable.
+    :param key_path: tuple of the keys leading to the array inside the variable.
+    :param used_filenames: file names already in use, a suffix is added to the name in the (unlikely) case of a
+                           collision.
+    :return: file name.
+    """
+    digest = hashlib.blake2b(_key_repr(key_path).encode('utf-8'), digest_size=8).hexdigest()
+    filename = '%s-%s.npy' % (var_name, digest)
+    suffix = 1
+    while used_filenames is not None and filename in used_filenames:
+        filename = '%s-%s-%d.npy' % (var_name, digest, suffix)
+        suffix += 1
+    return filename
+
+
 class NumpyArrayPlaceholder:
 
-    def __init__(self, np_arr=None, save_folder=None, var_name=None, key_hash=None):
+    def __init__(self, np_arr=None, save_folder=None, var_name=None, key_hash=None, filename=None):
+        """
+        Saves a numpy array into its own .npy file, to be put in place of the array in the pickled variable.
+        :param np_arr: array to save. Memory-mapped arrays are not rewritten, their file is used (and copied if it is
+                       not in save_folder).
+        :param save_folder: folder to save into.
+        :param var_name: name of the variable that contains the array.
+        :param key_hash: used to name the file when filename is not given (deprecated).
+        :param filename: name of the .npy file, see placeholder_filename().
+        """
+
+        self.filename = None
+        self.bytes_written = 0  # number of bytes written to save_folder when creating the placeholder
 
         if np_arr is not None:
 
-            # if the variable is numpy mmapped
-            if isinstance(np_arr, np.memmap):
+            # if the variable is numpy mmapped (copy-on-write memory maps may have been modified in memory only)
+            if isinstance(np_arr, np.memmap) and np_arr.mode != 'c':
                 np_arr.flush()
                 try:
                     dir_name = os.path.dirname(np_arr.filename)
                     self.filename = os.path.basename(np_arr.filename)
 
-                    if dir_name != save_folder:  # the mmap file is in a different directory than where we are saving
-                        shutil.copyfile(np_arr.filename, os.path.join(save_folder, os.path.basename(np_arr.filename)))
+                    # the mmap file is in a different directory than where we are saving
+                    if os.path.abspath(dir_name) != os.path.abspath(save_folder):
+                        fastcopy.copy_file(np_arr.filename, os.path.join(save_folder, self.filename))
+                        self.bytes_written = os.path.getsize(np_arr.filename)
 
                     return
                 except TypeError:  # if encountered with problems, copy into memory and save
-                    print('Converting a mmaped array with no associated file into regular numpy array.')
+                    logger.warning('Converting a mmaped array with no associated file into regular numpy array.')
                     np_arr_mem = np.zeros(shape=np_arr.shape, dtype=np_arr.dtype)
                     np_arr_mem[:] = np_arr[:]
                     np_arr = np_arr_mem
 
-            filename = os.path.join(save_folder, var_name + str(key_hash) + '.npy')
+            if filename is None:
+                filename = var_name + str(key_hash) + '.npy'
+            filename = os.path.join(save_folder, filename)
             try:
                 # need to allow pickle here since no other way to save_copy mixed numpy and Python objects
-                np.save(filename, np_arr, allow_pickle=True)
+                self.bytes_written = _save_npy_replace(filename, np_arr, allow_pickle=True)
                 self.filename = os.path.basename(filename)
             except EnvironmentError:
-                print('Failed in saving numpy placeholder file:', filename)
+                logger.error('Failed in saving numpy placeholder file: %s', filename)
                 self.filename = None  # means it was not successful
 
+    def __getstate__(self):
+        # bytes_written only describes the save that created the placeholder, do not pickle it so that unchanged
+        # dictionaries keep the same fingerprint between saves.
+        state = self.__dict__.copy()
+        state.pop('bytes_written', None)
+        return state
+
     def load(self, load_folder, mmap_mode):
 
         # need to allow pickle here since no other way to save_copy mixed numpy and Python objects
@@ -101,14 +684,14 @@ class NumpyArrayPlaceholder:
             np_arr = np.load(full_filename, allow_pickle=True, mmap_mode=mmap_mode)
             return np_arr
         except:
-            print('Could not memory map file:', full_filename)
+            logger.warning('Could not memory map file: %s', full_filename)
             if mmap_mode is not None:
                 try:
                     np_arr = np.load(full_filename, allow_pickle=True, mmap_mode=None)
-                    print('Loaded it all in memory instead.')
+                    logger.warning('Loaded it all in memory instead.')
                     return np_arr
                 except:
-                    print('Also failed to load it all in memory.')
+                    logger.error('Also failed to load it all in memory.')
                     raise
                     return self
 
@@ -118,7 +701,7 @@ class Varpack:
     def __init__(self, attached_folder=None, **kwargs):
         """
         Initiate Varpack class instance. Optionally attach it to a folder and load the data.
-        :param attached_folder: attached/load folder.
+        :param attached_folder: attached/load folder, or single-file pack.
         :param kwargs: key-value arguments passed to load()
         """
         self.__internal__ = dict()
@@ -131,54 +714,707 @@ class Varpack:
         self.__internal__['skipped_loading_vars'] = set()
         self.__internal__['skip_saving_vars'] = set()
 
+        # variables that have been assigned (or deleted) since the last save/load
+        self.__internal__['assigned_vars'] = set()
+        self.__internal__['last_save_bytes_written'] = 0
+        self.__internal__['last_save_stats'] = None  # IOStats of the last save and load, see stats.py
+        self.__internal__['last_load_stats'] = None
+
+        # variables that have not been loaded yet during a lazy load, with the file they are saved in
+        self.__internal__['lazy_vars'] = dict()
+
+        # estimated sizes of the variables during the last save, see _estimate_var_size()
+        self.__internal__['size_cache'] = dict()
+
+        # 'folder' for a folder of .npy and .pickle files, or 'single' for a single-file pack (see singlefile.py).
+        # the segments of a single-file pack are indexed by the file names the variables would have in a folder.
+        self.__internal__['format'] = 'folder'
+        self.__internal__['single_file_segments'] = None
+
+        # ticket of the newest save whose var_info the pack has, see save_async()
+        self.__internal__['save_ticket'] = 0
+
         if attached_folder is not None:
             # load if json file exists, otherwise attach to it
-            if os.path.isfile(os.path.join(attached_folder, JSON_FILENAME)):
-                print('Loading from ', attached_folder)
+            if os.path.isfile(os.path.join(attached_folder, JSON_FILENAME)) or \
+                    singlefile.is_single_file_pack(attached_folder):
+                logger.info('Loading from %s', attached_folder)
                 self.load(load_folder=attached_folder, **kwargs)
             else:
                 self.__internal__['attached_folder'] = attached_folder
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name != '__internal__':
+            self.__internal__['assigned_vars'].add(name)
+            self.__internal__['lazy_vars'].pop(name, None)
+
+    def __delattr__(self, name):
+        if name in self.__internal__['lazy_vars']:
+            del self.__internal__['lazy_vars'][name]
+        else:
+            object.__delattr__(self, name)
+        self.__internal__['assigned_vars'].add(name)
+
+    def __getattr__(self, name):
+        # only called when the regular attribute lookup fails: load lazily-loaded variables on first access
+        internal = self.__dict__.get('__internal__')
+        if internal is not None and name in internal.get('lazy_vars', ()):
+            self.prefetch([name])
+            return self.__dict__[name]
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+    def __dir__(self):
+        return list(super().__dir__()) + list(self.__internal__.get('lazy_vars', ()))
+
+    def _loaded_var_names(self):
+        return [v for v in vars(self) if v != '__internal__'] + list(self.__internal__['lazy_vars'])
+
+    def __reduce_ex__(self, protocol):
+        # a pack whose variables are all saved in its attached folder, unchanged, is pickled as a handle: the folder
+        # and the names of the loaded variables. It is re-attached when unpickled (e.g. in the workers of a process
+        # pool) with numpy_mmap_mode='r', so that all the processes share the page cache of the arrays instead of each
+        # one receiving a copy. Packs with unsaved changes (including in-place modifications) are pickled with their
+        # variables.
+        attached_folder = self.__internal__['attached_folder']
+        var_info = self.__internal__['var_info']
+        loaded_vars = self._loaded_var_names()
+        if attached_folder is None or len(self.__internal__['assigned_vars']) > 0 or \
+                any(v not in var_info or v in self.__internal__['skip_saving_vars'] for v in loaded_vars) or \
+                any(not self._is_var_saved(v) for v in vars(self) if v != '__internal__'):
+            return super().__reduce_ex__(protocol)
+        return _reattach, (attached_folder, sorted(set(var_info) - set(loaded_vars)))
+
+    def __copy__(self):
+        # copies are not affected by __reduce_ex__(): a shallow copy shares the variables
+        varpack = object.__new__(type(self))
+        varpack.__dict__.update(self.__dict__)
+        return varpack
+
+    def __deepcopy__(self, memo):
+        # an independent copy of the variables (and of the state of the pack), never a handle re-attached to the
+        # folder
+        varpack = object.__new__(type(self))
+        memo[id(self)] = varpack
+        for name, value in self.__dict__.items():
+            varpack.__dict__[name] = copy.deepcopy(value, memo)
+        return varpack
+
+    def _is_var_saved(self, var_name):
+        # whether a loaded variable is the same as when it was saved into the attached folder, from its fingerprint.
+        # Memory-mapped arrays (modified in their file, if at all) and read-only proxies are not hashed.
+        info = self.__internal__['var_info'][var_name]
+        value = self.__dict__[var_name]
+        if _is_shared_value(value):
+            return True
+        if 'fingerprint' not in info:
+            return False
+        if info.get('uses_numpy_placeholders', False):
+            # the variable was fingerprinted with its arrays replaced by placeholders, see save()
+            if 'placeholders' not in info:
+                return False
+            replacements = dict()
+            for key_path, np_arr in _find_in_containers(value, lambda x: isinstance(x, np.ndarray),
+                                                        info.get('placeholder_depth', 1),
+                                                        info.get('placeholder_max_keys', 1000)):
+                record = info['placeholders'].get(_key_repr(key_path))
+                if record is None:
+                    continue
+                if not _is_shared_value(np_arr) and get_fingerprint(np_arr) != record.get('fingerprint'):
+                    return False
+                placeholder = NumpyArrayPlaceholder()
+                placeholder.filename = record['filename']
+                replacements[key_path] = placeholder
+            if len(replacements) != len(info['placeholders']):
+                return False
+            value = _replace_in_containers(value, replacements, copy_containers=True)
+
+        if isinstance(value, np.ndarray) and info.get('filename', '').endswith('.npy'):
+            return get_fingerprint(value) == info['fingerprint']
+        try:
+            if info.get('filename') == MISC_VAR_FILENAME:
+                return get_fingerprint(value) == info['fingerprint']
+            # separate pickle files are fingerprinted with their out-of-band buffers, if any, see save()
+            for out_of_band_buffers in [True, False]:
+                pickled, buffers = _pickle_with_buffers(value, out_of_band_buffers)
+                buffer_fingerprints = ''.join(_hash_bytes(buf.raw()) for buf in buffers)
+                if _hash_bytes(pickled + buffer_fingerprints.encode()) == info['fingerprint']:
+                    return True
+        except Exception:  # e.g. not picklable anymore
+            pass
+        return False
+
     def get_attached_folder(self):
         return self.__internal__['attached_folder']
 
-    def detach(self):
-        # loads all the variables into memory and detaches from the disk folder. This enables saving it somewhere else.
+    def last_save_bytes_written(self):
+        """
+        :return: number of bytes written to disk by the last call to save().
+        """
+        return self.__internal__['last_save_bytes_written']
+
+    def last_save_stats(self):
+        """
+        :return: IOStats of the last call to save() (see stats.py), or None.
+        """
+        return self.__internal__['last_save_stats']
+
+    def last_load_stats(self):
+        """
+        :return: IOStats of the last load, or None.
+        """
+        return self.__internal__['last_load_stats']
+
+    @staticmethod
+    def _var_info_files(var_info):
+        # all the files used by the variables in var_info
+        files = {MISC_VAR_FILENAME}
+        for info in var_info.values():
+            if 'filename' in info:
+                files.add(info['filename'])
+            for record in info.get('placeholders', dict()).values():
+                files.add(record['filename'])
+            for record in info.get('oob_buffers', list()):
+                files.add(record['filename'])
+            files.update(info.get('packed', dict()).values())
+            if 'strings' in info:
+                files.add(info['strings']['offsets'])
+            for record in info.get('table', dict()).get('columns', list()):
+                if 'filename' in record:
+                    files.add(record['filename'])
+                if 'strings' in record:
+                    files.add(record['strings']['offsets'])
+        return files
+
+    @staticmethod
+    def _remove_files(folder, filenames):
+        for filename in sorted(filenames):
+            try:
+                os.remove(os.path.join(folder, filename))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _write_json(folder, var_info, binary_index=None):
+        # writes varpack.json and optionally its binary index (see BINARY_INDEX_FILENAME), returns their size. By
+        # default, the binary index is written if the folder already has one.
+        num_entries = len(var_info) + sum(len(info.get('placeholders', ())) for info in var_info.values())
+        json_path = os.path.join(folder, JSON_FILENAME)
+        tmp_path = transaction.temp_path(json_path)
+        with open(tmp_path, 'w') as outfile:
+            json.dump(var_info, outfile, indent=4 if num_entries <= JSON_INDENT_MAX_ENTRIES else None)
+        # the binary index records the stat of varpack.json, which is the same once the temporary file is renamed
+        json_stat = os.stat(tmp_path)
+        transaction.finish(tmp_path, json_path)
+        num_bytes = json_stat.st_size
+
+        index_path = os.path.join(folder, BINARY_INDEX_FILENAME)
+        if binary_index is None:
+            binary_index = os.path.isfile(index_path)
+        if binary_index:
+            # round-trip through json so that var_info is the same as when varpack.json is read (e.g. lists for shapes)
+            index = {'json_stat': [json_stat.st_size, json_stat.st_mtime_ns],
+                     'var_info': json.loads(json.dumps(var_info))}
+            pickled = pickle.dumps(index, protocol=PICKLE_PROTOCOL)
+            _write_file_replace(index_path, pickled)
+            num_bytes += len(pickled)
+        elif os.path.isfile(index_path):
+            os.remove(index_path)
+        return num_bytes
+
+    @staticmethod
+    def _read_json(folder):
+        # reads the var_info of varpack.json, from its binary index when it is up to date
+        json_path = os.path.join(folder, JSON_FILENAME)
+        json_stat = os.stat(json_path)
+        try:
+            with open(os.path.join(folder, BINARY_INDEX_FILENAME), 'rb') as f:
+                index = pickle.load(f)
+            if index['json_stat'] == [json_stat.st_size, json_stat.st_mtime_ns]:
+                return index['var_info']
+        except (EnvironmentError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+            pass
+
+        with open(json_path, 'r') as json_file:
+            return json.load(json_file)
+
+    @staticmethod
+    def _storage_kind(info):
+        # how a variable is stored: 'array', 'pickle', 'packed', 'compressed', 'strings' or 'table'
+        if 'table' in info:
+            return 'table'
+        if 'compression' in info:
+            return 'compressed'
+        if 'packed' in info:
+            return 'packed'
+        if 'strings' in info:
+            return 'strings'
+        if os.path.splitext(info.get('filename', ''))[1] == '.npy':
+            return 'array'
+        return 'pickle'
+
+    @staticmethod
+    def inspect(folder):
+        """
+        Describe the variables of a pack from its index only, without reading any data file.
+        :param folder: folder or single-file pack.
+        :return: a dictionary with a dictionary for each variable name, with its kind ('array', 'pickle',
+                 'packed', 'compressed', 'strings' or 'table'), estimated size in memory (in bytes), shape and dtype
+                 (of arrays), number of keys (of packed dictionaries), number of numpy placeholders (of pickled
+                 variables), number of rows and column labels (of tables, as strings) and the list of its files (or
+                 segments of a single-file pack).
+        """
+        varpack = Varpack()
+        var_info = varpack._read_index(folder)
+
+        variables = dict()
+        for name, info in var_info.items():
+            kind = Varpack._storage_kind(info)
+
+            files = Varpack._var_info_files({name: info}) - {MISC_VAR_FILENAME}
+            if 'filename' in info:
+                files.add(info['filename'])
+            variables[name] = {'kind': kind, 'size': info.get('size'), 'files': sorted(files)}
+            for key in ['shape', 'dtype', 'num_keys']:
+                if key in info:
+                    variables[name][key] = tuple(info[key]) if key == 'shape' else info[key]
+            if kind == 'pickle':
+                variables[name]['num_placeholders'] = len(info.get('placeholders', ()))
+            if kind == 'table':
+                variables[name]['num_rows'] = info['table']['num_rows']
+                variables[name]['columns'] = list(info['table']['labels'])
+        return variables
+
+    def _check_folder_format(self, operation):
+        assert self.__internal__['attached_folder'] is not None, 'attached folder has not yet been set'
+        if self.__internal__['format'] != 'folder':
+            raise ValueError('%s is only supported by packs saved in a folder.' % operation)
+        if versioned.is_version_folder(self.__internal__['attached_folder']):
+            raise ValueError('%s would modify files shared by the versions of a VersionedStore.' % operation)
+
+    def create_array(self, name, shape, dtype=np.float64):
+        """
+        Create a numpy array variable directly as a .npy file in the attached folder, without allocating it in memory.
+        The variable is a writable memory-mapped array (initialized with zeros) that can be filled in blocks, and is
+        registered in varpack.json right away. Rows can be added later with append().
+        :param name: name of the variable.
+        :param shape: shape of the array.
+        :param dtype: dtype of the array (not an object dtype).
+        :return: the memory-mapped array.
+        """
+        self._check_folder_format('create_array()')
+        dtype = np.dtype(dtype)
+        if dtype.hasobject:
+            raise ValueError('Arrays of object dtype cannot be memory-mapped.')
+        shape = tuple(int(x) for x in np.atleast_1d(shape))
+
+        folder = self.__internal__['attached_folder']
+        filename = name + '.npy'
+        with _folder_lock(folder):
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, filename)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(_npy_header(shape, dtype, NPY_HEADER_SIZE))
+                # the file is extended without writing the data, which stays sparse until it is filled
+                f.truncate(NPY_HEADER_SIZE + int(np.prod(shape, dtype=np.int64)) * dtype.itemsize)
+            os.replace(path + '.tmp', path)
+
+            np_arr = np.load(path, mmap_mode='r+')
+            self.__setattr__(name, np_arr)
+            self.__internal__['var_info'][name] = {'size': np_arr.nbytes, 'filename': filename,
+                                                   'shape': np_arr.shape, 'dtype': str(np_arr.dtype)}
+            self._write_json(folder, self.__internal__['var_info'])
+        return np_arr
+
+    def append(self, name, rows):
+        """
+        Append rows to a numpy array variable along its first axis, by extending its .npy file in the attached folder
+        and rewriting the shape in its header in place. The variable is created (with create_array()) if it does not
+        exist. Memory-mapped views of the array from before the append stay valid, but do not include the new rows.
+        :param name: name of the variable, a memory-mapped array of the attached folder, e.g. created with
+                     create_array(). Arrays saved by save() can only be appended to while their shape fits in their
+                     .npy header.
+        :param rows: array with the rows to append, of the same dtype (or castable to it) and with the same shape
+                     except for the first axis.
+        :return: the memory-mapped array with the appended rows.
+        """
+        self._check_folder_format('append()')
+        folder = self.__internal__['attached_folder']
+        rows = np.asarray(rows)
+
+        with _folder_lock(folder):
+            if name not in vars(self):
+                self.create_array(name, (0,) + rows.shape[1:], rows.dtype)
+
+            np_arr = getattr(self, name)
+            if not isinstance(np_arr, np.memmap) or np_arr.mode == 'c' or np_arr.filename is None or \
+                    os.path.abspath(np_arr.filename) != os.path.abspath(os.path.join(folder, name + '.npy')):
+                raise ValueError('Variable %s is not an array memory-mapped from the attached folder '
+                                 '(with mode r+ or r).' % name)
+            np_arr.flush()
+
+            path = os.path.join(folder, name + '.npy')
+            with open(path, 'r+b') as f:
+                version, shape, fortran_order, dtype, header_size = partial.read_npy_header(f)
+                if fortran_order and len(shape) > 1:
+                    raise ValueError('Cannot append rows to the Fortran-ordered array %s.' % name)
+                if len(shape) == 0 or rows.shape[1:] != shape[1:]:
+                    raise ValueError('Cannot append rows of shape %s to array %s of shape %s.'
+                                     % (rows.shape, name, shape))
+                rows = rows.astype(dtype, copy=False)
+                new_shape = (shape[0] + rows.shape[0],) + shape[1:]
+                new_header = _npy_header(new_shape, dtype, header_size, version)
+
+                # the data is written before the header, so that the array is still valid if the append fails
+                f.seek(header_size + int(np.prod(shape, dtype=np.int64)) * dtype.itemsize)
+                if rows.size > 0:
+                    rows_per_block = max(1, APPEND_CHUNK_BYTES // max(1, rows[0].nbytes))
+                    for start in range(0, rows.shape[0], rows_per_block):
+                        f.write(np.ascontiguousarray(rows[start:start + rows_per_block]).reshape(-1).view(np.uint8))
+                f.flush()
+                f.seek(0)
+                f.write(new_header)
+
+            np_arr = np.load(path, mmap_mode=np_arr.mode)
+            self.__setattr__(name, np_arr)
+            var_info = self.__internal__['var_info'].setdefault(name, {'filename': name + '.npy'})
+            var_info.update({'size': np_arr.nbytes, 'shape': np_arr.shape, 'dtype': str(np_arr.dtype)})
+            var_info.pop('fingerprint', None)
+            self._write_json(folder, self.__internal__['var_info'])
+        return np_arr
+
+    def gc(self, dry_run=False):
+        """
+        Remove the .npy, .pickle, .bin and .zchunks files of the attached folder that are not used by any variable of
+        the pack, e.g. left over by previous saves. Packs that were saved before placeholder files were recorded in
+        varpack.json are left untouched, since their placeholder files cannot be told apart from unused ones.
+        :param dry_run: only return the files that would be removed.
+        :return: list of the removed files.
+        """
+        folder = self.__internal__['attached_folder']
+        assert folder is not None, 'attached folder has not yet been set'
+        if self.__internal__['format'] == 'single':
+            return []  # single-file packs are rewritten as a whole on save
+        _wait_for_async_saves(folder)
+
+        var_info = self.__internal__['var_info']
+        for v in var_info:
+            if var_info[v].get('uses_numpy_placeholders', False) and 'placeholders' not in var_info[v]:
+                logger.warning('Variable %s has unrecorded placeholder files, skipping garbage collection.', v)
+                return []
+
+        used_files = self._var_info_files(var_info)
+        unused_files = sorted(f for f in os.listdir(folder)
+                              if os.path.splitext(f)[1] in ('.npy', '.pickle', '.bin', '.zchunks') and
+                              f not in used_files)
+        if not dry_run:
+            self._remove_files(folder, unused_files)
+        return unused_files
+
+    def _estimate_var_size(self, var_name, obj, size_cache, trust_assignments=False):
+        # with trust_assignments, the size estimated during the previous save is reused if the variable has not been
+        # re-assigned since and is still the same object with the same number of elements. Otherwise an object
+        # modified in place (e.g. a dict with a new large value) could keep its previous size, which decides whether
+        # it is saved in a separate file.
+        try:
+            num_elements = len(obj)
+        except TypeError:
+            num_elements = None
+        key = (id(obj), type(obj).__name__, num_elements)
+
+        prev_key, size = self.__internal__['size_cache'].get(var_name, (None, None))
+        if not trust_assignments or prev_key != key or var_name in self.__internal__['assigned_vars'] or \
+                isinstance(obj, np.ndarray):
+            size = estimate_obj_size(obj)
+
+        size_cache[var_name] = (key, size)
+        return size
+
+    @staticmethod
+    def _is_file_current(prev_info, filename, fingerprint, save_folder):
+        # whether the file from the previous save can be kept as is instead of being rewritten
+        return fingerprint is not None and prev_info.get('fingerprint') == fingerprint and \
+            prev_info.get('filename') == filename and os.path.isfile(os.path.join(save_folder, filename))
+
+    def detach(self, mmap_mode=None):
+        """
+        Copy of the pack that is not attached to a folder, e.g. to save it somewhere else. Memory-mapped arrays are
+        read into memory (once, in blocks), other arrays and containers are copied and other objects are deep-copied.
+        :param mmap_mode: None to read memory-mapped arrays into memory, or 'c' to map them copy-on-write instead of
+                          reading them: modifications stay in memory and the files are not modified, but the files
+                          must not be modified (e.g. by saving the original pack) while the detached pack is in use.
+        :return: the detached pack (or the pack itself if it is not attached).
+        """
         if self.__internal__['attached_folder'] is None:   # already detached
             return self
+        assert mmap_mode in [None, 'c'], "mmap_mode must be None or 'c'."
+        _wait_for_async_saves(self.__internal__['attached_folder'])
 
         # loads everything into memory and sets attached_folder to None
-        all_vars = vars(self)
+        self.prefetch()
 
-        detached_self = copy.deepcopy(self)
-        detached_self.__internal__['attached_folder'] = None
+        detached_self = Varpack()
+        for key in ['numpy_mmap_mode', 'skipped_loading_vars', 'skip_saving_vars', 'assigned_vars']:
+            detached_self.__internal__[key] = copy.deepcopy(self.__internal__[key])
 
-        for var_name in all_vars:
-            v = mmap_var_to_memory(getattr(detached_self, var_name))
-            setattr(detached_self, var_name, v)
+        memo = dict()
+        for var_name, value in vars(self).items():
+            if var_name != '__internal__':
+                object.__setattr__(detached_self, var_name, _detach_value(value, memo, mmap_mode))
 
         return detached_self
 
+    def _copy_value_to(self, x, src_folder, dst_folder, copied_files, memo):
+        # copy of a variable for _copy_to_folder(): arrays memory-mapped from the copied files of src_folder are
+        # memory-mapped from their copies in dst_folder, other numpy arrays and dicts, lists, tuples and sets are
+        # copied, and other objects are deep-copied.
+        if id(x) in memo:
+            return memo[id(x)]
+
+        if isinstance(x, np.memmap):
+            y = None
+            if x.filename is not None and os.path.basename(x.filename) in copied_files and \
+                    os.path.abspath(os.path.dirname(x.filename)) == os.path.abspath(src_folder):
+                try:
+                    y = np.load(os.path.join(dst_folder, os.path.basename(x.filename)),
+                                mmap_mode=self.__internal__['numpy_mmap_mode'])
+                    if not (isinstance(y, np.memmap) and y.shape == x.shape and y.dtype == x.dtype and
+                            y.offset == x.offset):  # e.g. a slice of the memory-mapped array
+                        y = None
+                except (ValueError, EnvironmentError):
+                    y = None
+            if y is None:
+                y = np.array(x)
+        elif isinstance(x, np.ndarray):
+            y = x.copy()
+        elif isinstance(x, PackedArrayDict):
+            y = PackedArrayDict(self._copy_value_to(x.data, src_folder, dst_folder, copied_files, memo),
+                                self._copy_value_to(x.index, src_folder, dst_folder, copied_files, memo), x.key_list)
+        elif isinstance(x, StringArray):
+            y = StringArray(self._copy_value_to(x.data, src_folder, dst_folder, copied_files, memo),
+                            self._copy_value_to(x.offsets, src_folder, dst_folder, copied_files, memo), x.shape, x.kind)
+        elif isinstance(x, Table):
+            y = x.map_columns(lambda values: self._copy_value_to(values, src_folder, dst_folder, copied_files, memo))
+        elif type(x) is dict:
+            y = dict()
+            memo[id(x)] = y
+            for k, v in x.items():
+                y[k] = self._copy_value_to(v, src_folder, dst_folder, copied_files, memo)
+        elif type(x) is list:
+            y = list()
+            memo[id(x)] = y
+            y.extend(self._copy_value_to(v, src_folder, dst_folder, copied_files, memo) for v in x)
+        elif type(x) in (tuple, set):
+            y = type(x)(self._copy_value_to(v, src_folder, dst_folder, copied_files, memo) for v in x)
+        else:
+            y = copy.deepcopy(x, memo)
+
+        memo[id(x)] = y
+        return y
+
+    def _copy_to_folder(self, dst_folder, hardlink=False, workers=None):
+        """
+        Copy of the pack attached to dst_folder. The files of the attached folder are copied (see fastcopy.py) instead
+        of re-serializing their variables, arrays memory-mapped from them are memory-mapped from the copies instead of
+        being loaded into memory, and variables that have not been loaded yet (e.g. lazily) are carried over without
+        loading them. The copy still needs to be saved, which only rewrites the files of the modified variables.
+        """
+        src_folder = self.__internal__['attached_folder']
+        var_info = self.__internal__['var_info']
+        os.makedirs(dst_folder, exist_ok=True)
+
+        # the files of variables assigned since the last save/load are rewritten anyway
+        files = self._var_info_files({v: var_info[v] for v in var_info
+                                      if v not in self.__internal__['assigned_vars']})
+        with _folder_lock(src_folder):
+            copied_files = _copy_files(src_folder, dst_folder,
+                                       [f for f in files if os.path.isfile(os.path.join(src_folder, f))],
+                                       hardlink=hardlink, workers=workers)
+
+        copied_self = Varpack()
+        for key in ['var_info', 'numpy_mmap_mode', 'skipped_loading_vars', 'skip_saving_vars', 'assigned_vars',
+                    'lazy_vars']:
+            copied_self.__internal__[key] = copy.deepcopy(self.__internal__[key])
+        copied_self.__internal__['attached_folder'] = dst_folder
+
+        memo = dict()
+        for var_name, value in vars(self).items():
+            if var_name != '__internal__':
+                object.__setattr__(copied_self, var_name,
+                                   self._copy_value_to(value, src_folder, dst_folder, copied_files, memo))
+        return copied_self
+
     def _replace_numpy_placeholders(self, var_info, load_folder, numpy_mmap_mode, stop_on_error,
-                                    mmap_vars_list=None):
-        # go  over all the loaded variables and replace placeholder numpy arrays with mmap ones
+                                    mmap_vars_list=None, var_names=None, workers=None, stats=None):
+        # go  over all the loaded variables (or only var_names) and replace placeholder numpy arrays with mmap ones
         all_vars = vars(self)
-        for v in all_vars:
-            if (not v in self.__internal__['skip_saving_vars']) and v != '__internal__' and 'uses_numpy_placeholders' in var_info[v] and var_info[v][
-                'uses_numpy_placeholders']:
-                # go over keys in the dictionary and replace the placeholders with numpy arrays
-                for k in all_vars[v]:
-                    if isinstance(all_vars[v][k], NumpyArrayPlaceholder):
-                        all_vars[v][k] = all_vars[v][k].load(load_folder, numpy_mmap_mode)
-
-                        if isinstance(all_vars[v][k], NumpyArrayPlaceholder):
-                            print('Could not load numpy array from the placeholder in variable: %s, key: %s'
-                                  % (v, k))
-                            if stop_on_error:
-                                return None
-                        elif isinstance(all_vars[v][k], np.memmap):
-                            if mmap_vars_list is not None:
-                                mmap_vars_list.append(v + '[' + k + ']')
+        if var_names is None:
+            var_names = list(all_vars)
+
+        placeholders = list()  # (variable name, key path, placeholder) of all placeholders, loaded concurrently
+        for v in var_names:
+            if v not in self.__internal__['skip_saving_vars'] and v != '__internal__' and \
+                    var_info[v].get('uses_numpy_placeholders', False):
+                # go over the (nested) keys of the variable and replace the placeholders with numpy arrays
+                for key_path, numpy_array_placeholder in _find_in_containers(
+                        all_vars[v], lambda x: isinstance(x, NumpyArrayPlaceholder),
+                        var_info[v].get('placeholder_depth', 1), var_info[v].get('placeholder_max_keys', np.inf)):
+                    placeholders.append((v, key_path, numpy_array_placeholder))
+
+        stats = IOStats('load', load_folder) if stats is None else stats
+        results = _run_parallel([stats.timed(v, 'mmap', functools.partial(self._load_placeholder,
+                                                                          numpy_array_placeholder, load_folder,
+                                                                          numpy_mmap_mode))
+                                 for v, _, numpy_array_placeholder in placeholders], workers)
+
+        replacements = dict()
+        for (v, key_path, _), (np_arr, error) in zip(placeholders, results):
+            if error is not None or isinstance(np_arr, NumpyArrayPlaceholder):
+                logger.error('Could not load numpy array from the placeholder in variable: %s, key: %s',
+                             v, _key_repr(key_path))
+                if stop_on_error:
+                    if error is not None:
+                        raise error
+                    return None
+                continue
+
+            replacements.setdefault(v, dict())[key_path] = np_arr
+            if isinstance(np_arr, np.memmap):
+                if mmap_vars_list is not None:
+                    mmap_vars_list.append(v + _key_repr(key_path))
+            else:
+                stats.add_bytes(v, bytes_read=np_arr.nbytes)
+
+        for v in replacements:
+            # dicts and lists are modified in place, tuples are replaced
+            object.__setattr__(self, v, _replace_in_containers(all_vars[v], replacements[v]))
+
+    def _read_pickle_file(self, load_folder, file_name):
+        segments = self.__internal__['single_file_segments']
+        if segments is not None:
+            return pickle.loads(singlefile.read_blob(load_folder, segments[file_name]))
+
+        # memory-map the out-of-band buffers of the variable, if any
+        buffers = list()
+        if file_name != MISC_VAR_FILENAME:
+            var_name = os.path.splitext(file_name)[0]
+            for record in self.__internal__['var_info'].get(var_name, dict()).get('oob_buffers', list()):
+                buffers.append(self._map_buffer_file(os.path.join(load_folder, record['filename'])))
+
+        with open(os.path.join(load_folder, file_name), 'rb') as f:
+            if len(buffers) > 0:
+                return pickle.load(f, buffers=buffers)
+            return pickle.load(f)
+
+    def _stored_size(self, load_folder, file_name):
+        # number of bytes of a file (or segment of a single-file pack)
+        segments = self.__internal__['single_file_segments']
+        if segments is not None:
+            return segments[file_name]['length']
+        return os.path.getsize(os.path.join(load_folder, file_name))
+
+    def _map_buffer_file(self, filename):
+        # the buffers are mapped copy-on-write rather than 'r+': they are not visible as memory maps inside the
+        # unpickled objects, and in-place modifications are only written by the next save (which detects them)
+        mode = 'r' if self.__internal__['numpy_mmap_mode'] == 'r' else 'c'
+        try:
+            return np.memmap(filename, dtype=np.uint8, mode=mode)
+        except (ValueError, EnvironmentError):
+            logger.warning('Could not memory map file: %s', filename)
+            return np.fromfile(filename, dtype=np.uint8)
+
+    def _load_npy_file(self, load_folder, file_name, mmap_mode):
+        segments = self.__internal__['single_file_segments']
+        if segments is not None:
+            return singlefile.open_array(load_folder, segments[file_name], mmap_mode)
+
+        return np.load(os.path.join(load_folder, file_name), mmap_mode=mmap_mode)
+
+    @staticmethod
+    def _open_compressed(load_folder, info):
+        # a compressed array (see compressed.py), its chunks are only decompressed when they are read
+        return CompressedArray(os.path.join(load_folder, info['filename']), info['shape'], info['dtype'],
+                               info['compression'])
+
+    def _load_strings(self, load_folder, info, mmap_mode):
+        # an array of strings saved as its data and offsets arrays (see strings.py), memory-mapped if possible
+        try:
+            data = self._load_npy_file(load_folder, info['filename'], mmap_mode)
+            offsets = self._load_npy_file(load_folder, info['strings']['offsets'], mmap_mode)
+        except (ValueError, EnvironmentError):
+            data = self._load_npy_file(load_folder, info['filename'], None)
+            offsets = self._load_npy_file(load_folder, info['strings']['offsets'], None)
+        return StringArray(data, offsets, info['shape'], info['strings']['kind'])
+
+    def _load_table(self, load_folder, info, mmap_mode, columns=None):
+        # a table saved with one file per column (see tables.py), its columns are opened when first accessed
+        def load_column(position):
+            record = info['table']['columns'][position]
+            if 'strings' in record:
+                return self._load_strings(load_folder, record, mmap_mode)
+            try:
+                return self._load_npy_file(load_folder, record['filename'], mmap_mode)
+            except (ValueError, EnvironmentError):
+                return self._load_npy_file(load_folder, record['filename'], None)
+
+        table = Table(self._read_pickle_file(load_folder, info['filename']), load_column)
+        return table if columns is None else table.select(columns)
+
+    def _load_packed(self, load_folder, info, mmap_mode):
+        # a dictionary of arrays saved with packed storage (see packed.py), its arrays are memory-mapped if possible
+        try:
+            data = self._load_npy_file(load_folder, info['filename'], mmap_mode)
+            index = self._load_npy_file(load_folder, info['packed']['index'], mmap_mode)
+        except (ValueError, EnvironmentError):
+            data = self._load_npy_file(load_folder, info['filename'], None)
+            index = self._load_npy_file(load_folder, info['packed']['index'], None)
+        return PackedArrayDict(data, index, self._read_pickle_file(load_folder, info['packed']['keys']))
+
+    def _load_placeholder(self, numpy_array_placeholder, load_folder, mmap_mode):
+        if self.__internal__['single_file_segments'] is not None:
+            return self._load_npy_file(load_folder, numpy_array_placeholder.filename, mmap_mode)
+
+        return numpy_array_placeholder.load(load_folder, mmap_mode)
+
+    def prefetch(self, names=None, workers=None):
+        """
+        Load variables that are still pending from a lazy load (see load()), so that later accesses do not hit the disk.
+        Variables saved in the misc. variables file are all loaded together.
+        :param names: a list of variable names to load. Default: all pending variables.
+        :param workers: number of threads used to read the files concurrently. Default: DEFAULT_WORKERS.
+        :return: None
+        """
+        lazy_vars = self.__internal__.get('lazy_vars', dict())
+        if names is None:
+            names = list(lazy_vars)
+
+        file_names = []
+        for v in names:
+            if v in lazy_vars and lazy_vars[v] not in file_names:
+                file_names.append(lazy_vars[v])
+
+        load_folder = self.__internal__['attached_folder']
+        if len(file_names) > 0:
+            with _folder_lock(load_folder):  # do not read files being written by a background save
+                results = _run_parallel([functools.partial(self._read_pickle_file, load_folder, file_name)
+                                         for file_name in file_names], workers)
+        else:
+            results = []
+        for file_name, (loaded_vars, error) in zip(file_names, results):
+            if error is not None:
+                raise error
+            if file_name != MISC_VAR_FILENAME:
+                loaded_vars = {os.path.splitext(file_name)[0]: loaded_vars}
+
+            # only assign the variables that are still pending (i.e. have not been re-assigned meanwhile)
+            loaded_names = [v for v in loaded_vars if lazy_vars.get(v) == file_name]
+            for v in loaded_names:
+                object.__setattr__(self, v, loaded_vars[v])
+                del lazy_vars[v]
+
+            self._replace_numpy_placeholders(self.__internal__['var_info'], load_folder,
+                                             numpy_mmap_mode=self.__internal__['numpy_mmap_mode'],
+                                             stop_on_error=True, var_names=loaded_names, workers=workers)
 
     def set_attached_folder(self, attached_folder=None):
         """
@@ -189,17 +1425,21 @@ class Varpack:
         assert attached_folder is not None, 'attached_folder need to be specified.'
 
         if self.__internal__['attached_folder'] is not None and self.__internal__['attached_folder'] != attached_folder:
-            print('Attached folder is already set to a different directory and cannot be changed.')
-            print('Load a new instance of this class to attach to a different directory.')
-            print('Skipping...')
+            logger.warning('Attached folder is already set to a different directory and cannot be changed.')
+            logger.warning('Load a new instance of this class to attach to a different directory.')
+            logger.warning('Skipping...')
             return
         else:
             self.__internal__['attached_folder'] = attached_folder
 
+    @_locks_save_folder
     def save(self, save_folder=None, max_dict_keys: int = 1000,
              min_dict_numpy_size: int = 10000, sep_var_min_size: int = 1e4,
              sep_vars: typing.Optional[Union[Dict, List]] = None,
-             skip_saving_vars: typing.Set = None):
+             skip_saving_vars: typing.Set = None, incremental: bool = True,
+             trust_assignments: bool = False, workers: typing.Optional[int] = None, gc: bool = True,
+             format: typing.Optional[str] = None, binary_index: typing.Optional[bool] = None, durable: bool = False,
+             **storage_options):
         """
         Save the pack of variables into the 'attached folder'. This folder must have been already set up for the
         var pack using set_attached_folder() method.
@@ -207,12 +1447,15 @@ class Varpack:
         A subset variables can be marked to be saved in separate files, e.g. so they could later be loaded individually
         or to be excluded from loading the pack.
 
-        :param save_folder: if provided and not equal to attached folder, all the data is loaded into memory and
-                            then a new folder is made and a copy of the data is saved to that folder. Save then
-                            returns the newly created varpack object, and leaves the original object intact.
-        :param max_dict_keys: do not try to replace large numpy arrays with dictionaries with larger than
-                              this number of keys. This is mainly to avoid wasting time checking keys in very large
-                              dictionaries.
+        :param save_folder: if provided and not equal to attached folder, a new folder is made and a copy of the data
+                            is saved to that folder. The files of the attached folder are copied (with reflinks or
+                            in-kernel copies when possible, see fastcopy.py) and memory-mapped arrays stay
+                            memory-mapped, only the variables modified since the last save are serialized again.
+                            Save then returns the newly created varpack object, and leaves the original object
+                            intact.
+        :param max_dict_keys: do not try to replace large numpy arrays with dictionaries (or lists and tuples) with
+                              larger than this number of keys. This is mainly to avoid wasting time checking keys in
+                              very large dictionaries.
         :param min_dict_numpy_size: minimum number of elements in a numpy array for it to be replaced with
                                     a placeholder objects that points to a separate numpy file.
         :param sep_var_min_size:  minimum total in-memory size (in bytes) for a variable to be saved in a
@@ -220,6 +1463,57 @@ class Varpack:
         :param sep_vars: a list containing variables that need to be saved in a different pickle file.
                          All numpy arrays are automatically saved in separate .npy files.
         :param skip_saving_vars: a set with the variables to be skipped during save.
+        :param incremental: only rewrite .npy and .pickle files whose content fingerprint (recorded in varpack.json)
+                            differs from the one of the current value of the variable.
+        :param trust_assignments: with incremental save, assume that variables which have not been assigned since the
+                                  last save/load are unchanged, and skip fingerprinting them (and estimating their
+                                  size) altogether. In-place modifications of such variables (e.g. list.append) are
+                                  then not saved.
+        :param workers: number of threads used to write independent files concurrently. Default: DEFAULT_WORKERS.
+                        Use 1 to write the files one at a time.
+        :param gc: remove the files that were used by the previous save but are not anymore (e.g. of deleted
+                   variables or placeholders of removed dictionary keys). See also gc().
+        :param format: 'folder' to save a folder of .npy and .pickle files, or 'single' to save a single file with
+                       memory-mappable array segments (see singlefile.py), which is faster to copy and open on
+                       shared filesystems. Single-file packs are rewritten as a whole on each save, so incremental,
+                       trust_assignments, workers, gc and out_of_band_buffers do not apply to them.
+                       Default: the format of the attached pack, or 'folder'.
+        :param binary_index: also write a binary copy of varpack.json (varpack.index), which is much faster to read
+                             for packs with many variables and placeholders, e.g. with inspect() or a selective load.
+                             Default: only if the folder already has one.
+        :param durable: flush the written files to disk before the save returns, so that the new version of the pack
+                        survives a power loss or OS crash. The files are flushed together (in parallel) once all of
+                        them are written, see transaction.py. Saves into a folder are transactional either way: the
+                        files of the previous save are only replaced once all the files have been written, so a
+                        failed or interrupted save leaves the previous version intact.
+        :param storage_options: how the variables are stored (see STORAGE_OPTIONS for the defaults):
+            out_of_band_buffers: pickle the variables that are saved in separate pickle files with protocol 5, and
+                                 save their large buffers (e.g. numpy arrays inside lists or custom objects) into
+                                 separate raw files that are memory-mapped on load, instead of copying them into the
+                                 pickle file.
+            placeholder_depth: maximum number of nested dictionaries, lists and tuples to go through to find the numpy
+                               arrays to be replaced with placeholder objects, e.g. 2 for the arrays in
+                               {'layer': {'weights': array}}.
+            pack_array_dicts: save dictionaries of at least max_dict_keys numpy arrays of the same dtype (e.g.
+                              embeddings keyed by id) with packed storage: the arrays are concatenated into a single
+                              .npy file with an index of their offsets and shapes. They are loaded as read-only
+                              PackedArrayDict mappings of views into the memory-mapped file (instead of dicts).
+                              PackedArrayDict variables (e.g. of a loaded pack) are always saved with packed storage.
+            compression: codec ('zlib', 'lzma' or 'bz2') used to compress the numpy array variables, or a dictionary
+                         with the codec of each variable to compress. Compressed arrays are saved in chunks of rows
+                         (compressed in parallel) and are loaded as read-only CompressedArray proxies that only
+                         decompress the chunks that are read (see compressed.py). Only supported by the folder format.
+            string_arrays: how to save the numpy array variables of dtype object whose elements are all str (or all
+                           bytes), e.g. id columns. 'offsets': as the concatenated UTF-8 encoded strings and an int64
+                           array of offsets, which are memory-mapped on load and wrapped in a read-only StringArray
+                           that only decodes the strings that are accessed (see strings.py). 'auto': also convert them
+                           to fixed-width 'U'/'S' arrays instead, when that does not take more space. Default: pickle
+                           them.
+            columnar_tables: save structured numpy arrays and pandas DataFrames with one file per column (columns of
+                             strings are saved as with string_arrays='offsets', see tables.py), instead of as a single
+                             .npy file or a pickle. They are loaded as read-only Table objects whose columns are only
+                             memory-mapped when accessed, see Table.materialize() and the columns argument of load().
+                             Only the columns that changed are rewritten.
         :return: None
         """
 
@@ -231,21 +1525,59 @@ class Varpack:
         if save_folder is None:
             save_folder = self.__internal__['attached_folder']
 
+        if format is None:
+            format = self.__internal__['format']
+        assert format in ['folder', 'single'], "format must be 'folder' or 'single'."
+        if save_folder is not None and (format == 'single' and os.path.isdir(save_folder) or
+                                        format == 'folder' and os.path.isfile(save_folder)):
+            raise ValueError('%s already exists and cannot be saved into with format %s.' % (save_folder, format))
+
+        options = _storage_options(storage_options)
+
+        if format == 'single' and self.__internal__['attached_folder'] is not None and \
+                save_folder != self.__internal__['attached_folder']:
+            # writing a single-file pack does not modify the variables, no need to detach.
+            self._save_single_file(save_folder, max_dict_keys=max_dict_keys,
+                                   min_dict_numpy_size=min_dict_numpy_size, sep_var_min_size=sep_var_min_size,
+                                   sep_vars=sep_vars, options=options, durable=durable, attach=False)
+            return Varpack(save_folder, numpy_mmap_mode=self.__internal__['numpy_mmap_mode'])
+
         if save_folder != self.__internal__['attached_folder']:
-            detached_self = self.detach()
-            detached_self.set_attached_folder(save_folder)
+            if self.__internal__['attached_folder'] is not None and self.__internal__['format'] == 'folder' and \
+                    format == 'folder':
+                # copy the files of the attached folder, only the modified variables are then rewritten
+                detached_self = self._copy_to_folder(save_folder, workers=workers)
+            else:
+                detached_self = self.detach()
+                detached_self.set_attached_folder(save_folder)
 
             # must remeber to include all future input params there!
-            detached_self.save(save_folder, max_dict_keys, min_dict_numpy_size, sep_var_min_size,
-                                sep_vars, skip_saving_vars)
+            detached_self.save(save_folder, max_dict_keys=max_dict_keys, min_dict_numpy_size=min_dict_numpy_size,
+                               sep_var_min_size=sep_var_min_size, sep_vars=sep_vars,
+                               skip_saving_vars=skip_saving_vars, incremental=incremental,
+                               trust_assignments=trust_assignments, workers=workers, gc=gc, format=format,
+                               binary_index=binary_index, durable=durable, **storage_options)
+            self.__internal__['last_save_stats'] = detached_self.last_save_stats()
             return detached_self
 
+        if format == 'single':
+            self._save_single_file(save_folder, max_dict_keys=max_dict_keys, min_dict_numpy_size=min_dict_numpy_size,
+                                   sep_var_min_size=sep_var_min_size, sep_vars=sep_vars, options=options,
+                                   durable=durable, attach=True)
+            return self
+
 
-        print('Saving variables into the attached folder: ', save_folder)
+        logger.info('Saving variables into the attached folder: %s', save_folder)
+        stats = IOStats('save', save_folder)
+        out_of_band_buffers, placeholder_depth = options['out_of_band_buffers'], options['placeholder_depth']
+        pack_array_dicts, compression = options['pack_array_dicts'], options['compression']
+        string_arrays, columnar_tables = options['string_arrays'], options['columnar_tables']
 
         assert save_folder is not None, 'attached folder has not yet been set'
 
         os.makedirs(save_folder, exist_ok=True)
+        # the files written from here on are staged until the transaction is committed, after varpack.json is written
+        save_transaction = transaction.begin(save_folder, durable)
 
         # variables that cannot be saved as numpy arrays and need to be saved using pickle
         pickle_vars = list()
@@ -257,82 +1589,525 @@ class Varpack:
         else:
             sep_vars = set(sep_vars)
 
+        # var_info from the previous save/load, used to find out which files do not need to be rewritten
+        prev_var_info = self.__internal__['var_info']
+        lazy_vars = self.__internal__['lazy_vars']
+        not_loaded_vars = self.__internal__['skipped_loading_vars'] | set(lazy_vars)
+        # the var_info of the pack is only replaced once the save is committed, a failed save leaves it as it was
+        var_info = {v: prev_var_info[v] for v in prev_var_info if v in not_loaded_vars}
+        assigned_vars = self.__internal__['assigned_vars']
+
+        def previous_fingerprint(var_name):
+            # with trust_assignments, fingerprints of variables that were not assigned are reused without hashing
+            if incremental and trust_assignments and var_name not in assigned_vars:
+                return prev_var_info.get(var_name, dict()).get('fingerprint')
+            return None
+
+        def fingerprint_of(var_name, obj):
+            with stats.timer(var_name, 'hash'):
+                return get_fingerprint(obj)
+
+        def save_placeholder(var_name, key_path, np_arr, filename):
+            # saves an array of a dictionary into its own file, unless it is unchanged since the previous save
+            key_repr = _key_repr(key_path)
+            prev_record = prev_var_info.get(var_name, dict()).get('placeholders', dict()).get(key_repr, dict())
+            fingerprint = None
+            if incremental and not (isinstance(np_arr, np.memmap) and np_arr.mode != 'c') and \
+                    not np_arr.dtype.hasobject:
+                if trust_assignments and var_name not in assigned_vars:
+                    fingerprint = prev_record.get('fingerprint')
+                if fingerprint is None:
+                    fingerprint = fingerprint_of(var_name, np_arr)
+
+                if self._is_file_current(prev_record, filename, fingerprint, save_folder):
+                    numpy_array_placeholder = NumpyArrayPlaceholder()
+                    numpy_array_placeholder.filename = filename
+                    return numpy_array_placeholder, fingerprint
+
+            with stats.timer(var_name, 'write'):
+                return NumpyArrayPlaceholder(np_arr, save_folder=save_folder, var_name=var_name,
+                                             filename=filename), fingerprint
+
+        def save_compressed(var_name, obj, codec):
+            filename = var_name + '.zchunks'
+            path = os.path.join(save_folder, filename)
+            prev_info = prev_var_info.get(var_name, dict())
+            if isinstance(obj, CompressedArray):
+                # compressed arrays are read-only, their compressed file is reused as it is
+                if os.path.abspath(obj.path) == os.path.abspath(path) and os.path.isfile(path) and \
+                        prev_info.get('compression') == obj.compression:
+                    return filename, prev_info.get('fingerprint'), None, obj.compression
+                with stats.timer(var_name, 'write'):
+                    obj.copy_to(path)
+                return filename, None, obj.compressed_nbytes, obj.compression
+
+            fingerprint = previous_fingerprint(var_name)
+            if incremental and fingerprint is None:
+                fingerprint = fingerprint_of(var_name, obj)
+            if incremental and self._is_file_current(prev_info, filename, fingerprint, save_folder) and \
+                    prev_info.get('compression', dict()).get('codec') == codec:
+                return filename, fingerprint, None, prev_info['compression']
+
+            with stats.timer(var_name, 'write'):
+                compression_info = compressed.write_compressed(path, obj, codec,
+                                                               workers=DEFAULT_WORKERS if workers is None else workers)
+            return filename, fingerprint, sum(length for _, length in compression_info['chunks']), compression_info
+
+        def save_array(var_name, np_arr):
+            filename = var_name + '.npy'
+            fingerprint = previous_fingerprint(var_name)
+            if incremental and fingerprint is None:
+                fingerprint = fingerprint_of(var_name, np_arr)
+
+            if incremental and self._is_file_current(prev_var_info.get(var_name, dict()), filename, fingerprint,
+                                                     save_folder):
+                return filename, fingerprint, None
+
+            # need to disallow pickle here otherwise all vars are saved
+            with stats.timer(var_name, 'write'):
+                num_bytes = _save_npy_replace(os.path.join(save_folder, filename), np_arr, allow_pickle=False)
+            return filename, fingerprint, num_bytes
+
+        def save_packed(var_name, obj):
+            # saves a dictionary of arrays with packed storage, unless it is unchanged since the previous save
+            files = {'data': var_name + '.packed.npy', 'index': var_name + '.packed-index.npy',
+                     'keys': var_name + '.packed-keys.pickle'}
+            prev_info = prev_var_info.get(var_name, dict())
+            all_files_exist = all(os.path.isfile(os.path.join(save_folder, f)) for f in files.values())
+            fingerprint = previous_fingerprint(var_name)
+
+            if isinstance(obj, PackedArrayDict) and isinstance(obj.data, np.memmap) and obj.data.filename is not None \
+                    and os.path.abspath(obj.data.filename) == os.path.abspath(os.path.join(save_folder, files['data'])):
+                # memory-mapped from the files of this folder, the data may only have been modified in place
+                obj.data.flush()
+                if all_files_exist:
+                    return files, None, None
+
+            if incremental and all_files_exist and fingerprint is not None and \
+                    prev_info.get('fingerprint') == fingerprint and prev_info.get('filename') == files['data']:
+                return files, fingerprint, None
+
+            with stats.timer(var_name, 'serialize'):
+                data, index, keys = packed.pack_arrays(obj)
+            if fingerprint is None:
+                with stats.timer(var_name, 'hash'):
+                    fingerprint = _hash_bytes((get_fingerprint(data) + get_fingerprint(index) +
+                                               get_fingerprint(keys)).encode())
+
+            if incremental and all_files_exist and prev_info.get('fingerprint') == fingerprint and \
+                    prev_info.get('filename') == files['data']:
+                return files, fingerprint, None
+
+            num_bytes = 0
+            with stats.timer(var_name, 'write'):
+                for filename, value in [(files['data'], data), (files['index'], index)]:
+                    num_bytes += _save_npy_replace(os.path.join(save_folder, filename), value)
+                pickled_keys = pickle.dumps(keys, protocol=PICKLE_PROTOCOL)
+                _write_file_replace(os.path.join(save_folder, files['keys']), pickled_keys)
+            return files, fingerprint, num_bytes + len(pickled_keys)
+
+        def save_strings(var_name, obj, kind, data, offsets):
+            # saves an array of strings as its data and offsets arrays, unless it is unchanged since the previous save
+            files = {'data': var_name + '.strings.npy', 'offsets': var_name + '.string-offsets.npy'}
+            prev_info = prev_var_info.get(var_name, dict())
+            all_files_exist = all(os.path.isfile(os.path.join(save_folder, f)) for f in files.values())
+
+            if isinstance(obj, StringArray) and isinstance(obj.data, np.memmap) and obj.data.filename is not None \
+                    and os.path.abspath(obj.data.filename) == os.path.abspath(os.path.join(save_folder, files['data'])) \
+                    and all_files_exist:
+                # memory-mapped from the files of this folder, which are read-only
+                return files, prev_info.get('fingerprint'), None
+
+            fingerprint = previous_fingerprint(var_name)
+            if fingerprint is None:
+                with stats.timer(var_name, 'hash'):
+                    fingerprint = _hash_bytes((get_fingerprint(data) + get_fingerprint(offsets) + kind +
+                                               str(obj.shape)).encode())
+            if incremental and all_files_exist and prev_info.get('fingerprint') == fingerprint and \
+                    prev_info.get('filename') == files['data']:
+                return files, fingerprint, None
+
+            num_bytes = 0
+            with stats.timer(var_name, 'write'):
+                for filename, value in [(files['data'], data), (files['offsets'], offsets)]:
+                    num_bytes += _save_npy_replace(os.path.join(save_folder, filename), value)
+            return files, fingerprint, num_bytes
+
+        def save_table(var_name, obj):
+            # saves a table with one file per column (see tables.py), only the columns that changed since the
+            # previous save are rewritten. Returns the table info, fingerprint, bytes written and unchanged files.
+            prev_info = prev_var_info.get(var_name, dict())
+            prev_table = prev_info.get('table', dict())
+            meta_filename = var_name + '.table.pickle'
+            fingerprint = previous_fingerprint(var_name)
+            if fingerprint is not None and prev_info.get('filename') == meta_filename and \
+                    all(os.path.isfile(os.path.join(save_folder, f)) for f in self._var_info_files({var_name: prev_info})
+                        if f != MISC_VAR_FILENAME):
+                return prev_table, fingerprint, 0, len(prev_table['columns']) + 1
+
+            with stats.timer(var_name, 'serialize'):
+                meta, values = tables.split_table(obj)
+            num_bytes = 0
+            num_unchanged = 0
+            records = list()
+            for position, column in enumerate(values):
+                if column is None:  # pickled with the metadata
+                    records.append({'pickled': True})
+                    continue
+
+                prev_record = prev_table.get('columns', list())[position] \
+                    if position < len(prev_table.get('columns', list())) else dict()
+                with stats.timer(var_name, 'serialize'):
+                    record, files = tables.column_files('%s.col%d' % (var_name, position), column)
+                if all(isinstance(np_arr, np.memmap) and np_arr.filename is not None and
+                       os.path.abspath(np_arr.filename) == os.path.abspath(os.path.join(save_folder, filename))
+                       for filename, np_arr in files) and prev_record.get('filename') == record['filename']:
+                    # memory-mapped from the files of this folder (e.g. a loaded Table)
+                    for _, np_arr in files:
+                        np_arr.flush()
+                    records.append(prev_record)
+                    num_unchanged += len(files)
+                    continue
+
+                with stats.timer(var_name, 'hash'):
+                    record['fingerprint'] = _hash_bytes(''.join(get_fingerprint(np_arr) for _, np_arr in files).encode())
+                if incremental and prev_record.get('fingerprint') == record['fingerprint'] and \
+                        prev_record.get('filename') == record['filename'] and \
+                        all(os.path.isfile(os.path.join(save_folder, filename)) for filename, _ in files):
+                    records.append(prev_record)
+                    num_unchanged += len(files)
+                    continue
+
+                with stats.timer(var_name, 'write'):
+                    for filename, np_arr in files:
+                        num_bytes += _save_npy_replace(os.path.join(save_folder, filename), np_arr)
+                records.append(record)
+
+            with stats.timer(var_name, 'serialize'):
+                pickled_meta = pickle.dumps(meta, protocol=PICKLE_PROTOCOL)
+            meta_fingerprint = _hash_bytes(pickled_meta)
+            if incremental and prev_table.get('meta_fingerprint') == meta_fingerprint and \
+                    prev_info.get('filename') == meta_filename and \
+                    os.path.isfile(os.path.join(save_folder, meta_filename)):
+                num_unchanged += 1
+            else:
+                with stats.timer(var_name, 'write'):
+                    _write_file_replace(os.path.join(save_folder, meta_filename), pickled_meta)
+                num_bytes += len(pickled_meta)
+
+            table_info = {'kind': meta['kind'], 'num_rows': meta['num_rows'],
+                          'labels': [str(label) for label in meta['labels']], 'columns': records,
+                          'meta_fingerprint': meta_fingerprint}
+            fingerprint = None
+            if all('fingerprint' in record for record in records if 'filename' in record):
+                fingerprint = _hash_bytes((meta_fingerprint + ''.join(record.get('fingerprint', '')
+                                                                      for record in records)).encode())
+            return table_info, fingerprint, num_bytes, num_unchanged
+
+        def pickle_var(obj):
+            pickled, buffers = _pickle_with_buffers(obj, out_of_band_buffers)
+            buffer_fingerprints = [_hash_bytes(buf.raw()) for buf in buffers]
+            return pickled, buffers, buffer_fingerprints, _hash_bytes(pickled + ''.join(buffer_fingerprints).encode())
+
+        def save_pickle(var_name, obj):
+            filename = var_name + '.pickle'
+            prev_info = prev_var_info.get(var_name, dict())
+            prev_buffers = prev_info.get('oob_buffers', list())
+            fingerprint = previous_fingerprint(var_name)
+            pickled = None
+            if fingerprint is None:
+                with stats.timer(var_name, 'serialize'):
+                    pickled, buffers, buffer_fingerprints, fingerprint = pickle_var(obj)
+
+            if incremental and self._is_file_current(prev_info, filename, fingerprint, save_folder) and \
+                    all(os.path.isfile(os.path.join(save_folder, record['filename'])) for record in prev_buffers):
+                return filename, fingerprint, None, prev_buffers
+
+            if pickled is None:
+                with stats.timer(var_name, 'serialize'):
+                    pickled, buffers, buffer_fingerprints, fingerprint = pickle_var(obj)
+
+            # out-of-band buffers are each saved in a raw file, unless the same file is already there
+            num_bytes = 0
+            buffer_records = list()
+            with stats.timer(var_name, 'write'):
+                for i, (buf, buffer_fingerprint) in enumerate(zip(buffers, buffer_fingerprints)):
+                    record = {'filename': '%s.buffer%d.bin' % (var_name, i), 'fingerprint': buffer_fingerprint}
+                    if not (incremental and i < len(prev_buffers) and
+                            self._is_file_current(prev_buffers[i], record['filename'], buffer_fingerprint,
+                                                  save_folder)):
+                        _write_file_replace(os.path.join(save_folder, record['filename']), buf.raw())
+                        num_bytes += buf.raw().nbytes
+                    buffer_records.append(record)
+
+                _write_file_replace(os.path.join(save_folder, filename), pickled)
+            return filename, fingerprint, num_bytes + len(pickled), buffer_records
+
+        def save_misc(misc_dict):
+            # the misc. file is accounted for as a whole, under its file name
+            with stats.timer(MISC_VAR_FILENAME, 'serialize'):
+                pickled = pickle.dumps(misc_dict, protocol=PICKLE_PROTOCOL)
+            with stats.timer(MISC_VAR_FILENAME, 'write'):
+                num_bytes = _write_file_replace(os.path.join(save_folder, MISC_VAR_FILENAME), pickled)
+            return MISC_VAR_FILENAME, None, num_bytes, None
+
+        bytes_written = 0
+        num_unchanged_files = 0
+
+        size_cache = dict()  # new size cache, only containing the variables that still exist
+
+        # numpy arrays and numpy placeholders in dictionaries are written concurrently once all variables are examined
+        array_tasks = dict()  # variable name -> task
+        placeholder_tasks = dict()  # (variable name, dictionary key) -> task
+        placeholder_arrays = dict()  # variable name -> {dictionary key: numpy array}
+        packed_tasks = dict()  # variable name -> task
+        compressed_tasks = dict()  # variable name -> task
+        string_tasks = dict()  # variable name -> task
+        string_kinds = dict()  # variable name -> kind of strings
+        table_tasks = dict()  # variable name -> task
+        fixed_width_dtypes = dict()  # dtype of the arrays of strings converted to fixed-width strings
+
         for var_name in obj_vars:
             if var_name in self.__internal__['skip_saving_vars']:
-                print("- Skipping: " + var_name)
-                if var_name in self.__internal__['var_info']:
-                    del self.__internal__['var_info'][var_name]
+                logger.info('- Skipping: %s', var_name)
+                if var_name in var_info:
+                    del var_info[var_name]
             elif var_name != '__internal__':  # do not save_copy __internal__ variable.
 
-                print("Saving: " + var_name)
-
-                self.__internal__['var_info'][var_name] = dict()
-                self.__internal__['var_info'][var_name]['size'] = get_total_obj_size(obj_vars[var_name],
-                                                                                     count_mmap_size=False)
+                logger.info('Saving: %s', var_name)
+
+                var_info[var_name] = dict()
+                with stats.timer(var_name, 'sizing'):
+                    var_info[var_name]['size'] = self._estimate_var_size(var_name, obj_vars[var_name], size_cache,
+                                                                         trust_assignments)
+
+                codec = compression.get(var_name) if isinstance(compression, dict) else compression
+                string_kind = strings.string_kind(obj_vars[var_name]) if string_arrays is not None else None
+                if isinstance(obj_vars[var_name], Table) or (
+                        columnar_tables and codec is None and tables.table_kind(obj_vars[var_name]) is not None):
+                    # structured array or DataFrame, see tables.py
+                    table_tasks[var_name] = functools.partial(save_table, var_name, obj_vars[var_name])
+
+                elif isinstance(obj_vars[var_name], CompressedArray) or (
+                        codec is not None and isinstance(obj_vars[var_name], np.ndarray) and
+                        not obj_vars[var_name].dtype.hasobject):
+                    compressed_tasks[var_name] = functools.partial(save_compressed, var_name, obj_vars[var_name], codec)
+
+                elif isinstance(obj_vars[var_name], StringArray) or string_kind is not None:
+                    # array of strings, see strings.py
+                    value = obj_vars[var_name]
+                    if isinstance(value, StringArray):
+                        kind, data, offsets = value.kind, value.data, value.offsets
+                    else:
+                        kind = string_kind
+                        with stats.timer(var_name, 'serialize'):
+                            data, offsets = strings.encode_strings(value, kind)
+                    fixed_dtype = strings.fixed_width_dtype(value, kind, data, offsets) \
+                        if string_arrays == 'auto' and not isinstance(value, StringArray) else None
+                    if fixed_dtype is not None:
+                        fixed_width_dtypes[var_name] = str(fixed_dtype)
+                        array_tasks[var_name] = functools.partial(save_array, var_name, value.astype(fixed_dtype))
+                    else:
+                        string_kinds[var_name] = kind
+                        string_tasks[var_name] = functools.partial(save_strings, var_name, value, kind, data, offsets)
 
                 # if the variable is a numpy array then try to save_copy it as .npy
-                if isinstance(obj_vars[var_name], np.ndarray):
+                elif isinstance(obj_vars[var_name], np.ndarray):
 
-                    if type(obj_vars[var_name]) is np.memmap:
+                    if type(obj_vars[var_name]) is np.memmap and obj_vars[var_name].mode != 'c' and \
+                            obj_vars[var_name].filename is not None and \
+                            os.path.abspath(os.path.dirname(obj_vars[var_name].filename)) == \
+                            os.path.abspath(save_folder):
                         # flush mmap to disk, no need to re-save_copy if
                         # saving to the same folder where it is memory-mapped
                         obj_vars[var_name].flush()
 
-                        self.__internal__['var_info'][var_name]['filename'] = \
-                            os.path.basename(obj_vars[var_name].filename)
-                        self.__internal__['var_info'][var_name]['shape'] = obj_vars[var_name].shape
-                        self.__internal__['var_info'][var_name]['dtype'] = str(obj_vars[var_name].dtype)
+                        var_info[var_name]['filename'] = os.path.basename(obj_vars[var_name].filename)
+                        var_info[var_name]['shape'] = obj_vars[var_name].shape
+                        var_info[var_name]['dtype'] = str(obj_vars[var_name].dtype)
                     else:
-                        try:
-                            filename = var_name + '.npy'
-                            np.save(os.path.join(save_folder, filename), obj_vars[var_name],
-                                    allow_pickle=False)  # need to disallow pickle here otherwise all vars are saved
-
-                            self.__internal__['var_info'][var_name]['filename'] = filename
-                            self.__internal__['var_info'][var_name]['shape'] = obj_vars[var_name].shape
-                            self.__internal__['var_info'][var_name]['dtype'] = str(obj_vars[var_name].dtype)
-                        except:
-                            pickle_vars.append(var_name)
+                        array_tasks[var_name] = functools.partial(save_array, var_name, obj_vars[var_name])
+                elif isinstance(obj_vars[var_name], PackedArrayDict) or \
+                        (pack_array_dicts and packed.is_packable(obj_vars[var_name], max_dict_keys)):
+                    # large dictionary of arrays with the same dtype
+                    packed_tasks[var_name] = functools.partial(save_packed, var_name, obj_vars[var_name])
                 else:  # cannot readily be saved as a numpy array
                     pickle_vars.append(var_name)
 
-                    # see if it is dictionary made up of numpy arrays (and does not have too many keys)
-                    if type(obj_vars[var_name]) is dict and len(obj_vars[var_name]) < max_dict_keys:
-                        uses_numpy_placeholders = False
-
-                        for k in obj_vars[var_name]:
-                            # if the key is a numpy array and has enough elements that makes it worth saving as a
-                            # separate file.
-
-                            if isinstance(obj_vars[var_name][k], np.ndarray) and \
-                                    obj_vars[var_name][k].size >= min_dict_numpy_size:
-
-                                numpy_array_placeholder = NumpyArrayPlaceholder(obj_vars[var_name][k],
-                                                                                save_folder=save_folder,
-                                                                                var_name=var_name,
-                                                                                key_hash=k.__hash__())
-
-                                # if saving the value as a numpy array was successful,
-                                # put the placeholder object there instead.
-                                if numpy_array_placeholder.filename is not None:
-                                    obj_vars[var_name][k] = numpy_array_placeholder
-                                    uses_numpy_placeholders = True
-
-                        # update the size of the variable now that large numpy arrays have been replaced
-                        # with placeholders
-                        if uses_numpy_placeholders:
-                            if not 'size_before_numpy_placeholders' in self.__internal__['var_info'][var_name]:
-                                self.__internal__['var_info'][var_name]['size_before_numpy_placeholders'] = \
-                                    get_total_obj_size(obj_vars[var_name], count_mmap_size=True)
-
-                            self.__internal__['var_info'][var_name]['size'] = get_total_obj_size(obj_vars[var_name])
-
-                        # keep track of whether the dictionary is using numpy placeholder objects (useful when loading)
-                        self.__internal__['var_info'][var_name]['uses_numpy_placeholders'] = uses_numpy_placeholders
-
-                    # identify variables that are too large and need to be placed in separate pickle files.
-                    if self.__internal__['var_info'][var_name]['size'] >= sep_var_min_size:
-                        sep_vars.add(var_name)
+                    # see if it is a dictionary, list or tuple containing numpy arrays, possibly in nested
+                    # dictionaries, lists and tuples (that do not have too many keys)
+                    if type(obj_vars[var_name]) in (dict, list, tuple) and len(obj_vars[var_name]) < max_dict_keys:
+                        var_info[var_name]['uses_numpy_placeholders'] = False
+                        used_filenames = set()
+
+                        # numpy arrays that have enough elements that makes it worth saving them as separate files.
+                        for key_path, np_arr in _find_in_containers(
+                                obj_vars[var_name], lambda x: isinstance(x, np.ndarray) and
+                                x.size >= min_dict_numpy_size, placeholder_depth, max_dict_keys):
+                            filename = placeholder_filename(var_name, key_path, used_filenames)
+                            used_filenames.add(filename)
+                            placeholder_arrays.setdefault(var_name, dict())[key_path] = np_arr
+                            placeholder_tasks[var_name, key_path] = functools.partial(
+                                save_placeholder, var_name, key_path, np_arr, filename)
+
+        # the results are keyed by the kind of task and the variable (and dictionary key) it saves
+        parallel_tasks = dict()
+        for kind, tasks in [('placeholder', placeholder_tasks), ('array', array_tasks), ('packed', packed_tasks),
+                            ('strings', string_tasks), ('table', table_tasks)]:
+            parallel_tasks.update({(kind, key): task for key, task in tasks.items()})
+        array_results = dict(zip(parallel_tasks, _run_parallel(_with_save_progress(list(parallel_tasks.values())),
+                                                               workers)))
+
+        # if saving the value as a numpy array was successful, put the placeholder object there instead.
+        replacements = dict()
+        for var_name, key_path in placeholder_tasks:
+            result, error = array_results['placeholder', (var_name, key_path)]
+            if error is not None:
+                logger.error('Failed in saving numpy placeholder for variable: %s, key: %s (%s)',
+                             var_name, _key_repr(key_path), error)
+                continue
+
+            numpy_array_placeholder, fingerprint = result
+            if numpy_array_placeholder.filename is not None:
+                replacements.setdefault(var_name, dict())[key_path] = numpy_array_placeholder
+                var_info[var_name]['uses_numpy_placeholders'] = True
+                var_info[var_name]['placeholder_depth'] = max(len(key_path),
+                                                              var_info[var_name].get('placeholder_depth', 1))
+                var_info[var_name]['placeholder_max_keys'] = max_dict_keys
+                if numpy_array_placeholder.bytes_written > 0:
+                    bytes_written += numpy_array_placeholder.bytes_written
+                    stats.add_bytes(var_name, bytes_written=numpy_array_placeholder.bytes_written)
+                else:
+                    num_unchanged_files += 1
+                    stats.add_unchanged(var_name)
+
+                # keep track of the file of each placeholder, so that files which are no longer used can be removed
+                record = {'filename': numpy_array_placeholder.filename}
+                if fingerprint is not None:
+                    record['fingerprint'] = fingerprint
+                var_info[var_name].setdefault('placeholders', dict())[_key_repr(key_path)] = record
+
+        for var_name in replacements:
+            # dicts and lists are modified in place, tuples are replaced
+            object.__setattr__(self, var_name, _replace_in_containers(obj_vars[var_name], replacements[var_name]))
+
+        def restore_arrays():
+            # if the save is aborted, the placeholders point to files that are removed: put the arrays back
+            for var_name in replacements:
+                arrays = {key_path: placeholder_arrays[var_name][key_path] for key_path in replacements[var_name]}
+                object.__setattr__(self, var_name, _replace_in_containers(getattr(self, var_name), arrays))
+        save_transaction.on_abort(restore_arrays)
+
+        # each compressed array is compressed by several threads, one array at a time
+        compressed_results = dict(zip(compressed_tasks,
+                                      _run_parallel(_with_save_progress(list(compressed_tasks.values())), 1)))
+        for var_name in compressed_tasks:
+            result, error = compressed_results[var_name]
+            if error is not None:
+                raise error
+
+            filename, fingerprint, num_bytes, compression_info = result
+            if num_bytes is None:
+                num_unchanged_files += 1
+                stats.add_unchanged(var_name)
+            else:
+                bytes_written += num_bytes
+                stats.add_bytes(var_name, bytes_written=num_bytes)
+
+            var_info[var_name]['filename'] = filename
+            var_info[var_name]['shape'] = obj_vars[var_name].shape
+            var_info[var_name]['dtype'] = str(obj_vars[var_name].dtype)
+            var_info[var_name]['compression'] = compression_info
+            if fingerprint is not None:
+                var_info[var_name]['fingerprint'] = fingerprint
+
+        for var_name in table_tasks:
+            result, error = array_results['table', var_name]
+            if error is not None:
+                raise error
+
+            table_info, fingerprint, num_bytes, num_unchanged = result
+            bytes_written += num_bytes
+            num_unchanged_files += num_unchanged
+            stats.add_bytes(var_name, bytes_written=num_bytes)
+            stats.add_unchanged(var_name, num_unchanged)
+
+            var_info[var_name]['filename'] = var_name + '.table.pickle'
+            var_info[var_name]['table'] = table_info
+            if fingerprint is not None:
+                var_info[var_name]['fingerprint'] = fingerprint
+
+        for var_name in string_tasks:
+            result, error = array_results['strings', var_name]
+            if error is not None:
+                raise error
+
+            files, fingerprint, num_bytes = result
+            if num_bytes is None:
+                num_unchanged_files += len(files)
+                stats.add_unchanged(var_name, len(files))
+            else:
+                bytes_written += num_bytes
+                stats.add_bytes(var_name, bytes_written=num_bytes)
+
+            var_info[var_name]['filename'] = files['data']
+            var_info[var_name]['strings'] = {'offsets': files['offsets'], 'kind': string_kinds[var_name]}
+            var_info[var_name]['shape'] = obj_vars[var_name].shape
+            var_info[var_name]['dtype'] = 'object'
+            if fingerprint is not None:
+                var_info[var_name]['fingerprint'] = fingerprint
+
+        for var_name in packed_tasks:
+            result, error = array_results['packed', var_name]
+            if error is not None:  # save it with pickle instead
+                logger.warning('Failed in saving packed dictionary %s (%s), pickling it instead.', var_name, error)
+                pickle_vars.append(var_name)
+                continue
+
+            files, fingerprint, num_bytes = result
+            if num_bytes is None:
+                num_unchanged_files += len(files)
+                stats.add_unchanged(var_name, len(files))
+            else:
+                bytes_written += num_bytes
+                stats.add_bytes(var_name, bytes_written=num_bytes)
+
+            var_info[var_name]['filename'] = files['data']
+            var_info[var_name]['packed'] = {'index': files['index'], 'keys': files['keys']}
+            var_info[var_name]['num_keys'] = len(obj_vars[var_name])
+            if fingerprint is not None:
+                var_info[var_name]['fingerprint'] = fingerprint
+
+        for var_name in array_tasks:
+            result, error = array_results['array', var_name]
+            if error is not None:  # could not be saved as .npy (e.g. an object array), save it with pickle instead
+                pickle_vars.append(var_name)
+                continue
+
+            filename, fingerprint, num_bytes = result
+            if num_bytes is None:
+                num_unchanged_files += 1
+                stats.add_unchanged(var_name)
+            else:
+                bytes_written += num_bytes
+                stats.add_bytes(var_name, bytes_written=num_bytes)
+
+            var_info[var_name]['filename'] = filename
+            var_info[var_name]['shape'] = obj_vars[var_name].shape
+            var_info[var_name]['dtype'] = fixed_width_dtypes.get(var_name, str(obj_vars[var_name].dtype))
+            if fingerprint is not None:
+                var_info[var_name]['fingerprint'] = fingerprint
+
+        for var_name in pickle_vars:
+            # update the size of the variable now that large numpy arrays have been replaced
+            # with placeholders
+            if var_info[var_name].get('uses_numpy_placeholders', False):
+                var_info[var_name]['size_before_numpy_placeholders'] = var_info[var_name]['size']
+                var_info[var_name]['size'] = estimate_obj_size(obj_vars[var_name])
+
+            # identify variables that are too large and need to be placed in separate pickle files.
+            if var_info[var_name]['size'] >= sep_var_min_size:
+                sep_vars.add(var_name)
 
         # save_copy the rest of variables as pickle
         pickle_dict = dict()
@@ -340,81 +2115,598 @@ class Varpack:
             pickle_dict[v] = self.__getattribute__(v)
 
         # save_copy variables that need to have separate files
-        for var_name in sep_vars:
-            with open(os.path.join(save_folder, var_name + '.pickle'), 'wb') as f:
-                pickle.dump(pickle_dict[var_name], f, protocol=PICKLE_PROTOCOL)
-                self.__internal__['var_info'][var_name]['filename'] = var_name + '.pickle'
+        sep_vars = [v for v in pickle_vars if v in sep_vars]
+        pickle_tasks = {v: functools.partial(save_pickle, v, pickle_dict[v]) for v in sep_vars}  # None: misc. file
 
-        misc_vars = set(pickle_vars) - sep_vars
+        misc_vars = [v for v in pickle_vars if v not in sep_vars]
         misc_dict = dict()
+
+        # the misc. file needs to be rewritten if any of its variables changed, or a variable was added to or
+        # removed from it.
+        prev_misc_vars = {v for v in prev_var_info if prev_var_info[v].get('filename') == MISC_VAR_FILENAME}
+        rewrite_misc = not incremental or set(misc_vars) != prev_misc_vars - not_loaded_vars or \
+            not os.path.isfile(os.path.join(save_folder, MISC_VAR_FILENAME))
         for v in misc_vars:
             misc_dict[v] = pickle_dict[v]
-            self.__internal__['var_info'][v]['filename'] = MISC_VAR_FILENAME
+            var_info[v]['filename'] = MISC_VAR_FILENAME
+            if incremental:
+                fingerprint = previous_fingerprint(v)
+                if fingerprint is None:
+                    fingerprint = fingerprint_of(v, misc_dict[v])
+                var_info[v]['fingerprint'] = fingerprint
+                if prev_var_info.get(v, dict()).get('fingerprint') != fingerprint:
+                    rewrite_misc = True
+
+        if rewrite_misc:
+            # variables of the misc. file that are still pending from a lazy load are carried over as they are
+            lazy_misc_vars = [v for v in lazy_vars if lazy_vars[v] == MISC_VAR_FILENAME]
+            if len(lazy_misc_vars) > 0:
+                prev_misc_dict = self._read_pickle_file(save_folder, MISC_VAR_FILENAME)
+                for v in lazy_misc_vars:
+                    misc_dict[v] = prev_misc_dict[v]
+
+            pickle_tasks[None] = functools.partial(save_misc, misc_dict)
+        else:
+            num_unchanged_files += 1
+            stats.add_unchanged(MISC_VAR_FILENAME)
+
+        errors = list()
+        pickle_results = dict(zip(pickle_tasks, _run_parallel(_with_save_progress(list(pickle_tasks.values())),
+                                                              workers)))
+        for var_name, (result, error) in pickle_results.items():
+            if error is not None:
+                errors.append(error)
+                logger.error('Error when saving %s file: %s', var_name + '.pickle' if var_name else MISC_VAR_FILENAME,
+                             error)
+                continue
+
+            filename, fingerprint, num_bytes, buffer_records = result
+            if num_bytes is None:
+                num_unchanged_files += 1
+                stats.add_unchanged(var_name or MISC_VAR_FILENAME)
+            else:
+                bytes_written += num_bytes
+                stats.add_bytes(var_name or MISC_VAR_FILENAME, bytes_written=num_bytes)
+
+            if var_name is not None:
+                var_info[var_name]['filename'] = filename
+                if incremental:
+                    var_info[var_name]['fingerprint'] = fingerprint
+                if len(buffer_records) > 0:
+                    var_info[var_name]['oob_buffers'] = buffer_records
 
-        with open(os.path.join(save_folder, MISC_VAR_FILENAME), 'wb') as f:
-            pickle.dump(misc_dict, f, protocol=PICKLE_PROTOCOL)
+        if len(errors) > 0:
+            raise errors[0]
 
         # a json file with variable info
-        with open(os.path.join(save_folder, JSON_FILENAME), 'w') as outfile:
-            json.dump(self.__internal__['var_info'], outfile, indent=4)
+        with stats.timer(JSON_FILENAME, 'write'):
+            json_bytes = self._write_json(save_folder, var_info, binary_index)
+        bytes_written += json_bytes
+        # all the files are written: replace the files of the previous save with them
+        fsync_times = transaction.end(save_folder, commit=True)
+        self.__internal__['var_info'] = var_info
+        if len(fsync_times) > 0:
+            file_vars = {filename: var_name for var_name in var_info
+                         for filename in self._var_info_files({var_name: var_info[var_name]})}
+            for filename, seconds in fsync_times.items():
+                default = JSON_FILENAME if filename in (JSON_FILENAME, BINARY_INDEX_FILENAME) else MISC_VAR_FILENAME
+                stats.add_time(file_vars.get(filename, default), 'fsync', seconds)
+
+        if gc:
+            # remove the files of the previous save that are not used anymore
+            unused_files = self._var_info_files(prev_var_info) - self._var_info_files(var_info)
+            self._remove_files(save_folder, unused_files)
+
+        self.__internal__['last_save_bytes_written'] = bytes_written
+        self.__internal__['assigned_vars'] = set()
+        self.__internal__['size_cache'] = size_cache
+        logger.info('Wrote %d bytes, %d unchanged files were not rewritten.', bytes_written, num_unchanged_files)
+        for var_name in var_info:
+            if var_name in stats.variables:
+                stats.set_kind(var_name, self._storage_kind(var_info[var_name]))
+        stats.set_kind(MISC_VAR_FILENAME, 'pickle')
+        stats.add_bytes(JSON_FILENAME, bytes_written=json_bytes)
+        self.__internal__['last_save_stats'] = stats.finish()
 
         # Todo: do this for every mmaped variable right after saving, instead of here for all.
         # this would prevent messing up variables if an error occured during save
         base_folder = self.__internal__['attached_folder']
         if base_folder is None:
             base_folder = save_folder
-        self._replace_numpy_placeholders(self.__internal__['var_info'], base_folder,
+        self._replace_numpy_placeholders(var_info, base_folder,
                                          numpy_mmap_mode=self.__internal__['numpy_mmap_mode'], stop_on_error=True,
-                                         mmap_vars_list=None)
+                                         mmap_vars_list=None, workers=workers)
 
         # if data was never loaded, set the loaded folder to the first save_copy location.
         if self.__internal__['attached_folder'] is None:
             self.__internal__['attached_folder'] = save_folder
+        self.__internal__['format'] = 'folder'
 
         return self
 
-    def save_then_copy(self, copy_folder, **kwargs):
+    def _save_single_file(self, path, max_dict_keys, min_dict_numpy_size, sep_var_min_size, sep_vars, options, attach,
+                          durable=False):
+        # writes the pack into a single file, see save(). The variables themselves are not modified, dictionaries
+        # with numpy placeholders are pickled from shallow copies. With attach, the pack is attached to path.
+        # options are the storage options of the save (out_of_band_buffers and compression do not apply).
+        logger.info('Saving variables into the single-file pack: %s', path)
+        placeholder_depth, pack_array_dicts = options['placeholder_depth'], options['pack_array_dicts']
+        string_arrays, columnar_tables = options['string_arrays'], options['columnar_tables']
+
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.prefetch()  # the whole file is rewritten
+        sep_vars = set() if sep_vars is None else set(sep_vars)
+        size_cache = dict()
+        var_info = dict()
+        pickle_dict = dict()
+
+        stats = IOStats('save', path)
+        writer = singlefile.SingleFileWriter(path)
+
+        def add_array(var_name, name, np_arr):
+            with stats.timer(var_name, 'write'):
+                writer.add_array(name, np_arr)
+
+        def add_pickle(var_name, name, obj):
+            with stats.timer(var_name, 'serialize'):
+                pickled = pickle.dumps(obj, protocol=PICKLE_PROTOCOL)
+            with stats.timer(var_name, 'write'):
+                writer.add_blob(name, pickled)
+
+        try:
+            for var_name, value in vars(self).items():
+                if var_name == '__internal__' or var_name in self.__internal__['skip_saving_vars']:
+                    continue
+
+                logger.info('Saving: %s', var_name)
+                if isinstance(value, CompressedArray):
+                    value = np.asarray(value)  # compression is not supported by single-file packs
+                with stats.timer(var_name, 'sizing'):
+                    var_info[var_name] = {'size': self._estimate_var_size(var_name, value, size_cache)}
+
+                if isinstance(value, Table) or (columnar_tables and tables.table_kind(value) is not None):
+                    with stats.timer(var_name, 'serialize'):
+                        meta, values = tables.split_table(value)
+                    records = list()
+                    for position, column in enumerate(values):
+                        if column is None:
+                            records.append({'pickled': True})
+                            continue
+                        with stats.timer(var_name, 'serialize'):
+                            record, files = tables.column_files('%s.col%d' % (var_name, position), column)
+                        for filename, np_arr in files:
+                            add_array(var_name, filename, np_arr)
+                        records.append(record)
+                    var_info[var_name]['filename'] = var_name + '.table.pickle'
+                    var_info[var_name]['table'] = {'kind': meta['kind'], 'num_rows': meta['num_rows'],
+                                                   'labels': [str(label) for label in meta['labels']],
+                                                   'columns': records}
+                    add_pickle(var_name, var_name + '.table.pickle', meta)
+                    continue
+
+                string_kind = strings.string_kind(value) if string_arrays is not None else None
+                if isinstance(value, StringArray) or string_kind is not None:
+                    if isinstance(value, StringArray):
+                        string_kind, data, offsets = value.kind, value.data, value.offsets
+                    else:
+                        with stats.timer(var_name, 'serialize'):
+                            data, offsets = strings.encode_strings(value, string_kind)
+                        fixed_dtype = strings.fixed_width_dtype(value, string_kind, data, offsets) \
+                            if string_arrays == 'auto' else None
+                        if fixed_dtype is not None:
+                            value = value.astype(fixed_dtype)
+                    if not isinstance(value, np.ndarray) or value.dtype.hasobject:
+                        var_info[var_name]['filename'] = var_name + '.strings.npy'
+                        var_info[var_name]['strings'] = {'offsets': var_name + '.string-offsets.npy',
+                                                         'kind': string_kind}
+                        var_info[var_name]['shape'] = value.shape
+                        var_info[var_name]['dtype'] = 'object'
+                        add_array(var_name, var_name + '.strings.npy', data)
+                        add_array(var_name, var_name + '.string-offsets.npy', offsets)
+                        continue
+
+                if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+                    var_info[var_name]['filename'] = var_name + '.npy'
+                    var_info[var_name]['shape'] = value.shape
+                    var_info[var_name]['dtype'] = str(value.dtype)
+                    add_array(var_name, var_name + '.npy', value)
+                    continue
+
+                if isinstance(value, PackedArrayDict) or \
+                        (pack_array_dicts and packed.is_packable(value, max_dict_keys)):
+                    with stats.timer(var_name, 'serialize'):
+                        data, index, keys = packed.pack_arrays(value)
+                    var_info[var_name]['filename'] = var_name + '.packed.npy'
+                    var_info[var_name]['packed'] = {'index': var_name + '.packed-index.npy',
+                                                    'keys': var_name + '.packed-keys.pickle'}
+                    var_info[var_name]['num_keys'] = len(keys)
+                    add_array(var_name, var_name + '.packed.npy', data)
+                    add_array(var_name, var_name + '.packed-index.npy', index)
+                    add_pickle(var_name, var_name + '.packed-keys.pickle', keys)
+                    continue
+
+                if type(value) in (dict, list, tuple) and len(value) < max_dict_keys:
+                    placeholders = dict()
+                    replacements = dict()
+                    for key_path, np_arr in _find_in_containers(
+                            value, lambda x: isinstance(x, np.ndarray) and x.size >= min_dict_numpy_size and
+                            not x.dtype.hasobject, placeholder_depth, max_dict_keys):
+                        numpy_array_placeholder = NumpyArrayPlaceholder()
+                        numpy_array_placeholder.filename = placeholder_filename(
+                            var_name, key_path, {record['filename'] for record in placeholders.values()})
+                        add_array(var_name, numpy_array_placeholder.filename, np_arr)
+                        replacements[key_path] = numpy_array_placeholder
+                        placeholders[_key_repr(key_path)] = {'filename': numpy_array_placeholder.filename}
+
+                    var_info[var_name]['uses_numpy_placeholders'] = len(placeholders) > 0
+                    if len(placeholders) > 0:
+                        # the containers leading to the placeholders are copied, the variable itself is not modified
+                        value = _replace_in_containers(value, replacements, copy_containers=True)
+                        var_info[var_name]['placeholders'] = placeholders
+                        var_info[var_name]['placeholder_depth'] = max(len(key_path) for key_path in replacements)
+                        var_info[var_name]['placeholder_max_keys'] = max_dict_keys
+                        var_info[var_name]['size_before_numpy_placeholders'] = var_info[var_name]['size']
+                        var_info[var_name]['size'] = estimate_obj_size(value)
+
+                pickle_dict[var_name] = value
+                if var_info[var_name]['size'] >= sep_var_min_size:
+                    sep_vars.add(var_name)
+
+            # variables that were skipped during load are copied from the previous file as they are
+            prev_segments = self.__internal__['single_file_segments']
+            prev_path = self.__internal__['attached_folder']
+            for var_name in sorted(self.__internal__['skipped_loading_vars']):
+                info = self.__internal__['var_info'].get(var_name, dict())
+                if prev_segments is None or info.get('filename', MISC_VAR_FILENAME) == MISC_VAR_FILENAME:
+                    continue
+                var_info[var_name] = info
+                for filename in self._var_info_files({var_name: info}) - {MISC_VAR_FILENAME}:
+                    writer.copy_segment(filename, prev_path, prev_segments[filename])
+
+            misc_dict = dict()
+            for var_name in pickle_dict:
+                if var_name in sep_vars:
+                    var_info[var_name]['filename'] = var_name + '.pickle'
+                    add_pickle(var_name, var_name + '.pickle', pickle_dict[var_name])
+                else:
+                    var_info[var_name]['filename'] = MISC_VAR_FILENAME
+                    misc_dict[var_name] = pickle_dict[var_name]
+            add_pickle(MISC_VAR_FILENAME, MISC_VAR_FILENAME, misc_dict)
+
+            # round-trip through json so that var_info is the same as when it is loaded (e.g. lists for shapes)
+            var_info = json.loads(json.dumps(var_info))
+            bytes_written = writer.close(var_info, durable=durable)
+        except:
+            writer.abort()
+            raise
+
+        logger.info('Wrote %d bytes.', bytes_written)
+        for var_name, info in var_info.items():
+            stats.set_kind(var_name, self._storage_kind(info))
+            files = self._var_info_files({var_name: info}) - {MISC_VAR_FILENAME}
+            stats.add_bytes(var_name, bytes_written=sum(writer.segments[f]['length'] for f in files
+                                                         if f in writer.segments))
+        stats.set_kind(MISC_VAR_FILENAME, 'pickle')
+        stats.add_bytes(MISC_VAR_FILENAME, bytes_written=writer.segments[MISC_VAR_FILENAME]['length'])
+        self.__internal__['last_save_stats'] = stats.finish()
+        if attach:
+            self.__internal__['var_info'] = var_info
+            self.__internal__['attached_folder'] = path
+            self.__internal__['format'] = 'single'
+            self.__internal__['single_file_segments'] = writer.segments
+            self.__internal__['assigned_vars'] = set()
+            self.__internal__['size_cache'] = size_cache
+            self.__internal__['last_save_bytes_written'] = bytes_written
+
+    def save_async(self, save_folder=None, **kwargs):
+        """
+        Save the pack in a background thread, see save(). A snapshot of the variables is taken before returning:
+        in-memory numpy arrays and (nested) dicts, lists, tuples and sets are copied, so later modifications of them
+        do not affect the save. Other objects (e.g. custom classes) are shared with the snapshot and should not be
+        modified in place until the save is done. Saves into the same folder are run one after the other, in the order
+        in which save_async() was called; save(), gc() and detach() wait for the pending async saves of the folder.
+
+        Copying the in-memory arrays takes time and memory on the calling thread. Memory-mapped arrays (e.g. of a
+        pack that was saved or loaded) are not copied, and neither are the array variables that have not been
+        assigned since the last save when trust_assignments=True is passed, since they are not saved again.
+        :param save_folder: see save().
+        :param kwargs: key-value arguments passed to save().
+        :return: a SaveFuture, whose result is the number of bytes written. Its varpack attribute is the saved pack
+                 (this one, or the new pack if saved into a different folder).
+        """
+        if save_folder is None:
+            save_folder = self.__internal__['attached_folder']
+        assert save_folder is not None, 'attached folder has not yet been set'
+
+        snapshot = Varpack()
+        for key, value in self.__internal__.items():
+            snapshot.__internal__[key] = copy.copy(value)
+        var_info = self.__internal__['var_info']
+        trusted = kwargs.get('trust_assignments', False) and kwargs.get('incremental', True)
+        memo = dict()
+        for var_name, value in vars(self).items():
+            if var_name == '__internal__':
+                continue
+            if trusted and isinstance(value, np.ndarray) and var_name not in self.__internal__['assigned_vars'] and \
+                    'fingerprint' in var_info.get(var_name, dict()) and \
+                    var_info[var_name].get('filename') == var_name + '.npy':
+                # the save keeps its file without reading the array
+                object.__setattr__(snapshot, var_name, value)
+            else:
+                object.__setattr__(snapshot, var_name, _snapshot_value(value, memo))
+
+        # variables assigned from now on are saved by the next save
+        snapshot_assigned_vars = self.__internal__['assigned_vars']
+        self.__internal__['assigned_vars'] = set()
+        ticket = next(_save_tickets)
+
+        future = SaveFuture()
+        future.set_running_or_notify_cancel()
+        folder_key = os.path.abspath(save_folder)
+        with _async_saves_guard:
+            previous_future = _async_saves.get(folder_key)
+            _async_saves[folder_key] = future
+
+        def run():
+            _save_progress.future = future
+            try:
+                if previous_future is not None:
+                    wait([previous_future])
+                with _folder_lock(save_folder):
+                    # a previous save into the same folder may have finished since the snapshot was taken
+                    for key in ['var_info', 'attached_folder', 'format', 'single_file_segments']:
+                        snapshot.__internal__[key] = copy.copy(self.__internal__[key])
+
+                    saved_varpack = snapshot.save(save_folder, **kwargs)
+                    if saved_varpack is snapshot or saved_varpack is None:
+                        saved_varpack = self
+                        # unless a save of the pack was started after this one (e.g. a synchronous save, which
+                        # waits for this one to finish), the pack now reflects this save
+                        if ticket > self.__internal__['save_ticket']:
+                            self.__internal__['save_ticket'] = ticket
+                            for key in ['var_info', 'attached_folder', 'format', 'single_file_segments',
+                                        'skip_saving_vars', 'last_save_bytes_written', 'last_save_stats']:
+                                self.__internal__[key] = snapshot.__internal__[key]
+            except BaseException as e:
+                self.__internal__['assigned_vars'] |= snapshot_assigned_vars
+                future.set_exception(e)
+            else:
+                future.varpack = saved_varpack
+                future.set_result(saved_varpack.last_save_bytes_written())
+            finally:
+                _save_progress.future = None
+                with _async_saves_guard:
+                    if _async_saves.get(folder_key) is future:
+                        del _async_saves[folder_key]
+
+        # not a daemon thread, so that the interpreter waits for the save to finish on exit
+        threading.Thread(target=run, name='varpack-save').start()
+        return future
+
+    def save_then_copy(self, copy_folder, hardlink=False, **kwargs):
         """
         save into a new folder and then sane
         :param copy_folder: the folder into which attached folder content is copied to.
+        :param hardlink: hard link the files instead of copying them when possible. Only use it if neither pack
+                         is modified in place, e.g. through arrays memory-mapped with mode 'r+'.
         :param args: same arguments as save()
         :return: None
         """
 
         self.save(**kwargs)
-        from distutils.dir_util import copy_tree
-        os.makedirs(copy_folder, exist_ok=True)
+        attached_folder = self.__internal__['attached_folder']
+        with _folder_lock(attached_folder):
+            if self.__internal__['format'] == 'single':
+                logger.info('Copying the attached single-file pack to: %s', copy_folder)
+                fastcopy.copy_file(attached_folder, copy_folder, hardlink=hardlink)
+                return
+
+            os.makedirs(copy_folder, exist_ok=True)
+
+            logger.info('Copying the attached folder to: %s', copy_folder)
+            files = self._var_info_files(self.__internal__['var_info']) | {JSON_FILENAME, BINARY_INDEX_FILENAME}
+            _copy_files(attached_folder, copy_folder,
+                        [f for f in files if os.path.isfile(os.path.join(attached_folder, f))], hardlink=hardlink,
+                        workers=kwargs.get('workers'))
+
+    def _read_index(self, load_folder):
+        # reads the var_info of a pack (and the segments of a single-file pack), without loading any variable
+        if singlefile.is_single_file_pack(load_folder):
+            # the index of a single-file pack has the same var_info as varpack.json
+            index = singlefile.read_index(load_folder)
+            var_info = index['var_info']
+            self.__internal__['var_info'] = var_info
+            self.__internal__['format'] = 'single'
+            self.__internal__['single_file_segments'] = index['segments']
+        else:
+            self.__internal__['format'] = 'folder'
+            self.__internal__['single_file_segments'] = None
+            if os.path.isfile(os.path.join(load_folder, transaction.JOURNAL_FILENAME)):
+                # a save was interrupted after it was committed, complete it first
+                with _folder_lock(load_folder):
+                    transaction.recover(load_folder)
+
+            # read the varpack.json file
+            try:
+                var_info = self._read_json(load_folder)
+                self.__internal__['var_info'] = var_info
+            except EnvironmentError:
+                logger.error('Error when loading %s file.', JSON_FILENAME)
+                raise
+        return var_info
+
+    def _read_array_file(self, folder, filename, index):
+        # reads part of an array saved in a .npy file (or a segment of a single-file pack), see read()
+        segments = self.__internal__['single_file_segments']
+        if segments is not None:
+            segment = segments[filename]
+            return partial.read_array(folder, segment['offset'], segment['shape'], singlefile._segment_dtype(segment),
+                                      index)
+
+        path = os.path.join(folder, filename)
+        with open(path, 'rb') as f:
+            _, shape, fortran_order, dtype, header_size = partial.read_npy_header(f)
+        if dtype.hasobject or (fortran_order and len(shape) > 1):
+            # the rows are not stored contiguously, read the whole array
+            np_arr = np.load(path, allow_pickle=True)
+            if isinstance(index, list) and len(index) > 0 and all(isinstance(i, slice) for i in index):
+                return [np_arr[i] for i in index]
+            return np_arr if index is None else np_arr[index]
+        return partial.read_array(path, header_size, shape, dtype, index)
+
+    def read(self, name, key=None, index=None):
+        """
+        Read part of a numpy array variable from the attached folder (or single-file pack), without memory-mapping or
+        loading anything else: only the rows selected by the first index are read from the file, with positional
+        reads (see partial.py). The variable does not need to be loaded (e.g. it may have been skipped or be lazy).
+        :param name: name of the variable.
+        :param key: for variables that are dictionaries (or lists and tuples), the key of the array to read, which
+                    was saved as a numpy placeholder or with packed storage. A list of keys/indices reads an array of
+                    nested containers, e.g. ['layer1', 'weights']. For tables saved with columnar_tables=True, the
+                    label of the column to read (compared as a string).
+        :param index: numpy-style index of the part of the array to read, e.g. 5, slice(10, 20),
+                      (slice(None, None, 2), 3) or an array of row indices. A list of slices reads several slices in a
+                      single pass and returns a list of arrays. Default: the whole array.
+        :return: a new array (or list of arrays).
+        """
+        folder = self.__internal__['attached_folder']
+        assert folder is not None, 'attached folder has not yet been set'
+        if name not in self.__internal__['var_info']:
+            raise KeyError('Variable %s is not saved in %s.' % (name, folder))
+        info = self.__internal__['var_info'][name]
+
+        if 'compression' in info:
+            compressed_array = self._open_compressed(folder, info)
+            if isinstance(index, list) and len(index) > 0 and all(isinstance(i, slice) for i in index):
+                return [compressed_array[i] for i in index]
+            return np.asarray(compressed_array) if index is None else compressed_array[index]
+
+        if 'table' in info:
+            if key is None:
+                raise ValueError('Variable %s is a table, the label of a column is needed.' % name)
+            if str(key) not in info['table']['labels']:
+                raise KeyError('Table %s has no column %s.' % (name, key))
+            position = info['table']['labels'].index(str(key))
+            record = info['table']['columns'][position]
+            if 'filename' not in record:  # pickled with the metadata of the table
+                column = self._read_pickle_file(folder, info['filename'])['pickled'][position]
+                return np.asarray(column) if index is None else np.asarray(column)[index]
+            info = record
+            if 'strings' not in info:
+                return self._read_array_file(folder, info['filename'], index)
+
+        if 'strings' in info:
+            # only the pages of the selected strings are read from the memory-mapped files
+            string_array = self._load_strings(folder, info, 'r')
+            if isinstance(index, list) and len(index) > 0 and all(isinstance(i, slice) for i in index):
+                return [string_array[i] for i in index]
+            return np.asarray(string_array) if index is None else np.asarray(string_array[index])
+
+        if 'packed' in info:
+            if key is None:
+                raise ValueError('Variable %s is a packed dictionary, a key is needed.' % name)
+            # only the row of the key in the index and the range of its data are read
+            slot = self._read_pickle_file(folder, info['packed']['keys']).index(key)
+            row = self._read_array_file(folder, info['packed']['index'], slot)
+            ndim = int(row[packed.INDEX_NDIM_COLUMN])
+            shape = tuple(int(x) for x in row[packed.INDEX_SHAPE_COLUMN:packed.INDEX_SHAPE_COLUMN + ndim])
+            offset = int(row[packed.INDEX_OFFSET_COLUMN])
+            data = self._read_array_file(folder, info['filename'],
+                                         slice(offset, offset + int(np.prod(shape, dtype=np.int64))))
+            np_arr = data.reshape(shape)
+            if isinstance(index, list) and len(index) > 0 and all(isinstance(i, slice) for i in index):
+                return [np_arr[i] for i in index]
+            return np_arr if index is None else np_arr[index]
+
+        if key is not None:
+            key_path = tuple(key) if isinstance(key, list) else (key,)
+            record = info.get('placeholders', dict()).get(_key_repr(key_path))
+            if record is None:
+                raise KeyError('Variable %s has no array saved as a numpy placeholder at key %s.'
+                               % (name, _key_repr(key_path)))
+            filename = record['filename']
+        else:
+            filename = info['filename']
+            if os.path.splitext(filename)[1] != '.npy':
+                raise ValueError('Variable %s is not saved as a numpy array, load it instead.' % name)
 
-        print('Copying the attached folder to:', copy_folder)
-        copy_tree(self.__internal__['attached_folder'], copy_folder)
+        return self._read_array_file(folder, filename, index)
+
+    def _apply_access_hints(self, var_info, access_hints, background_prefetch):
+        # madvise() the memory-mapped arrays of the hinted (loaded) variables, and prefetch them if requested
+        all_vars = vars(self)
+        prefetched = list()
+        for v, hint in access_hints.items():
+            if v not in all_vars:
+                continue
+            value = all_vars[v]
+            if isinstance(value, PackedArrayDict):
+                np_arrs = [value.data]
+            elif isinstance(value, StringArray):
+                np_arrs = [value.data, value.offsets]
+            elif isinstance(value, np.memmap):
+                np_arrs = [value]
+            else:
+                np_arrs = [np_arr for _, np_arr in _find_in_containers(
+                    value, lambda x: isinstance(x, np.memmap), var_info[v].get('placeholder_depth', 1),
+                    var_info[v].get('placeholder_max_keys', np.inf))] \
+                    if var_info.get(v, dict()).get('uses_numpy_placeholders') else list()
+
+            for np_arr in np_arrs:
+                if isinstance(np_arr, np.memmap):
+                    planner.madvise(np_arr, hint)
+                    if hint in ('hot', 'sequential'):
+                        prefetched.append(np_arr)
+
+        if background_prefetch and len(prefetched) > 0:
+            planner.prefetch_in_background(prefetched)
 
     def load(self, load_folder, numpy_mmap_mode='r+', stop_on_error=True,
-             skip_loading=None, keep_loaded_skips=False):
+             skip_loading=None, keep_loaded_skips=False, lazy=False, workers=None, memory_budget=None,
+             access_hints=None, background_prefetch=False, columns=None):
         """
         Attach to a folder and load data from it.
-        :param load_folder: the varpack folder to load the variables from.
-        :param numpy_mmap_mode: must be 'r+', 'r' or 'c'.
+        :param load_folder: the varpack folder (or single-file pack) to load the variables from.
+        :param numpy_mmap_mode: must be 'r+', 'r' or 'c'. 'r+' is replaced with 'c' for the versions of a
+               VersionedStore, whose files are shared between versions.
                see https://numpy.org/doc/1.18/reference/generated/numpy.memmap.html
         :param stop_on_error: stop if any errors where encountered during load.
         :param skip_loading: a list/set of variable names to skip loading from the folder.
         :param keep_loaded_skips: whether to keep a variable was in __misc__vars.pickle file even if it is in skipped
                                   list. Default: False
+        :param lazy: do not unpickle any variables during load. All variables are still accessible as properties
+                     but each pickle file is only loaded when one of its variables is first accessed, or when it is
+                     loaded explicitly with prefetch(). Numpy arrays are memory-mapped as usual.
+        :param workers: number of threads used to read the files concurrently. Default: DEFAULT_WORKERS.
+        :param memory_budget: number of bytes of variables to keep in memory. Arrays that fit in the budget are read
+                              into memory, the others are memory-mapped, and pickled variables that do not fit are
+                              loaded on first access (as with lazy=True). See planner.plan_load().
+        :param access_hints: a dictionary with the access hint of variables: 'hot', 'sequential' or 'random'. Hot
+                             variables are read into memory first, memory-mapped arrays (including the arrays in
+                             placeholders) are given the matching madvise() hint.
+        :param background_prefetch: read the files of the memory-mapped 'hot' and 'sequential' arrays in a background
+                                    thread, so that their pages are in the page cache when they are accessed.
+        :param columns: a dictionary with the list of the column labels to load of tables saved with
+                        columnar_tables=True, e.g. {'trades': ['price']}. The other columns are not accessible and
+                        their files are not opened. Tables are loaded as Table objects, whose columns are
+                        memory-mapped when they are first accessed.
         :return: None
         """
 
         assert numpy_mmap_mode in ['r+', 'r', 'c'], "numpy_mmap_mode must be 'r+', 'r' or 'c'."
+        if numpy_mmap_mode == 'r+' and versioned.is_version_folder(load_folder):
+            # the files of a version are hard links to blobs shared with the other versions of its store
+            logger.info('%s is a version of a VersionedStore, its arrays are memory-mapped with option c.',
+                        load_folder)
+            numpy_mmap_mode = 'c'
+        self.__internal__['numpy_mmap_mode'] = numpy_mmap_mode
 
         mmap_vars_list = list()  # the list of variables and dictionary fields that have been numpy memory-mapped
 
-        # read the varpack.json file
-        try:
-            with open(os.path.join(load_folder, JSON_FILENAME), 'r') as json_file:
-                var_info = json.load(json_file)
-
-                self.__internal__['var_info'] = var_info
-        except EnvironmentError:
-            print('Error when loading ' + JSON_FILENAME + ' file.')
-            raise
+        var_info = self._read_index(load_folder)
+        stats = IOStats('load', load_folder)
 
         # get all the files where the variables have been saved to (in case there are extra files in the folder)
         files_to_load = set()
@@ -431,69 +2723,280 @@ class Varpack:
                 self.__internal__['skipped_loading_vars'].add(var_name)
             else:
                 files_to_load.add(var_info[var_name]['filename'])
-        files_to_load = list(files_to_load)
+        files_to_load = sorted(files_to_load)
 
         files_with_load_error = list()
+        self.__internal__['lazy_vars'] = dict()
+
+        # variables saved with packed storage, by the file name of their data
+        packed_files = {var_info[v]['filename']: v for v in var_info if 'packed' in var_info[v]}
+        # arrays of strings, by the file name of their data
+        string_files = {var_info[v]['filename']: v for v in var_info if 'strings' in var_info[v]}
+        # tables saved with one file per column, by the file name of their metadata
+        table_files = {var_info[v]['filename']: v for v in var_info if 'table' in var_info[v]}
+        columns = dict() if columns is None else columns
+        for v in columns:
+            if v not in table_files.values():
+                raise ValueError('Variable %s is not a table saved with columnar_tables=True.' % v)
+
+        # which arrays are read into memory, and which pickle files are deferred
+        access_hints = dict() if access_hints is None else access_hints
+        load_plan = planner.plan_load({v: var_info[v] for v in var_info if v not in skip_loading},
+                                      memory_budget, access_hints)
+
+        def mmap_mode_of(var_name):
+            return None if load_plan.get(var_name) == planner.MEMORY else numpy_mmap_mode
+
+        def is_deferred(file_name):
+            file_vars = [v for v in var_info if var_info[v]['filename'] == file_name and v not in skip_loading]
+            return lazy or (len(file_vars) > 0 and all(load_plan.get(v) == planner.DEFER for v in file_vars))
+
+        def timed(var_name, mmap_mode, task):
+            return stats.timed(var_name, 'read' if mmap_mode is None else 'mmap', task)
+
+        def load_npy(file_name):
+            # first try to mmap (unless the plan reads it into memory), otherwise load regularly
+            mmap_mode = mmap_mode_of(os.path.splitext(file_name)[0])
+            try:
+                return self._load_npy_file(load_folder, file_name, mmap_mode), mmap_mode is not None
+            except:
+                return self._load_npy_file(load_folder, file_name, None), False
 
+        # read all the files concurrently, then assign their content in order so that errors are handled
+        # deterministically.
+        read_tasks = list()
         for file_name in files_to_load:
             name, extension = os.path.splitext(file_name)
-            if extension == '.pickle':
-                try:
-                    with open(os.path.join(load_folder, file_name), 'rb') as f:
-                        loaded_vars = pickle.load(f)
-
-                    # transfer the variables to the object
-                    if file_name == MISC_VAR_FILENAME:
-                        for v in loaded_vars:
-                            if v in skip_loading:  # even if the variable was
-                                if keep_loaded_skips:
-                                    print(
-                                        'Variable %s was saved in misc. variables file so it was loaded with them.' % v)
-                                    self.__setattr__(v, loaded_vars[v])
-
-                                    # since we ended up loading it anyways
-                                    self.__internal__['skipped_loading_vars'].remove(v)
-                            else:  # if not in skip list
-                                self.__setattr__(v, loaded_vars[v])
-                    else:  # if it is not the misc_vars file, then assign it directly
-                        self.__setattr__(name, loaded_vars)
+            if file_name in packed_files:
+                v = packed_files[file_name]
+                read_tasks.append(timed(v, mmap_mode_of(v), functools.partial(self._load_packed, load_folder,
+                                                                              var_info[v], mmap_mode_of(v))))
+            elif file_name in string_files:
+                v = string_files[file_name]
+                read_tasks.append(timed(v, mmap_mode_of(v), functools.partial(self._load_strings, load_folder,
+                                                                              var_info[v], mmap_mode_of(v))))
+            elif file_name in table_files:
+                v = table_files[file_name]
+                read_tasks.append(timed(v, None, functools.partial(self._load_table, load_folder, var_info[v],
+                                                                   mmap_mode_of(v), columns.get(v))))
+            elif extension == '.pickle' and is_deferred(file_name):
+                read_tasks.append(None)
+                for v in var_info:
+                    if var_info[v]['filename'] == file_name and v not in skip_loading:
+                        self.__internal__['lazy_vars'][v] = file_name
+            elif extension == '.pickle':
+                read_tasks.append(timed(file_name if file_name == MISC_VAR_FILENAME else name, None,
+                                        functools.partial(self._read_pickle_file, load_folder, file_name)))
+            elif extension == '.npy':
+                read_tasks.append(timed(name, mmap_mode_of(name), functools.partial(load_npy, file_name)))
+            elif extension == '.zchunks':
+                read_tasks.append(timed(name, None, functools.partial(self._open_compressed, load_folder,
+                                                                      var_info[name])))
+            else:
+                read_tasks.append(None)
+                logger.error('Unable to load file %s: Unknown file extension %s .', file_name, extension)
+                files_with_load_error.append(file_name)
+
+        results = _run_parallel([task for task in read_tasks if task is not None], workers)
+        results.reverse()
+
+        for file_name, task in zip(files_to_load, read_tasks):
+            if task is None:
+                continue
 
-                except EnvironmentError:
-                    print('Error when loading ' + file_name + ' file.')
+            name, extension = os.path.splitext(file_name)
+            loaded, error = results.pop()
+            if file_name in packed_files:
+                if error is not None:
+                    raise error
+                if isinstance(loaded.data, np.memmap):
+                    mmap_vars_list.append(packed_files[file_name])
+                else:
+                    stats.add_bytes(packed_files[file_name], bytes_read=loaded.data.nbytes + loaded.index.nbytes)
+                self.__setattr__(packed_files[file_name], loaded)
+            elif file_name in string_files:
+                if error is not None:
+                    raise error
+                if isinstance(loaded.data, np.memmap):
+                    mmap_vars_list.append(string_files[file_name])
+                else:
+                    stats.add_bytes(string_files[file_name], bytes_read=loaded.nbytes)
+                self.__setattr__(string_files[file_name], loaded)
+            elif file_name in table_files:
+                if error is not None:
+                    raise error
+                stats.add_bytes(table_files[file_name], bytes_read=self._stored_size(load_folder, file_name))
+                if mmap_mode_of(table_files[file_name]) is not None:
+                    mmap_vars_list.append(table_files[file_name])
+                self.__setattr__(table_files[file_name], loaded)
+            elif extension == '.zchunks':
+                if error is not None:
+                    raise error
+                self.__setattr__(name, loaded)
+            elif extension == '.pickle':
+                if error is not None:
+                    logger.error('Error when loading %s file.', file_name)
                     if stop_on_error:
                         return None
                     else:
-                        print('Skipping its contents.')
+                        logger.warning('Skipping its contents.')
                         files_with_load_error.append(file_name)
-            elif extension == '.npy':
-                var_name, _ = os.path.splitext(os.path.basename(file_name))
+                    continue
+
+                loaded_vars = loaded
+                stats.add_bytes(file_name if file_name == MISC_VAR_FILENAME else name,
+                                bytes_read=self._stored_size(load_folder, file_name))
+
+                # transfer the variables to the object
+                if file_name == MISC_VAR_FILENAME:
+                    for v in loaded_vars:
+                        if v in skip_loading:  # even if the variable was
+                            if keep_loaded_skips:
+                                logger.info('Variable %s was saved in misc. variables file so it was loaded with them.', v)
+                                self.__setattr__(v, loaded_vars[v])
 
-                # first try to mmap, otherwise load regularly
-                try:
-                    np_arr = np.load(os.path.join(load_folder, file_name), mmap_mode=numpy_mmap_mode)
+                                # since we ended up loading it anyways
+                                self.__internal__['skipped_loading_vars'].remove(v)
+                        else:  # if not in skip list
+                            self.__setattr__(v, loaded_vars[v])
+                else:  # if it is not the misc_vars file, then assign it directly
+                    self.__setattr__(name, loaded_vars)
+            else:
+                if error is not None:
+                    raise error
+
+                var_name, _ = os.path.splitext(os.path.basename(file_name))
+                np_arr, is_mmap = loaded
+                if is_mmap:
                     mmap_vars_list.append(var_name)
-                except:
-                    np_arr = np.load(os.path.join(load_folder, file_name))
+                else:
+                    stats.add_bytes(var_name, bytes_read=np_arr.nbytes)
 
                 self.__setattr__(var_name, np_arr)
-            else:
-                print('Unable to load file %s: Unknown file extension %s .' % (file_name, extension))
-                files_with_load_error.append(file_name)
 
         # go  over all the loaded variables and replace placeholder numpy arrays with mmap ones
         self._replace_numpy_placeholders(var_info, load_folder, numpy_mmap_mode=numpy_mmap_mode,
                                          stop_on_error=stop_on_error,
-                                         mmap_vars_list=mmap_vars_list)
-        self.__internal__['numpy_mmap_mode'] = numpy_mmap_mode
+                                         mmap_vars_list=mmap_vars_list, workers=workers, stats=stats)
+
+        self._apply_access_hints(var_info, access_hints, background_prefetch)
+
+        for var_name in var_info:
+            if var_name not in self.__internal__['skipped_loading_vars']:
+                stats.set_kind(var_name, self._storage_kind(var_info[var_name]))
+        if MISC_VAR_FILENAME in files_to_load:
+            stats.set_kind(MISC_VAR_FILENAME, 'pickle')
+        self.__internal__['last_load_stats'] = stats.finish()
 
-        num_skipped_vars = len(var_info.keys()) - len(vars(self))
+        num_skipped_vars = len(var_info.keys()) - len(vars(self)) - len(self.__internal__['lazy_vars'])
         if num_skipped_vars > 0:
-            print('Skipped loading %d variables.' % num_skipped_vars)
+            logger.info('Skipped loading %d variables.', num_skipped_vars)
+
+        if len(self.__internal__['lazy_vars']) > 0:
+            logger.info('%d pickled variables will be loaded on first access.', len(self.__internal__['lazy_vars']))
 
         if len(mmap_vars_list) > 0:
-            print('The following numpy variables have been memory-mapped with option %s:' % numpy_mmap_mode)
-            print('    ' + str(mmap_vars_list))
+            logger.info('The following numpy variables have been memory-mapped with option %s:', numpy_mmap_mode)
+            logger.info('    %s', mmap_vars_list)
         else:
-            print('No properties has been memory-mapped.')
+            logger.info('No properties has been memory-mapped.')
 
         self.__internal__['attached_folder'] = load_folder
+        self.__internal__['assigned_vars'] = set()
+
+
+def _is_shared_value(value):
+    # whether a value is read from the files of its pack: memory-mapped arrays (other than copy-on-write ones, which
+    # may have been modified in memory only) and read-only proxies
+    if isinstance(value, np.memmap):
+        return value.mode != 'c'
+    return isinstance(value, (CompressedArray, PackedArrayDict, StringArray, Table))
+
+
+def _reattach(attached_folder, skip_loading):
+    # unpickles a pack pickled as a handle, see Varpack.__reduce_ex__(). Pickled variables are only loaded when they
+    # are accessed.
+    return Varpack(attached_folder, numpy_mmap_mode='r', lazy=True, skip_loading=skip_loading)
+
+
+_map_worker_pack = None  # pack shared by the tasks of a map_arrays() worker process
+
+
+def _init_map_worker(varpack):
+    global _map_worker_pack
+    _map_worker_pack = varpack
+
+
+def _map_chunk(varpack, func, name, start, stop):
+    return func(getattr(_map_worker_pack if varpack is None else varpack, name)[start:stop])
+
+
+def map_arrays(varpack, func, names=None, chunk_rows=None, workers=None, processes=False):
+    """
+    Apply a function to chunks of rows of the numpy arrays of a pack, in a thread or process pool.
+    :param varpack: Varpack. With processes=True it should be saved, so that it is sent to the workers as a handle
+                    which re-attaches to its folder (see Varpack.__reduce_ex__()), instead of a copy of its variables.
+    :param func: function called with each chunk (rows start:stop of an array), must be picklable with processes=True.
+    :param names: list of the array variables to map over. Default: all numpy array (and compressed array) variables.
+    :param chunk_rows: number of rows of each chunk. Default: about MAP_CHUNK_BYTES per chunk.
+    :param workers: number of threads or processes. Default: DEFAULT_WORKERS.
+    :param processes: use a process pool instead of a thread pool, e.g. for functions which hold the GIL.
+    :return: dictionary with the list of the results of func for the chunks of each array, in order.
+    """
+    if names is None:
+        names = [v for v, value in vars(varpack).items() if isinstance(value, (np.ndarray, CompressedArray))]
+    workers = DEFAULT_WORKERS if workers is None else workers
+
+    tasks = list()  # (name, start, stop)
+    for name in names:
+        np_arr = getattr(varpack, name)
+        if np_arr.ndim == 0:
+            raise ValueError('Variable %s is a 0-dimensional array, it cannot be split into chunks.' % name)
+        rows = chunk_rows
+        if rows is None:
+            row_nbytes = int(np.prod(np_arr.shape[1:], dtype=np.int64)) * np_arr.dtype.itemsize
+            rows = max(1, MAP_CHUNK_BYTES // max(1, row_nbytes))
+        tasks.extend((name, start, min(start + rows, len(np_arr))) for start in range(0, len(np_arr), rows))
+
+    if processes:
+        executor = ProcessPoolExecutor(max_workers=max(1, workers), initializer=_init_map_worker,
+                                       initargs=(varpack,))
+        shared_varpack = None  # the workers use the pack they received when they started
+    else:
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        shared_varpack = varpack
+    with executor:
+        futures = [executor.submit(_map_chunk, shared_varpack, func, name, start, stop) for name, start, stop in tasks]
+
+    results = {name: list() for name in names}
+    for (name, _, _), future in zip(tasks, futures):
+        results[name].append(future.result())
+    return results
+
+
+def read(pack_path, name, key=None, index=None):
+    """
+    Read part of a numpy array variable of a pack without loading the pack, see Varpack.read().
+    :param pack_path: folder or single-file pack.
+    :return: a new array (or list of arrays).
+    """
+    varpack = Varpack()
+    varpack._read_index(pack_path)
+    varpack.__internal__['attached_folder'] = pack_path
+    return varpack.read(name, key=key, index=index)
+
+
+def convert_pack(src, dst, format='single', **kwargs):
+    """
+    Convert a pack between the folder and the single-file formats.
+    :param src: folder or single-file pack to convert.
+    :param dst: path of the converted pack.
+    :param format: format of the converted pack, 'single' or 'folder'.
+    :param kwargs: key-value arguments passed to save()
+    :return: Varpack attached to dst.
+    """
+    return Varpack(src, numpy_mmap_mode='r').save(save_folder=dst, format=format, **kwargs)
+
+
+from . import versioned
+from .versioned import VersionedStore
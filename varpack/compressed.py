@@ -0,0 +1,233 @@
+import numpy as np
+import mmap
+import bz2
+import lzma
+import zlib
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from . import transaction
+
+# Compressed arrays are split into chunks of rows (along the first axis) of about COMPRESSED_CHUNK_BYTES, which are
+# compressed independently and concatenated into a single .zchunks file. The offset and length of each chunk are
+# stored in varpack.json, so that reading a slice of the array only decompresses the chunks it overlaps.
+
+COMPRESSED_CHUNK_BYTES = 4 * 2 ** 20
+CHUNK_CACHE_SIZE = 16  # number of decompressed chunks kept in memory by each CompressedArray
+
+# name: (compress(data, level), decompress(data), default level). All of them release the GIL, so chunks are
+# compressed in parallel with threads.
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress, 6),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress, 6),
+    'bz2': (lambda data, level: bz2.compress(data, level), bz2.decompress, 9),
+}
+
+
+def _chunk_rows(shape, dtype):
+    row_nbytes = int(np.prod(shape[1:], dtype=np.int64)) * np.dtype(dtype).itemsize
+    return max(1, COMPRESSED_CHUNK_BYTES // max(1, row_nbytes))
+
+
+def write_compressed(path, np_arr, codec='zlib', level=None, workers=1):
+    """
+    Compress a numpy array (not of object dtype) into a .zchunks file. The file is written to a temporary file which
+    then replaces path, so that CompressedArray objects reading the previous file stay valid.
+    :param path: path of the file.
+    :param np_arr: array to compress, it is read one chunk at a time (e.g. from a memory-mapped file).
+    :param codec: 'zlib', 'lzma' or 'bz2'.
+    :param level: compression level. Default: the default of the codec.
+    :param workers: number of threads compressing chunks concurrently.
+    :return: dictionary with the codec, level, chunk_rows and the [offset, length] of each chunk, to be stored in
+             varpack.json.
+    """
+    if codec not in CODECS:
+        raise ValueError('Unknown compression codec %s, must be one of %s.' % (codec, sorted(CODECS)))
+    compress, _, default_level = CODECS[codec]
+    if level is None:
+        level = default_level
+
+    if np_arr.ndim == 0:
+        np_arr = np_arr.reshape(1)
+        num_rows, chunk_rows = 1, 1
+    else:
+        num_rows, chunk_rows = np_arr.shape[0], _chunk_rows(np_arr.shape, np_arr.dtype)
+
+    def compress_chunk(start):
+        return compress(np.ascontiguousarray(np_arr[start:start + chunk_rows]).tobytes(), level)
+
+    chunks = list()
+    offset = 0
+    starts = list(range(0, num_rows, chunk_rows))
+    tmp_path = transaction.temp_path(path)
+    with open(tmp_path, 'wb') as f, ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # a few chunks per thread at a time, so that memory use is bounded for arrays larger than memory
+        batch_size = max(1, workers) * 2
+        for i in range(0, len(starts), batch_size):
+            for data in executor.map(compress_chunk, starts[i:i + batch_size]):
+                f.write(data)
+                chunks.append([offset, len(data)])
+                offset += len(data)
+    transaction.finish(tmp_path, path)
+
+    return {'codec': codec, 'level': level, 'chunk_rows': chunk_rows, 'chunks': chunks}
+
+
+class CompressedArray:
+    """
+    Read-only array-like proxy of a compressed array (see write_compressed()). Indexing it (e.g. x[10:20] or
+    x[5, :3]) only decompresses the chunks that the first index overlaps, the most recently used chunks are cached.
+    np.asarray(x) decompresses the whole array.
+    """
+
+    def __init__(self, path, shape, dtype, compression, cache_size=CHUNK_CACHE_SIZE):
+        """
+        :param path: .zchunks file.
+        :param shape: shape of the array.
+        :param dtype: dtype of the array.
+        :param compression: the dictionary returned by write_compressed().
+        :param cache_size: maximum number of decompressed chunks kept in memory.
+        """
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.compression = compression
+        self.cache_size = cache_size
+        self._init_file()
+
+    def _init_file(self):
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        # the file is mapped when opened, so that the chunks can still be read if it is later replaced by a new save
+        self._mmap = None
+        if len(self.compression['chunks']) > 0:
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['_lock', '_cache', '_mmap']:
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_file()
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    @property
+    def compressed_nbytes(self):
+        return sum(length for _, length in self.compression['chunks'])
+
+    def __len__(self):
+        if self.ndim == 0:
+            raise TypeError('len() of unsized object')
+        return self.shape[0]
+
+    def __repr__(self):
+        return '%s(shape=%s, dtype=%s, codec=%s)' % (type(self).__name__, self.shape, self.dtype,
+                                                      self.compression['codec'])
+
+    def _chunk(self, i):
+        with self._lock:
+            if i in self._cache:
+                self._cache.move_to_end(i)
+                return self._cache[i]
+
+        offset, length = self.compression['chunks'][i]
+        decompress = CODECS[self.compression['codec']][1]
+        chunk = np.frombuffer(decompress(self._mmap[offset:offset + length]), dtype=self.dtype)
+        chunk = chunk.reshape((-1,) + self.shape[1:])
+
+        with self._lock:
+            self._cache[i] = chunk
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return chunk
+
+    def read_rows(self, start, stop):
+        """
+        :return: a (new) array with the rows start:stop, only decompressing the chunks they overlap.
+        """
+        if self.ndim == 0:
+            return self._chunk(0).reshape(()).copy()
+        start, stop, _ = slice(start, stop).indices(self.shape[0])
+        stop = max(start, stop)
+        out = np.empty((stop - start,) + self.shape[1:], dtype=self.dtype)
+        chunk_rows = self.compression['chunk_rows']
+        for i in range(start // chunk_rows, (stop + chunk_rows - 1) // chunk_rows):
+            chunk_start = i * chunk_rows
+            lo, hi = max(start, chunk_start), min(stop, chunk_start + chunk_rows)
+            out[lo - start:hi - start] = self._chunk(i)[lo - chunk_start:hi - chunk_start]
+        return out
+
+    def take_rows(self, rows):
+        """
+        :param rows: array of row indices (non-negative).
+        :return: a (new) array with the rows, only decompressing the chunks they are in.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty(rows.shape + self.shape[1:], dtype=self.dtype)
+        chunk_rows = self.compression['chunk_rows']
+        chunk_ids = rows // chunk_rows
+        for i in np.unique(chunk_ids):
+            in_chunk = chunk_ids == i
+            out[in_chunk] = self._chunk(int(i))[rows[in_chunk] - i * chunk_rows]
+        return out
+
+    def __getitem__(self, key):
+        if self.ndim == 0:
+            return self.read_rows(0, 1)[key]
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, rest = (key[0], key[1:]) if len(key) > 0 else (slice(None), ())
+
+        if isinstance(first, (int, np.integer)):
+            row = int(first) + self.shape[0] if first < 0 else int(first)
+            if not 0 <= row < self.shape[0]:
+                raise IndexError('index %d is out of bounds for axis 0 with size %d' % (first, self.shape[0]))
+            return self.read_rows(row, row + 1)[(0,) + rest]
+
+        if isinstance(first, slice):
+            rows = np.arange(*first.indices(self.shape[0]))
+        elif first is Ellipsis or first is None:
+            return self.read_rows(0, self.shape[0])[key]
+        else:
+            rows = np.asarray(first)
+            if rows.dtype == bool:
+                rows = np.flatnonzero(rows)
+            rows = np.where(rows < 0, rows + self.shape[0], rows)
+
+        if rows.size == 0:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+        if rows.min() < 0 or rows.max() >= self.shape[0]:
+            raise IndexError('index out of bounds for axis 0 with size %d' % self.shape[0])
+        if isinstance(first, slice) and first.step in (None, 1):
+            return self.read_rows(int(rows[0]), int(rows[-1]) + 1)[(slice(None),) + rest]
+        return self.take_rows(rows)[(slice(None),) + rest]
+
+    def __array__(self, dtype=None, copy=None):
+        np_arr = self.read_rows(0, None)
+        return np_arr if dtype is None else np_arr.astype(dtype, copy=False)
+
+    def copy_to(self, path):
+        """
+        Write the compressed file of the array to path (through a temporary file which then replaces path).
+        """
+        tmp_path = transaction.temp_path(path)
+        with open(tmp_path, 'wb') as f:
+            if self._mmap is not None:
+                f.write(self._mmap[:self.compressed_nbytes])
+        transaction.finish(tmp_path, path)
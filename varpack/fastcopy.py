@@ -0,0 +1,105 @@
+import os
+import sys
+import shutil
+
+from . import transaction
+
+# Copies files with the fastest method supported by the platform and filesystem:
+#   reflink:         FICLONE ioctl (Linux: btrfs, xfs, ...), the copy shares the blocks of the source copy-on-write
+#   copy_file_range: in-kernel copy (Linux, Python 3.8+), may also share blocks on filesystems that support it
+#   sendfile:        in-kernel copy (Linux)
+#   chunked:         read/write in blocks of COPY_CHUNK_BYTES
+# Hard links are only used on request, since a file modified in place (e.g. through a memory-mapped array opened
+# with mode 'r+') would then be modified in both copies.
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int)
+COPY_CHUNK_BYTES = 64 * 2 ** 20
+
+
+def _reflink(fsrc, fdst, size):
+    try:
+        import fcntl
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _copy_file_range(fsrc, fdst, size):
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(size - copied, COPY_CHUNK_BYTES))
+            if n == 0:
+                break
+            copied += n
+    except OSError:
+        if copied > 0:
+            raise
+        return False
+    return copied == size
+
+
+def _sendfile(fsrc, fdst, size):
+    # sendfile() to a regular file is only supported on Linux
+    if not hasattr(os, 'sendfile') or not sys.platform.startswith('linux'):
+        return False
+    copied = 0
+    try:
+        while copied < size:
+            n = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, min(size - copied, COPY_CHUNK_BYTES))
+            if n == 0:
+                break
+            copied += n
+    except OSError:
+        if copied > 0:
+            raise
+        return False
+    return copied == size
+
+
+def _chunked(fsrc, fdst, size):
+    shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_BYTES)
+    return True
+
+
+def copy_file(src, dst, hardlink=False):
+    """
+    Copy a file. The copy is written to a temporary file which then replaces dst, so that memory maps of a previous
+    dst file stay valid (or is staged by the transaction of a save into the folder of dst, see transaction.py).
+    :param src: source file.
+    :param dst: destination file.
+    :param hardlink: hard link dst to src if possible, instead of copying it.
+    :return: the method used: 'hardlink', 'reflink', 'copy_file_range', 'sendfile' or 'chunked'.
+    """
+    tmp_dst = transaction.temp_path(dst)
+    if hardlink:
+        try:
+            if os.path.lexists(tmp_dst):
+                os.remove(tmp_dst)
+            os.link(src, tmp_dst)
+            transaction.finish(tmp_dst, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+
+    methods = [('reflink', _reflink), ('copy_file_range', _copy_file_range), ('sendfile', _sendfile),
+               ('chunked', _chunked)]
+    try:
+        with open(src, 'rb') as fsrc, open(tmp_dst, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            for method, copy in methods:
+                if copy(fsrc, fdst, size):
+                    break
+                # a failed attempt may have written part of the file
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        transaction.finish(tmp_dst, dst)
+    except:
+        if os.path.lexists(tmp_dst):
+            os.remove(tmp_dst)
+        raise
+    return method
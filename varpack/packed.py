@@ -0,0 +1,109 @@
+import numpy as np
+import collections.abc
+
+# A packed array dictionary stores the values of a dictionary of numpy arrays of the same dtype as three parts:
+#   data:  the values concatenated (flattened, in C order) into a single 1-D array
+#   index: an int64 array with a row per key: offset of the value in data, its number of dimensions and its shape
+#          (padded with zeros up to the largest number of dimensions)
+#   keys:  the list of keys, in the same order as the rows of index
+# so that dictionaries with millions of keys are saved in a few files, and loaded without unpickling the arrays.
+
+INDEX_OFFSET_COLUMN = 0
+INDEX_NDIM_COLUMN = 1
+INDEX_SHAPE_COLUMN = 2
+
+
+def is_packable(obj, min_keys):
+    """
+    :param obj: variable to check.
+    :param min_keys: minimum number of keys for a dictionary to be packed.
+    :return: whether obj is a dictionary of at least min_keys numpy arrays (not memory-mapped) of the same dtype, which
+             does not have object fields.
+    """
+    if type(obj) is not dict or len(obj) < min_keys or len(obj) == 0:
+        return False
+
+    dtype = None
+    for value in obj.values():
+        if type(value) is not np.ndarray:
+            return False
+        if dtype is None:
+            dtype = value.dtype
+            if dtype.hasobject:
+                return False
+        elif value.dtype != dtype:
+            return False
+    return True
+
+
+def pack_arrays(obj):
+    """
+    :param obj: a dictionary for which is_packable() is True, or a PackedArrayDict.
+    :return: data, index and keys of the packed dictionary.
+    """
+    if isinstance(obj, PackedArrayDict):
+        return obj.data, obj.index, obj.key_list
+
+    keys = list(obj)
+    values = list(obj.values())
+    max_ndim = max(value.ndim for value in values)
+    index = np.zeros((len(values), INDEX_SHAPE_COLUMN + max_ndim), dtype=np.int64)
+    offset = 0
+    for i, value in enumerate(values):
+        index[i, INDEX_OFFSET_COLUMN] = offset
+        index[i, INDEX_NDIM_COLUMN] = value.ndim
+        index[i, INDEX_SHAPE_COLUMN:INDEX_SHAPE_COLUMN + value.ndim] = value.shape
+        offset += value.size
+
+    data = np.empty(offset, dtype=values[0].dtype)
+    for i, value in enumerate(values):
+        data[index[i, INDEX_OFFSET_COLUMN]:index[i, INDEX_OFFSET_COLUMN] + value.size] = value.reshape(-1)
+    return data, index, keys
+
+
+class PackedArrayDict(collections.abc.Mapping):
+    """
+    Read-only dictionary of numpy arrays backed by a packed (usually memory-mapped) data array. Values are read-only
+    views into the data array, created when they are accessed. Use dict(packed_array_dict) to get a regular
+    dictionary of the views, e.g. to add or remove keys.
+    """
+
+    def __init__(self, data, index, keys):
+        """
+        :param data: 1-D array with the concatenated values.
+        :param index: int64 array with the offset, number of dimensions and shape of each value, see pack_arrays().
+        :param keys: list of the keys.
+        """
+        self.data = data
+        self.index = index
+        self.key_list = list(keys)
+        self._slots = None  # key -> row of index, created on the first lookup
+
+    def _slot(self, key):
+        if self._slots is None:
+            self._slots = {k: i for i, k in enumerate(self.key_list)}
+        return self._slots[key]
+
+    def __getitem__(self, key):
+        row = self.index[self._slot(key)]
+        offset, ndim = int(row[INDEX_OFFSET_COLUMN]), int(row[INDEX_NDIM_COLUMN])
+        shape = tuple(int(x) for x in row[INDEX_SHAPE_COLUMN:INDEX_SHAPE_COLUMN + ndim])
+        view = self.data[offset:offset + int(np.prod(shape, dtype=np.int64))].reshape(shape)
+        view.flags.writeable = False
+        return view
+
+    def __contains__(self, key):
+        try:
+            self._slot(key)
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        return iter(self.key_list)
+
+    def __len__(self):
+        return len(self.key_list)
+
+    def __repr__(self):
+        return '%s(%d arrays of %s)' % (type(self).__name__, len(self), self.data.dtype)
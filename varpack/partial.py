@@ -0,0 +1,133 @@
+import numpy as np
+import os
+
+# Reads parts of C-ordered arrays stored in files (.npy files or array segments of single-file packs) without memory
+# mapping or reading the whole file: the rows that are read are grouped into runs of consecutive rows, and each run is
+# read with a single positional read (os.preadv/os.pread when available) directly into the output array.
+
+
+def read_npy_header(f):
+    """
+    :param f: .npy file opened in binary mode, at its beginning.
+    :return: version, shape, fortran_order, dtype and size of the header (i.e. offset of the data).
+    """
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    return version, shape, fortran_order, dtype, f.tell()
+
+
+def _pread_into(f, buffer, offset):
+    # fills buffer (a writable memoryview of bytes) with the bytes of f starting at offset
+    done = 0
+    while done < len(buffer):
+        if hasattr(os, 'preadv'):
+            n = os.preadv(f.fileno(), [buffer[done:]], offset + done)
+        elif hasattr(os, 'pread'):
+            data = os.pread(f.fileno(), len(buffer) - done, offset + done)
+            buffer[done:done + len(data)] = data
+            n = len(data)
+        else:
+            f.seek(offset + done)
+            n = f.readinto(buffer[done:])
+        if n == 0:
+            raise EOFError('File %s is shorter than expected.' % f.name)
+        done += n
+
+
+def read_rows(path, data_offset, shape, dtype, rows):
+    """
+    Read rows (along the first axis) of a C-ordered array stored in a file.
+    :param path: file.
+    :param data_offset: offset of the array data in the file.
+    :param shape: shape of the array.
+    :param dtype: dtype of the array.
+    :param rows: array of row indices, within [0, shape[0]).
+    :return: a new array of shape (len(rows),) + shape[1:].
+    """
+    dtype = np.dtype(dtype)
+    rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+    row_nbytes = int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize
+    if np.all(np.diff(rows) > 0):  # e.g. slices with a positive step
+        unique_rows, inverse = rows, None
+    else:
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+    out = np.empty((len(unique_rows),) + tuple(shape[1:]), dtype=dtype)
+
+    if row_nbytes > 0 and len(unique_rows) > 0:
+        out_bytes = memoryview(out.reshape(-1).view(np.uint8))
+        # runs of consecutive rows are read at once
+        run_starts = np.flatnonzero(np.diff(unique_rows) != 1) + 1
+        run_stops = np.concatenate([run_starts, [len(unique_rows)]])
+        with open(path, 'rb') as f:
+            for start, stop in zip(np.concatenate([[0], run_starts]), run_stops):
+                _pread_into(f, out_bytes[start * row_nbytes:stop * row_nbytes],
+                            data_offset + int(unique_rows[start]) * row_nbytes)
+
+    return out if inverse is None else out[inverse.reshape(-1)]
+
+
+def _index_rows(index, num_rows):
+    # rows selected by an index of the first axis, and whether the axis is removed (integer index)
+    if isinstance(index, (int, np.integer)):
+        row = int(index) + num_rows if index < 0 else int(index)
+        if not 0 <= row < num_rows:
+            raise IndexError('index %d is out of bounds for axis 0 with size %d' % (index, num_rows))
+        return np.array([row]), True
+    if isinstance(index, slice):
+        return np.arange(*index.indices(num_rows)), False
+
+    rows = np.asarray(index)
+    if rows.dtype == bool:
+        if rows.shape != (num_rows,):
+            raise IndexError('boolean index of shape %s does not match axis 0 of size %d' % (rows.shape, num_rows))
+        return np.flatnonzero(rows), False
+    if rows.dtype.kind not in 'iu':
+        raise IndexError('only integers, slices, and integer or boolean arrays are valid indices')
+    rows = np.where(rows < 0, rows + num_rows, rows).astype(np.int64)
+    if rows.size > 0 and (rows.min() < 0 or rows.max() >= num_rows):
+        raise IndexError('index out of bounds for axis 0 with size %d' % num_rows)
+    return rows, False
+
+
+def read_array(path, data_offset, shape, dtype, index=None):
+    """
+    Read part of a C-ordered array stored in a file, only reading the rows selected by the first index.
+    :param path: file.
+    :param data_offset: offset of the array data in the file.
+    :param shape: shape of the array.
+    :param dtype: dtype of the array.
+    :param index: numpy-style index, e.g. 5, slice(10, 20), (slice(None, None, 2), 3) or an array of row indices.
+                  A list of slices reads several slices at once (e.g. for random-row sampling) and returns a list of
+                  arrays. Default: the whole array.
+    :return: array (or list of arrays).
+    """
+    shape = tuple(shape)
+    if isinstance(index, list) and len(index) > 0 and all(isinstance(i, slice) for i in index):
+        if len(shape) == 0:
+            raise IndexError('too many indices for a 0-dimensional array')
+        # all the slices are read in a single pass over the file
+        rows = [np.arange(*i.indices(shape[0])) for i in index]
+        out = read_rows(path, data_offset, shape, dtype, np.concatenate(rows))
+        return np.split(out, np.cumsum([len(r) for r in rows])[:-1])
+
+    if len(shape) == 0:
+        out = read_rows(path, data_offset, (1,), dtype, [0]).reshape(())
+        return out if index is None else out[index]
+
+    if index is None:
+        index = slice(None)
+    if isinstance(index, tuple):
+        first, rest = (index[0], index[1:]) if len(index) > 0 else (slice(None), ())
+    else:
+        first, rest = index, ()
+    if first is Ellipsis or first is None:
+        return read_rows(path, data_offset, shape, dtype, np.arange(shape[0]))[index]
+
+    rows, squeeze = _index_rows(first, shape[0])
+    out = read_rows(path, data_offset, shape, dtype, rows).reshape(rows.shape + shape[1:])
+    if squeeze:
+        return out[(0,) + rest]
+    return out[(slice(None),) + rest] if len(rest) > 0 else out
@@ -0,0 +1,146 @@
+import numpy as np
+import os
+import mmap
+import threading
+
+# Load planning: decides, from the sizes recorded in var_info, which arrays are read into memory and which are
+# memory-mapped, and which pickle files are unpickled during load and which are deferred to their first access.
+#
+# Access hints:
+#   'hot':        accessed often, read into memory first (or mapped with MADV_WILLNEED if it does not fit)
+#   'sequential': read from start to end, memory-mapped with MADV_SEQUENTIAL
+#   'random':     accessed at random positions, memory-mapped with MADV_RANDOM
+
+ACCESS_HINTS = ('hot', 'sequential', 'random')
+SMALL_ARRAY_BYTES = 2 ** 20  # arrays up to this size are read into memory when the memory budget allows it
+PREFETCH_CHUNK_BYTES = 16 * 2 ** 20  # files are read in blocks of this size by background prefetching
+
+# actions of a load plan
+MEMORY = 'memory'  # arrays are read into memory, pickled variables are unpickled during load
+MMAP = 'mmap'  # arrays are memory-mapped
+DEFER = 'defer'  # pickled variables are unpickled on first access (see load(lazy=True))
+
+MADVISE_FLAGS = {'hot': 'MADV_WILLNEED', 'sequential': 'MADV_SEQUENTIAL', 'random': 'MADV_RANDOM'}
+
+
+def _is_array(info):
+    # arrays saved in .npy files (or segments), packed dictionaries and tables, which can be memory-mapped
+    return 'packed' in info or 'table' in info or \
+        (os.path.splitext(info.get('filename', ''))[1] == '.npy' and 'compression' not in info)
+
+
+def plan_load(var_info, memory_budget=None, access_hints=None):
+    """
+    Decide how to load each variable of a pack.
+    :param var_info: var_info of the pack (only the variables to load).
+    :param memory_budget: maximum number of bytes of variables to keep in memory, as estimated by their size in
+                          var_info. Variables are given memory in this order: 'hot' variables, pickled variables
+                          (smallest first), and small arrays (up to SMALL_ARRAY_BYTES, unless hinted 'sequential' or
+                          'random'). Pickled variables that do not fit are deferred, arrays that are not read into
+                          memory are memory-mapped. The variables of the misc. variables file are loaded or deferred
+                          together. Default: no budget, all pickled variables are loaded, arrays are memory-mapped
+                          unless they are 'hot'.
+    :param access_hints: a dictionary with the access hint of variables, see ACCESS_HINTS.
+    :return: a dictionary with the action for each variable: MEMORY, MMAP or DEFER. Compressed arrays are not
+             included, they are always loaded as CompressedArray proxies.
+    """
+    access_hints = dict() if access_hints is None else access_hints
+    for name, hint in access_hints.items():
+        if hint not in ACCESS_HINTS:
+            raise ValueError('Unknown access hint %s for variable %s, must be one of %s.' % (hint, name,
+                                                                                            ACCESS_HINTS))
+
+    # units that are loaded together: an array, or the variables of a pickle file
+    units = dict()
+    for name, info in var_info.items():
+        if 'compression' in info:
+            continue
+        key = name if _is_array(info) else info['filename']
+        units.setdefault(key, {'names': [], 'size': 0, 'is_array': _is_array(info), 'hot': False})
+        units[key]['names'].append(name)
+        units[key]['size'] += int(info.get('size') or 0)
+        units[key]['hot'] |= access_hints.get(name) == 'hot'
+
+    plan = dict()
+    if memory_budget is None:
+        for unit in units.values():
+            action = (MEMORY if unit['hot'] else MMAP) if unit['is_array'] else MEMORY
+            plan.update((name, action) for name in unit['names'])
+        return plan
+
+    def priority(unit):
+        if unit['hot']:
+            return 0
+        if not unit['is_array']:
+            return 1
+        if unit['size'] <= SMALL_ARRAY_BYTES and access_hints.get(unit['names'][0]) not in ('sequential', 'random'):
+            return 2
+        return None
+
+    remaining = memory_budget
+    candidates = sorted((u for u in units.values() if priority(u) is not None),
+                        key=lambda u: (priority(u), u['size'], u['names'][0]))
+    for unit in units.values():
+        plan.update((name, MMAP if unit['is_array'] else DEFER) for name in unit['names'])
+    for unit in candidates:
+        if unit['size'] <= remaining:
+            remaining -= unit['size']
+            plan.update((name, MEMORY) for name in unit['names'])
+    return plan
+
+
+def _base_mmap(np_arr):
+    # the mmap.mmap object backing a memory-mapped array, if any
+    base = np_arr
+    while base is not None and not isinstance(base, mmap.mmap):
+        base = getattr(base, '_mmap', None) if isinstance(base, np.memmap) and base._mmap is not None \
+            else getattr(base, 'base', None)
+    return base
+
+
+def madvise(np_arr, hint):
+    """
+    Give the kernel an access hint for a memory-mapped array (where supported).
+    :param np_arr: memory-mapped array.
+    :param hint: one of ACCESS_HINTS.
+    :return: whether the hint was given.
+    """
+    mm = _base_mmap(np_arr)
+    flag = getattr(mmap, MADVISE_FLAGS[hint], None)
+    if mm is None or flag is None or not hasattr(mm, 'madvise'):
+        return False
+    try:
+        mm.madvise(flag)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def _prefetch_files(ranges):
+    # reads the (path, offset, length) ranges, so that their pages are in the page cache when they are accessed
+    buffer = bytearray(PREFETCH_CHUNK_BYTES)
+    for path, offset, length in ranges:
+        try:
+            with open(path, 'rb', buffering=0) as f:
+                f.seek(offset)
+                while length > 0:
+                    n = f.readinto(memoryview(buffer)[:min(length, len(buffer))])
+                    if not n:
+                        break
+                    length -= n
+        except EnvironmentError:
+            pass
+
+
+def prefetch_in_background(np_arrs):
+    """
+    Read the files of memory-mapped arrays in a background thread, so that their pages are in the page cache when
+    they are accessed.
+    :param np_arrs: list of memory-mapped arrays.
+    :return: the (daemon) thread.
+    """
+    ranges = [(np_arr.filename, np_arr.offset, np_arr.nbytes) for np_arr in np_arrs
+              if isinstance(np_arr, np.memmap) and np_arr.filename is not None]
+    thread = threading.Thread(target=_prefetch_files, args=(ranges,), name='varpack-prefetch', daemon=True)
+    thread.start()
+    return thread
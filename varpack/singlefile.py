@@ -0,0 +1,181 @@
+import numpy as np
+import os
+import json
+import mmap
+import struct
+
+from . import transaction
+
+# Single-file pack layout:
+#   header:   magic (8 bytes), index offset and index length (little-endian uint64 each)
+#   segments: raw C-ordered array data and pickled blobs, each starting at a multiple of SEGMENT_ALIGNMENT so that
+#             arrays can be memory-mapped in place
+#   index:    JSON with the var_info of the pack and the offset, length and type of each segment
+
+SINGLE_FILE_MAGIC = b'VARPACK\x01'
+HEADER_FORMAT = '<8sQQ'
+SEGMENT_ALIGNMENT = max(4096, mmap.ALLOCATIONGRANULARITY)
+WRITE_CHUNK_BYTES = 64 * 2 ** 20  # arrays are written in blocks of about this size
+
+
+def is_single_file_pack(path):
+    """
+    :param path: path to a file or folder.
+    :return: whether path is a single-file pack.
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(SINGLE_FILE_MAGIC)) == SINGLE_FILE_MAGIC
+
+
+class SingleFileWriter:
+    """
+    Writes a single-file pack. Data is written to a temporary file which replaces path on close(), so that arrays
+    that are memory-mapped from a previous version of the file stay valid.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.segments = dict()
+        self.file = open(self.tmp_path, 'wb')
+        self.file.write(b'\0' * SEGMENT_ALIGNMENT)  # header, written on close()
+
+    def _align(self):
+        offset = self.file.tell()
+        if offset % SEGMENT_ALIGNMENT != 0:
+            self.file.write(b'\0' * (SEGMENT_ALIGNMENT - offset % SEGMENT_ALIGNMENT))
+        return self.file.tell()
+
+    def add_array(self, name, np_arr):
+        """
+        Write a numpy array (not of object dtype) as a raw segment. Memory-mapped arrays are streamed in blocks.
+        :return: number of bytes written.
+        """
+        offset = self._align()
+        if np_arr.ndim == 0 or np_arr.size == 0:
+            self.file.write(np.ascontiguousarray(np_arr).tobytes())
+        else:
+            rows_per_block = max(1, WRITE_CHUNK_BYTES // max(1, np_arr[0].nbytes))
+            for start in range(0, np_arr.shape[0], rows_per_block):
+                block = np.ascontiguousarray(np_arr[start:start + rows_per_block])
+                self.file.write(block.reshape(-1).view(np.uint8))
+
+        self.segments[name] = {'kind': 'array', 'offset': offset, 'length': np_arr.nbytes,
+                               'dtype': np_arr.dtype.str if np_arr.dtype.names is None else np_arr.dtype.descr,
+                               'shape': list(np_arr.shape)}
+        return np_arr.nbytes
+
+    def copy_segment(self, name, src_path, segment):
+        """
+        Copy a segment of another single-file pack as it is, without decoding it.
+        :return: number of bytes written.
+        """
+        offset = self._align()
+        with open(src_path, 'rb') as f:
+            f.seek(segment['offset'])
+            remaining = segment['length']
+            while remaining > 0:
+                data = f.read(min(remaining, WRITE_CHUNK_BYTES))
+                if len(data) == 0:
+                    raise EOFError('Segment %s of %s is truncated.' % (name, src_path))
+                self.file.write(data)
+                remaining -= len(data)
+
+        self.segments[name] = dict(segment, offset=offset)
+        return segment['length']
+
+    def add_blob(self, name, data):
+        """
+        Write a blob of bytes (e.g. a pickled variable) as a segment.
+        :return: number of bytes written.
+        """
+        offset = self._align()
+        self.file.write(data)
+        self.segments[name] = {'kind': 'blob', 'offset': offset, 'length': len(data)}
+        return len(data)
+
+    def close(self, var_info, durable=False):
+        """
+        Write the index and the header, and move the file in place.
+        :param var_info: var_info of the pack, stored in the index.
+        :param durable: flush the file and its rename to disk, so that the new file survives a crash once close()
+                        returns.
+        :return: total size of the file.
+        """
+        index = json.dumps({'var_info': var_info, 'segments': self.segments}).encode('utf-8')
+        index_offset = self._align()
+        self.file.write(index)
+        size = self.file.tell()
+
+        self.file.seek(0)
+        self.file.write(struct.pack(HEADER_FORMAT, SINGLE_FILE_MAGIC, index_offset, len(index)))
+        self.file.flush()
+        if durable:
+            os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        if durable:
+            transaction.fsync_folder(os.path.dirname(os.path.abspath(self.path)))
+        return size
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmp_path)
+
+
+def read_index(path):
+    """
+    :param path: single-file pack.
+    :return: index of the pack, a dictionary with 'var_info' and 'segments' keys.
+    """
+    with open(path, 'rb') as f:
+        magic, index_offset, index_length = struct.unpack(HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != SINGLE_FILE_MAGIC:
+            raise ValueError('%s is not a single-file pack.' % path)
+        f.seek(index_offset)
+        return json.loads(f.read(index_length).decode('utf-8'))
+
+
+def _descr_from_json(descr):
+    # JSON turns the tuples of a structured dtype descr (name, dtype[, shape]) into lists, turn them back
+    if not isinstance(descr, list):
+        return descr
+    fields = list()
+    for field in descr:
+        name = tuple(field[0]) if isinstance(field[0], list) else field[0]
+        fields.append((name, _descr_from_json(field[1])) + tuple(tuple(x) for x in field[2:]))
+    return fields
+
+
+def _segment_dtype(segment):
+    return np.dtype(_descr_from_json(segment['dtype']))
+
+
+def open_array(path, segment, mmap_mode):
+    """
+    Memory-map (zero-copy) an array segment, or read it into memory if mmap_mode is None.
+    :param path: single-file pack.
+    :param segment: the segment entry of the index.
+    :param mmap_mode: 'r+', 'r', 'c' or None.
+    :return: numpy array.
+    """
+    dtype = _segment_dtype(segment)
+    shape = tuple(segment['shape'])
+    if mmap_mode is None or segment['length'] == 0:
+        with open(path, 'rb') as f:
+            f.seek(segment['offset'])
+            return np.frombuffer(f.read(segment['length']), dtype=dtype).reshape(shape).copy()
+    return np.memmap(path, dtype=dtype, mode=mmap_mode, offset=segment['offset'], shape=shape)
+
+
+def read_blob(path, segment):
+    """
+    :param path: single-file pack.
+    :param segment: the segment entry of the index.
+    :return: the bytes of a blob segment.
+    """
+    with open(path, 'rb') as f:
+        f.seek(segment['offset'])
+        return f.read(segment['length'])
@@ -0,0 +1,209 @@
+import time
+import threading
+import contextlib
+import logging
+import sys
+
+# Instrumentation of saves and loads. Each save/load collects an IOStats object with, for each variable, the time
+# spent in each phase, the bytes written/read and how it was stored. It is available afterwards from
+# Varpack.last_save_stats() / Varpack.last_load_stats(), and is passed to the hooks added with add_stats_hook().
+#
+# Phases:
+#   sizing:      estimating the in-memory size of the variable (to decide whether to save it in a separate file)
+#   hash:        computing the content fingerprint of the variable (for incremental saves)
+#   serialize:   pickling, packing or encoding the variable
+#   write:       writing its files (including compression)
+#   read:        reading (and unpickling) its files into memory
+#   mmap:        memory-mapping its files
+#   fsync:       flushing its files to disk (saves with durable=True)
+#
+# Progress messages are logged to the 'varpack' logger, which prints them to stdout by default. set_verbose(False)
+# silences them, which also saves the time of formatting them (e.g. for packs with thousands of placeholders).
+
+PHASES = ('sizing', 'hash', 'serialize', 'write', 'read', 'mmap', 'fsync')
+
+logger = logging.getLogger('varpack')
+_default_handler = logging.StreamHandler(sys.stdout)
+_default_handler.setFormatter(logging.Formatter('%(message)s'))
+logger.addHandler(_default_handler)
+logger.setLevel(logging.INFO)
+logger.propagate = False  # the default handler already prints the messages, see use_default_handler()
+
+_hooks = list()
+
+
+def set_verbose(verbose=True):
+    """
+    Show (verbose=True) or silence (verbose=False) the progress messages of varpack. Warnings and errors are always
+    logged.
+    """
+    logger.setLevel(logging.INFO if verbose else logging.WARNING)
+
+
+def use_default_handler(enabled=True):
+    """
+    :param enabled: print the messages of the 'varpack' logger to stdout (True, the default), or only propagate them to
+                    the handlers of the root logger (False), e.g. to route them through the logging configuration of
+                    an application.
+    """
+    if enabled:
+        logger.addHandler(_default_handler)
+    else:
+        logger.removeHandler(_default_handler)
+    logger.propagate = not enabled
+
+
+def add_stats_hook(hook):
+    """
+    :param hook: function called with the IOStats of each finished save and load.
+    """
+    _hooks.append(hook)
+
+
+def remove_stats_hook(hook):
+    _hooks.remove(hook)
+
+
+class VarStats:
+    """
+    Statistics of a variable during a save or load.
+    """
+
+    def __init__(self):
+        self.kind = None  # how the variable is stored, 'array', 'pickle', 'packed', 'compressed' or 'strings'
+        self.timings = dict()  # phase -> seconds
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.files_unchanged = 0
+
+    @property
+    def total_time(self):
+        return sum(self.timings.values())
+
+    def as_dict(self):
+        return {'kind': self.kind, 'timings': dict(self.timings), 'bytes_written': self.bytes_written,
+                'bytes_read': self.bytes_read, 'files_unchanged': self.files_unchanged}
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, self.as_dict())
+
+
+class IOStats:
+    """
+    Statistics of a save or load, see the description above. The phases of different variables may run concurrently
+    (in threads), so the sum of the timings can exceed the duration of the operation.
+    """
+
+    def __init__(self, operation, path):
+        """
+        :param operation: 'save' or 'load'.
+        :param path: folder or single-file pack.
+        """
+        self.operation = operation
+        self.path = path
+        self.variables = dict()  # variable name -> VarStats
+        self.start_time = time.time()
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the lock is not picklable (e.g. when the pack holding the stats is pickled)
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def var(self, name):
+        with self._lock:
+            if name not in self.variables:
+                self.variables[name] = VarStats()
+            return self.variables[name]
+
+    def add_time(self, name, phase, seconds):
+        var_stats = self.var(name)
+        with self._lock:
+            var_stats.timings[phase] = var_stats.timings.get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timer(self, name, phase):
+        """
+        Context manager adding the time spent in its block to the phase of a variable.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, phase, time.perf_counter() - start)
+
+    def timed(self, name, phase, function):
+        """
+        :return: a function calling function within timer(name, phase), e.g. for tasks run in threads.
+        """
+        def timed_function(*args, **kwargs):
+            with self.timer(name, phase):
+                return function(*args, **kwargs)
+        return timed_function
+
+    def set_kind(self, name, kind):
+        self.var(name).kind = kind
+
+    def add_bytes(self, name, bytes_written=0, bytes_read=0):
+        var_stats = self.var(name)
+        with self._lock:
+            var_stats.bytes_written += bytes_written
+            var_stats.bytes_read += bytes_read
+
+    def add_unchanged(self, name, num_files=1):
+        var_stats = self.var(name)
+        with self._lock:
+            var_stats.files_unchanged += num_files
+
+    def finish(self):
+        """
+        Record the duration of the operation and call the hooks.
+        """
+        self.duration = time.time() - self.start_time
+        for hook in list(_hooks):
+            try:
+                hook(self)
+            except Exception as e:
+                logger.warning('Stats hook %r failed: %s', hook, e)
+        return self
+
+    @property
+    def bytes_written(self):
+        return sum(var_stats.bytes_written for var_stats in self.variables.values())
+
+    @property
+    def bytes_read(self):
+        return sum(var_stats.bytes_read for var_stats in self.variables.values())
+
+    def phase_totals(self):
+        """
+        :return: dictionary with the total time of each phase over all the variables.
+        """
+        totals = dict()
+        for var_stats in self.variables.values():
+            for phase, seconds in var_stats.timings.items():
+                totals[phase] = totals.get(phase, 0.0) + seconds
+        return totals
+
+    def slowest(self, n=10):
+        """
+        :return: list of the (name, VarStats) of the n variables with the largest total time.
+        """
+        return sorted(self.variables.items(), key=lambda item: item[1].total_time, reverse=True)[:n]
+
+    def as_dict(self):
+        return {'operation': self.operation, 'path': self.path, 'duration': self.duration,
+                'bytes_written': self.bytes_written, 'bytes_read': self.bytes_read,
+                'phases': self.phase_totals(),
+                'variables': {name: var_stats.as_dict() for name, var_stats in self.variables.items()}}
+
+    def __repr__(self):
+        return '%s(%s %s, %d variables, %d bytes written, %d bytes read, %s s)' % (
+            type(self).__name__, self.operation, self.path, len(self.variables), self.bytes_written,
+            self.bytes_read, '?' if self.duration is None else '%.3f' % self.duration)
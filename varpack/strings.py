@@ -0,0 +1,174 @@
+import numpy as np
+
+# Arrays of strings (object arrays of str or bytes, e.g. id columns) are stored as two arrays, instead of pickling
+# each element:
+#   data:    the UTF-8 encoded strings (or the bytes) concatenated into a single uint8 array
+#   offsets: an int64 array with the offset of each string in data (in C order), followed by the length of data
+# Both are saved as .npy files and memory-mapped on load, where they are wrapped in a read-only StringArray that only
+# decodes the strings that are accessed.
+
+KINDS = {str: 'str', bytes: 'bytes'}
+DECODE_BLOCK_STRINGS = 2 ** 16  # strings decoded at once when converting a whole StringArray
+
+
+def string_kind(np_arr):
+    """
+    :param np_arr: numpy array.
+    :return: 'str' or 'bytes' if np_arr is a non-empty object array whose elements are all str or all bytes, else None.
+    """
+    if not isinstance(np_arr, np.ndarray) or np_arr.dtype != object or np_arr.size == 0:
+        return None
+    flat = np_arr.reshape(-1)
+    kind = KINDS.get(type(flat[0]))
+    if kind is None or any(type(x) is not type(flat[0]) for x in flat):
+        return None
+    return kind
+
+
+def encode_strings(np_arr, kind):
+    """
+    :param np_arr: object array of str (kind 'str') or bytes (kind 'bytes').
+    :return: data (uint8) and offsets (int64) arrays.
+    """
+    flat = np_arr.reshape(-1)
+    encoded = [x.encode('utf-8') for x in flat] if kind == 'str' else list(flat)
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, offsets
+
+
+def fixed_width_dtype(np_arr, kind, data, offsets):
+    """
+    :return: the fixed-width dtype ('U' or 'S') that np_arr can be converted to without taking more space than its
+             data and offsets arrays, or None. Strings ending with NUL characters are not converted, since numpy
+             strips them.
+    """
+    flat = np_arr.reshape(-1)
+    if kind == 'str':
+        width = max(map(len, flat))
+        itemsize = 4 * width
+    else:
+        width = itemsize = int(np.diff(offsets).max())
+    if width == 0 or itemsize * len(flat) > data.nbytes + offsets.nbytes:
+        return None
+    if any(x.endswith('\x00' if kind == 'str' else b'\x00') for x in flat):
+        return None
+    return np.dtype(('U' if kind == 'str' else 'S') + str(width))
+
+
+class StringArray:
+    """
+    Read-only array-like of strings (str or bytes) backed by the data and offsets arrays of encode_strings(), usually
+    memory-mapped. Indexing it decodes only the selected strings: an integer index of a 1-D array returns a string,
+    other indices return object arrays. np.asarray(x) decodes all the strings into an object array.
+    """
+
+    def __init__(self, data, offsets, shape, kind):
+        """
+        :param data: uint8 array with the encoded strings.
+        :param offsets: int64 array with the offset of each string and the length of data.
+        :param shape: shape of the array.
+        :param kind: 'str' or 'bytes'.
+        """
+        self.data = data
+        self.offsets = offsets
+        self.shape = tuple(shape)
+        self.kind = kind
+
+    dtype = np.dtype(object)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+    def lengths(self):
+        """
+        :return: array with the length of each string, in bytes (of its UTF-8 encoding for str).
+        """
+        return np.diff(self.offsets).reshape(self.shape)
+
+    def __len__(self):
+        if self.ndim == 0:
+            raise TypeError('len() of unsized object')
+        return self.shape[0]
+
+    def __repr__(self):
+        return '%s(shape=%s, kind=%s)' % (type(self).__name__, self.shape, self.kind)
+
+    def _decode_range(self, start, stop):
+        # list of the strings start:stop (flat indices), decoded from a single contiguous read of data
+        base = int(self.offsets[start])
+        offsets = (np.asarray(self.offsets[start:stop + 1]) - base).tolist()
+        raw = self.data[base:int(self.offsets[stop])].tobytes()
+        if self.kind == 'bytes':
+            return [raw[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+        text = raw.decode('utf-8')
+        if len(text) == len(raw):  # ASCII only: byte offsets are character offsets
+            return [text[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+        return [raw[a:b].decode('utf-8') for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def _decode(self, flat_indices):
+        # object array with the strings at the flat indices (any shape)
+        flat_indices = np.asarray(flat_indices, dtype=np.int64)
+        out = np.empty(flat_indices.size, dtype=object)
+        indices = flat_indices.reshape(-1)
+        if indices.size > 0 and np.all(np.diff(indices) == 1):
+            out[:] = self._decode_range(int(indices[0]), int(indices[-1]) + 1)
+        else:
+            starts = np.asarray(self.offsets[indices]).tolist()
+            stops = np.asarray(self.offsets[indices + 1]).tolist()
+            for i, (a, b) in enumerate(zip(starts, stops)):
+                value = self.data[a:b].tobytes()
+                out[i] = value.decode('utf-8') if self.kind == 'str' else value
+        return out.reshape(flat_indices.shape)
+
+    def __getitem__(self, key):
+        if self.ndim == 1 and isinstance(key, (int, np.integer)):
+            row = int(key) + self.shape[0] if key < 0 else int(key)
+            if not 0 <= row < self.shape[0]:
+                raise IndexError('index %d is out of bounds for axis 0 with size %d' % (key, self.shape[0]))
+            return self._decode_range(row, row + 1)[0]
+        if self.ndim == 1 and isinstance(key, slice):
+            start, stop, step = key.indices(self.shape[0])
+            if step == 1:
+                out = np.empty(max(0, stop - start), dtype=object)
+                if stop > start:
+                    out[:] = self._decode_range(start, stop)
+                return out
+        # other indices select the flat indices of the strings with an array of positions
+        positions = np.arange(self.size, dtype=np.int64).reshape(self.shape)[key]
+        if np.ndim(positions) == 0:
+            return self._decode(positions).item()
+        return self._decode(positions)
+
+    def __iter__(self):
+        if self.ndim == 0:
+            raise TypeError('iteration over a 0-d array')
+        for start in range(0, self.shape[0], DECODE_BLOCK_STRINGS):
+            yield from self[start:start + DECODE_BLOCK_STRINGS]
+
+    def __array__(self, dtype=None, copy=None):
+        out = np.empty(self.size, dtype=object)
+        for start in range(0, self.size, DECODE_BLOCK_STRINGS):
+            stop = min(self.size, start + DECODE_BLOCK_STRINGS)
+            out[start:stop] = self._decode_range(start, stop)
+        out = out.reshape(self.shape)
+        return out if dtype is None else out.astype(dtype)
+
+    def tolist(self):
+        return np.asarray(self).tolist()
+
+    def to_fixed_width(self):
+        """
+        :return: a numpy array of fixed-width dtype ('U' for str, 'S' for bytes) with the strings.
+        """
+        return np.asarray(self).astype('U' if self.kind == 'str' else 'S')
@@ -0,0 +1,273 @@
+import sys
+import numpy as np
+
+from . import strings
+from .strings import StringArray
+
+# Columnar storage of tables: structured (record) numpy arrays and pandas DataFrames are saved with one file per
+# column, instead of as a single .npy file or a pickle:
+#   - columns of a numpy dtype are saved as .npy files
+#   - columns of strings (all str or all bytes, without missing values) are saved as their data and offsets arrays,
+#     see strings.py
+#   - other columns (e.g. pandas categoricals, or strings with missing values) are pickled with the metadata of the
+#     table (labels, dtypes, index of a DataFrame)
+# On load, a table is a read-only Table whose columns are only opened (memory-mapped) when they are first accessed,
+# so reading one column only touches the files of that column. Table.materialize() rebuilds the structured array or
+# DataFrame. pandas is only needed for DataFrames, it is not imported by varpack.
+
+KINDS = ('records', 'dataframe')
+
+
+def _pandas():
+    # the pandas module, if it has been imported (a DataFrame cannot exist otherwise)
+    return sys.modules.get('pandas')
+
+
+def table_kind(obj):
+    """
+    :return: 'records' for a structured numpy array (of at least one dimension), 'dataframe' for a pandas DataFrame
+             with unique column labels, the kind of a Table, else None.
+    """
+    if isinstance(obj, Table):
+        return obj.kind
+    if isinstance(obj, np.ndarray) and obj.dtype.names is not None and obj.ndim >= 1:
+        return 'records'
+    pandas = _pandas()
+    if pandas is not None and isinstance(obj, pandas.DataFrame) and obj.columns.is_unique:
+        return 'dataframe'
+    return None
+
+
+def _column_values(values, meta, position):
+    # the values of a column, or None if they are pickled with the metadata (added to meta['pickled'])
+    if isinstance(values, (StringArray, np.ndarray)) and not values.dtype.hasobject:
+        return values
+    if isinstance(values, np.ndarray) and strings.string_kind(values) is not None:
+        return values
+    meta['pickled'][position] = values
+    return None
+
+
+def split_table(obj):
+    """
+    :param obj: structured array, DataFrame or Table.
+    :return: the metadata of the table (pickled with it) and the list of the values of its columns (numpy arrays or
+             StringArrays, None for the columns pickled with the metadata). The index of a DataFrame is the last
+             column if meta['index_column'] (an index of a numpy dtype other than a RangeIndex).
+    """
+    if isinstance(obj, Table):
+        return obj.split()
+
+    if table_kind(obj) == 'records':
+        meta = {'kind': 'records', 'labels': list(obj.dtype.names), 'dtype': obj.dtype, 'shape': obj.shape,
+                'num_rows': obj.shape[0], 'pickled': dict()}
+        return meta, [_column_values(obj[name], meta, position) for position, name in enumerate(obj.dtype.names)]
+
+    pandas = _pandas()
+    meta = {'kind': 'dataframe', 'labels': list(obj.columns), 'dtypes': list(obj.dtypes),
+            'columns_name': obj.columns.name, 'attrs': dict(obj.attrs), 'num_rows': len(obj), 'pickled': dict(),
+            'index': obj.index, 'index_column': False}
+    values = list()
+    for position in range(obj.shape[1]):
+        series = obj.iloc[:, position]
+        if isinstance(series.dtype, np.dtype) and not series.dtype.hasobject:
+            values.append(_column_values(series.to_numpy(), meta, position))
+        elif series.dtype == object or pandas.api.types.is_string_dtype(series.dtype):
+            column = series.to_numpy(dtype=object)
+            values.append(column if strings.string_kind(column) is not None else
+                          _column_values(series.array, meta, position))
+        else:
+            values.append(_column_values(series.array, meta, position))
+
+    index = obj.index
+    if type(index) is pandas.Index and isinstance(index.dtype, np.dtype) and not index.dtype.hasobject:
+        # e.g. timestamps or ids, saved as a column
+        meta.update(index=None, index_column=True, index_name=index.name, index_dtype=index.dtype)
+        values.append(index.to_numpy())
+    return meta, values
+
+
+def column_files(base, values):
+    """
+    :param base: file name of the column without extension.
+    :param values: values of the column (a numpy array, an object array of strings or a StringArray).
+    :return: the record of the column (its files, shape and dtype) and the list of the (filename, array) to save.
+    """
+    if isinstance(values, StringArray):
+        kind, data, offsets = values.kind, values.data, values.offsets
+    elif values.dtype.hasobject:
+        kind = strings.string_kind(values)
+        data, offsets = strings.encode_strings(values, kind)
+    else:
+        record = {'filename': base + '.npy', 'shape': list(values.shape), 'dtype': str(values.dtype)}
+        return record, [(record['filename'], values)]
+    record = {'filename': base + '.strings.npy', 'strings': {'offsets': base + '.string-offsets.npy', 'kind': kind},
+              'shape': list(values.shape), 'dtype': 'object'}
+    return record, [(record['filename'], data), (record['strings']['offsets'], offsets)]
+
+
+class Table:
+    """
+    Read-only table of columns, see the description above. t[label] returns a column: a numpy array (memory-mapped
+    when loaded from a pack), a StringArray, or the pickled values. t.materialize() rebuilds the structured array or
+    DataFrame, t.select(labels) is a table with only some of the columns.
+    """
+
+    def __init__(self, meta, loader=None, positions=None):
+        """
+        :param meta: metadata of the table, see split_table().
+        :param loader: function loading the column at a position (the index of a DataFrame is at the last position
+                       if meta['index_column']).
+        :param positions: positions of the selected columns. Default: all the columns.
+        """
+        self.meta = meta
+        self._loader = loader
+        self._positions = list(range(len(meta['labels']))) if positions is None else list(positions)
+        self._loaded = dict()  # position -> values of the loaded columns
+
+    @property
+    def kind(self):
+        return self.meta['kind']
+
+    @property
+    def columns(self):
+        return [self.meta['labels'][position] for position in self._positions]
+
+    @property
+    def shape(self):
+        return self.meta['num_rows'], len(self._positions)
+
+    def __len__(self):
+        return self.meta['num_rows']
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __contains__(self, label):
+        return label in self.columns
+
+    def __repr__(self):
+        return '%s(kind=%s, rows=%d, columns=%s)' % (type(self).__name__, self.kind, len(self), self.columns)
+
+    def _position(self, label):
+        for position in self._positions:
+            if self.meta['labels'][position] == label:
+                return position
+        raise KeyError(label)
+
+    def column_at(self, position):
+        """
+        :return: the values of the column at a position of the whole table (loaded if needed).
+        """
+        if position in self.meta['pickled']:
+            return self.meta['pickled'][position]
+        if position not in self._loaded:
+            self._loaded[position] = self._loader(position)
+        return self._loaded[position]
+
+    def __getitem__(self, label):
+        return self.column_at(self._position(label))
+
+    def select(self, labels):
+        """
+        :return: a table with only the columns with these labels (sharing the columns loaded so far).
+        """
+        table = type(self)(self.meta, self._loader, [self._position(label) for label in labels])
+        table._loaded = self._loaded
+        return table
+
+    def _all_positions(self):
+        # positions of the selected columns, and of the index column if any
+        return self._positions + ([len(self.meta['labels'])] if self.meta.get('index_column') else [])
+
+    def split(self):
+        """
+        :return: the metadata and the values of the columns of a table with only the selected columns, see
+                 split_table().
+        """
+        meta = dict(self.meta)
+        meta['labels'] = self.columns
+        meta['pickled'] = {i: self.meta['pickled'][p] for i, p in enumerate(self._positions)
+                           if p in self.meta['pickled']}
+        if self.kind == 'records':
+            meta['dtype'] = np.dtype([(label, self.meta['dtype'].fields[label][0]) for label in meta['labels']])
+        else:
+            meta['dtypes'] = [self.meta['dtypes'][p] for p in self._positions]
+        return meta, [None if p in self.meta['pickled'] else self.column_at(p) for p in self._all_positions()]
+
+    def map_columns(self, function):
+        """
+        :return: a table with function applied to the values of each (loaded) column, e.g. to copy them into memory.
+        """
+        table = type(self)(self.meta, None, self._positions)
+        for position in self._all_positions():
+            if position not in self.meta['pickled']:
+                table._loaded[position] = function(self.column_at(position))
+        return table
+
+    def __getstate__(self):
+        # the loader is not pickled, the columns are loaded (into memory) instead
+        table = self.map_columns(np.asarray)
+        return {'meta': table.meta, '_loader': None, '_positions': table._positions, '_loaded': table._loaded}
+
+    def index(self):
+        """
+        :return: the index of a DataFrame (requires pandas), or None for a structured array.
+        """
+        if self.kind != 'dataframe':
+            return None
+        if not self.meta.get('index_column'):
+            return self.meta['index']
+        return _require_pandas().Index(np.asarray(self.column_at(len(self.meta['labels']))),
+                                       dtype=self.meta['index_dtype'], name=self.meta['index_name'])
+
+    def to_records(self):
+        """
+        :return: a structured numpy array with the selected columns.
+        """
+        if self.kind == 'records':
+            dtype = np.dtype([(label, self.meta['dtype'].fields[label][0]) for label in self.columns])
+            out = np.empty(self.meta['shape'], dtype=dtype)
+            for label in self.columns:
+                out[label] = np.asarray(self[label])
+            return out
+        return np.rec.fromarrays([np.asarray(self[label]) for label in self.columns],
+                                 names=[str(label) for label in self.columns])
+
+    def to_pandas(self):
+        """
+        :return: a pandas DataFrame with the selected columns (and the index of the saved DataFrame).
+        """
+        pandas = _require_pandas()
+        if self.kind == 'records':
+            return pandas.DataFrame({label: np.asarray(self[label]) for label in self.columns})
+
+        data = dict()
+        for label, position in zip(self.columns, self._positions):
+            values = self.column_at(position)
+            if isinstance(values, (np.ndarray, StringArray)):
+                values = np.asarray(values)
+            data[label] = pandas.Series(values).astype(self.meta['dtypes'][position])
+        df = pandas.DataFrame(data, columns=self.columns)
+        df.index = self.index()
+        df.columns.name = self.meta['columns_name']
+        df.attrs.update(self.meta['attrs'])
+        return df
+
+    def materialize(self):
+        """
+        :return: the table as it was saved: a structured array or a DataFrame.
+        """
+        return self.to_records() if self.kind == 'records' else self.to_pandas()
+
+    def __array__(self, dtype=None, copy=None):
+        out = self.to_records()
+        return out if dtype is None else out.astype(dtype)
+
+
+def _require_pandas():
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError('pandas is needed to rebuild DataFrames, install it or use Table.to_records().')
+    return pandas
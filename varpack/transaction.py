@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import time
+import uuid
+import ctypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Transactional saves into a folder. The files written by a save do not replace the files of the previous save until
+# all of them have been written:
+#   1. each file is written to a staged file, <filename>.tx<id>.tmp
+#   2. with durable=True, the staged files are flushed to disk together: writeback is started for all of them at once
+#      (with sync_file_range() where available) and they are then fsync'ed in parallel
+#   3. the list of the staged files is written to the journal (JOURNAL_FILENAME), through a temporary file that
+#      atomically replaces it. This is the commit point of the save.
+#   4. the staged files replace the files (varpack.json last), then the journal is removed
+# If a save fails or the process crashes before 3, the files of the previous save are intact and the staged files are
+# removed (by the failed save, or when the folder is next opened). If it crashes after 3, the renames are completed
+# when the folder is next opened (see recover()). Files are always replaced, never modified in place, so arrays that
+# are memory-mapped from the files of the previous save stay valid.
+
+JOURNAL_FILENAME = 'varpack.journal'
+STAGED_FILE_PATTERN = re.compile(r'\.tx[0-9a-f]{12}\.tmp$')
+# renamed last, in this order, so that the new manifest is never read with the data files of the previous save (a
+# binary index newer than varpack.json is ignored, see Varpack._read_json())
+MANIFEST_FILENAMES = ('varpack.index', 'varpack.json')
+FSYNC_WORKERS = 8
+
+_active = dict()  # absolute folder -> Transaction in progress
+_active_guard = threading.Lock()
+
+SYNC_FILE_RANGE_WRITE = 2
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _sync_file_range = _libc.sync_file_range
+    _sync_file_range.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_uint]
+except (OSError, AttributeError):
+    _sync_file_range = None
+
+
+def _fsync_path(path, directory=False):
+    fd = os.open(path, os.O_RDONLY | (getattr(os, 'O_DIRECTORY', 0) if directory else 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_folder(folder):
+    """
+    Flush the entries of a folder (e.g. renamed files) to disk, where supported.
+    """
+    try:
+        _fsync_path(folder, directory=True)
+    except OSError:  # e.g. on Windows, or on filesystems which do not support it
+        pass
+
+
+def flush_files(paths, workers=FSYNC_WORKERS):
+    """
+    Flush files to disk together: the writeback of all of them is started first, then they are fsync'ed in parallel.
+    :return: dictionary with the time spent flushing each file (in seconds).
+    """
+    if _sync_file_range is not None:
+        for path in paths:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                _sync_file_range(fd, 0, 0, SYNC_FILE_RANGE_WRITE)  # asynchronous, errors are reported by fsync
+            finally:
+                os.close(fd)
+
+    def flush(path):
+        start = time.perf_counter()
+        _fsync_path(path)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(paths)))) as executor:
+        return dict(zip(paths, executor.map(flush, paths)))
+
+
+class Transaction:
+    """
+    Files staged by a save into a folder, see the description above.
+    """
+
+    def __init__(self, folder, durable=False):
+        self.folder = os.path.abspath(folder)
+        self.durable = durable
+        self.id = uuid.uuid4().hex[:12]
+        self.staged = dict()  # file name -> staged file name
+        self._abort_callbacks = list()
+        self._lock = threading.Lock()
+
+    def stage(self, filename):
+        """
+        :return: path of the staged file to write instead of the file filename of the folder.
+        """
+        with self._lock:
+            if filename not in self.staged:
+                self.staged[filename] = '%s.tx%s.tmp' % (filename, self.id)
+            return os.path.join(self.folder, self.staged[filename])
+
+    def on_abort(self, callback):
+        """
+        :param callback: function called if the transaction is aborted, e.g. to undo in-memory changes made for the
+                         staged files.
+        """
+        self._abort_callbacks.append(callback)
+
+    def commit(self):
+        """
+        Replace the files of the folder with the staged files.
+        :return: dictionary with the time spent flushing each staged file to disk (by file name), empty unless
+                 durable.
+        """
+        staged = sorted(self.staged.items())
+        fsync_times = dict()
+        if self.durable and len(staged) > 0:
+            times = flush_files([os.path.join(self.folder, tmp) for _, tmp in staged])
+            fsync_times = {filename: times[os.path.join(self.folder, tmp)] for filename, tmp in staged}
+
+        journal_path = os.path.join(self.folder, JOURNAL_FILENAME)
+        with open(journal_path + '.tmp', 'w') as f:
+            json.dump({'id': self.id, 'files': dict(staged)}, f)
+            if self.durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(journal_path + '.tmp', journal_path)
+        if self.durable:
+            fsync_folder(self.folder)
+
+        _roll_forward(self.folder, dict(staged))
+        if self.durable:
+            fsync_folder(self.folder)
+        try:
+            os.remove(journal_path)
+        except FileNotFoundError:  # already removed by recover(), e.g. from another process
+            pass
+        self.staged = dict()
+        self._abort_callbacks = list()
+        return fsync_times
+
+    def abort(self):
+        """
+        Remove the staged files, the files of the folder are left as they were.
+        """
+        for callback in reversed(self._abort_callbacks):
+            callback()
+        self._abort_callbacks = list()
+        for tmp in self.staged.values():
+            try:
+                os.remove(os.path.join(self.folder, tmp))
+            except FileNotFoundError:
+                pass
+        self.staged = dict()
+
+
+def _roll_forward(folder, staged):
+    # replaces the files with their staged files (the ones that have not been moved yet), the manifest last
+    order = {filename: i for i, filename in enumerate(MANIFEST_FILENAMES)}
+    for filename, tmp in sorted(staged.items(), key=lambda item: (order.get(item[0], -1), item[0])):
+        try:
+            os.replace(os.path.join(folder, tmp), os.path.join(folder, filename))
+        except FileNotFoundError:
+            pass
+
+
+def begin(folder, durable=False):
+    """
+    Start a transaction for a save into folder: until it is committed or aborted, the files written into folder with
+    temp_path() and finish() are staged.
+    :return: the Transaction.
+    """
+    recover(folder)
+    transaction = Transaction(folder, durable)
+    with _active_guard:
+        _active[transaction.folder] = transaction
+    return transaction
+
+
+def end(folder, commit):
+    """
+    End the transaction of a folder, if any: commit it, or abort it (e.g. after an error).
+    :return: see Transaction.commit(), or None.
+    """
+    with _active_guard:
+        transaction = _active.pop(os.path.abspath(folder), None)
+    if transaction is None:
+        return None
+    if commit:
+        return transaction.commit()
+    transaction.abort()
+    return None
+
+
+def temp_path(path):
+    """
+    :return: the path of the file to write instead of path, which is then moved over path by finish(): the staged
+             file of the transaction of its folder, or path + '.tmp' outside of a transaction.
+    """
+    with _active_guard:
+        transaction = _active.get(os.path.dirname(os.path.abspath(path)))
+    if transaction is None:
+        return path + '.tmp'
+    return transaction.stage(os.path.basename(path))
+
+
+def finish(tmp_path, path):
+    """
+    Move the file written to temp_path(path) over path, unless it is staged by a transaction.
+    """
+    if tmp_path == path + '.tmp':
+        os.replace(tmp_path, path)
+
+
+def recover(folder):
+    """
+    Complete the transaction of a save into folder that was committed but not finished (e.g. after a crash), and
+    remove the staged files of saves that were not committed.
+    :return: whether a committed transaction was completed.
+    """
+    if not os.path.isdir(folder):
+        return False
+    journal_path = os.path.join(folder, JOURNAL_FILENAME)
+    completed = False
+    if os.path.isfile(journal_path):
+        try:
+            with open(journal_path, 'r') as f:
+                journal = json.load(f)
+        except ValueError:
+            journal = None  # the journal is always complete once in place, so this is not expected
+        if journal is not None:
+            _roll_forward(folder, journal['files'])
+            fsync_folder(folder)
+            completed = True
+        os.remove(journal_path)
+
+    with _active_guard:
+        active = _active.get(os.path.abspath(folder))
+    for filename in os.listdir(folder):
+        if STAGED_FILE_PATTERN.search(filename) and (active is None or filename not in active.staged.values()):
+            try:
+                os.remove(os.path.join(folder, filename))
+            except FileNotFoundError:
+                pass
+    return completed
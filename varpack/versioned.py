@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import functools
+
+from . import Varpack, logger, fastcopy, _copy_files, _folder_lock, _run_parallel, _snapshot_value, \
+    FINGERPRINT_CHUNK_BYTES, JSON_FILENAME, BINARY_INDEX_FILENAME
+
+# A versioned store keeps many versions of a pack without duplicating the files they have in common:
+#   blobs/<2 first hex digits>/<sha256 of the content>: one file per distinct content (read-only)
+#   versions/<tag>/: a regular varpack folder whose data files are hard links to the blobs, with its varpack.json
+#                    and a manifest (MANIFEST_FILENAME) mapping each data file to its blob
+# so that versions are loaded (and memory-mapped) like any pack, and storage only grows with the files that changed.
+# Data files are only ever replaced (never modified in place) by save(), so the blobs stay intact: versions are
+# memory-mapped copy-on-write instead of 'r+' (even when opened with Varpack(), see is_version_folder()), and
+# create_array() and append() refuse to write into them. On filesystems without hard links, the files of the versions
+# are copies of the blobs.
+
+MANIFEST_FILENAME = 'varpack.manifest.json'
+BLOBS_FOLDER = 'blobs'
+VERSIONS_FOLDER = 'versions'
+STAGING_FOLDER = 'staging'
+
+
+def is_version_folder(folder):
+    """
+    :return: whether folder is a version of a store, whose files must not be modified in place (see
+             Varpack.load(), which maps them copy-on-write instead of 'r+').
+    """
+    return os.path.isfile(os.path.join(folder, MANIFEST_FILENAME))
+
+
+def file_digest(path):
+    """
+    :return: sha256 hex digest of the content of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(functools.partial(f.read, FINGERPRINT_CHUNK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class VersionedStore:
+    """
+    Content-addressed store of versions of a pack, see the description above.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: folder of the store, created if it does not exist.
+        """
+        self.root = root
+        for folder in [BLOBS_FOLDER, VERSIONS_FOLDER, STAGING_FOLDER]:
+            os.makedirs(os.path.join(root, folder), exist_ok=True)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, BLOBS_FOLDER, digest[:2], digest)
+
+    def version_path(self, tag):
+        return os.path.join(self.root, VERSIONS_FOLDER, tag)
+
+    def _read_manifest(self, tag):
+        with open(os.path.join(self.version_path(tag), MANIFEST_FILENAME), 'r') as f:
+            return json.load(f)
+
+    def list_versions(self):
+        """
+        :return: list of the manifests of the versions (tag, created time, parent tag and the blob of each file),
+                 from the oldest to the newest.
+        """
+        manifests = list()
+        for tag in os.listdir(os.path.join(self.root, VERSIONS_FOLDER)):
+            try:
+                manifests.append(self._read_manifest(tag))
+            except (EnvironmentError, ValueError):
+                logger.warning('Skipping version %s, its manifest could not be read.', tag)
+        return sorted(manifests, key=lambda manifest: (manifest['created'], manifest['tag']))
+
+    def latest_tag(self):
+        """
+        :return: tag of the newest version, or None if the store is empty.
+        """
+        manifests = self.list_versions()
+        return manifests[-1]['tag'] if len(manifests) > 0 else None
+
+    def _version_of(self, folder):
+        # tag of the version of this store in folder, if any
+        if folder is None:
+            return None
+        parent, tag = os.path.split(os.path.abspath(folder))
+        if parent == os.path.abspath(os.path.join(self.root, VERSIONS_FOLDER)) and \
+                os.path.isfile(os.path.join(folder, MANIFEST_FILENAME)):
+            return tag
+        return None
+
+    def save(self, varpack, tag=None, workers=None, **kwargs):
+        """
+        Save a pack as a new version. Files that have not changed since the version the pack was loaded from (or
+        since the newest version) are not rewritten, and files with the same content as an existing blob are not
+        stored again.
+        :param varpack: the pack to save, it is left unchanged (a pack attached to a folder is copied with its files,
+                        the variables of a pack that is not attached are snapshotted as with save_async()).
+        :param tag: name of the version. Default: 'v<number of versions + 1>'.
+        :param workers: number of threads used to copy, write and hash files concurrently.
+        :param kwargs: key-value arguments passed to Varpack.save(), except save_folder and format.
+        :return: the tag of the version.
+        """
+        with _folder_lock(self.root):
+            if tag is None:
+                number = len(self.list_versions()) + 1
+                while os.path.exists(self.version_path('v%d' % number)):
+                    number += 1
+                tag = 'v%d' % number
+            if tag in ('', '.', '..') or os.sep in tag or (os.altsep is not None and os.altsep in tag):
+                raise ValueError('Invalid version tag: %s' % tag)
+            if os.path.exists(self.version_path(tag)):
+                raise ValueError('Version %s already exists.' % tag)
+
+            staging = tempfile.mkdtemp(prefix=tag + '.', dir=os.path.join(self.root, STAGING_FOLDER))
+            try:
+                parent = self._save_to_staging(varpack, staging, workers, kwargs)
+                manifest = {'tag': tag, 'created': time.time(), 'parent': parent,
+                            'files': self._store_blobs(staging, parent, workers)}
+                with open(os.path.join(staging, MANIFEST_FILENAME), 'w') as f:
+                    json.dump(manifest, f, indent=4)
+                os.rename(staging, self.version_path(tag))
+            except:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+        logger.info('Saved version %s with %d files.', tag, len(manifest['files']))
+        return tag
+
+    def _save_to_staging(self, varpack, staging, workers, kwargs):
+        # saves the pack into the staging folder, returns the tag of the version its files were taken from
+        attached_folder = varpack.get_attached_folder()
+        parent = self._version_of(attached_folder)
+        if attached_folder is not None and varpack.__internal__['format'] == 'folder':
+            # the files of a version are linked (they are blobs), the files of other packs are copied
+            staged = varpack._copy_to_folder(staging, hardlink=parent is not None, workers=workers)
+        elif attached_folder is not None:  # single-file pack
+            varpack.save(save_folder=staging, format='folder', workers=workers, **kwargs)
+            return None
+        else:
+            # the files of the newest version are linked, so that the variables that did not change are not
+            # rewritten (their fingerprints match the ones of its varpack.json)
+            parent = self.latest_tag()
+            staged = Varpack()
+            if parent is not None:
+                parent_folder = self.version_path(parent)
+                _copy_files(parent_folder, staging, self._read_manifest(parent)['files'], hardlink=True,
+                            workers=workers)
+                staged.__internal__['var_info'] = Varpack._read_json(parent_folder)
+            staged.__internal__['skip_saving_vars'] = set(varpack.__internal__['skip_saving_vars'])
+            memo = dict()
+            for var_name, value in vars(varpack).items():
+                if var_name != '__internal__':
+                    object.__setattr__(staged, var_name, _snapshot_value(value, memo))
+            # none of the variables can be trusted to be unchanged since the parent version
+            staged.__internal__['assigned_vars'] = set(vars(staged)) - {'__internal__'}
+            staged.__internal__['attached_folder'] = staging
+
+        staged.save(workers=workers, **kwargs)
+        return parent
+
+    def _store_blobs(self, staging, parent, workers):
+        # moves the data files of the staging folder into the blobs (unless a blob with the same content exists) and
+        # replaces them with links to the blobs, returns the blob of each file
+        known = dict()  # (device, inode) -> digest of the blobs of the parent version, which do not need hashing
+        if parent is not None:
+            for digest in set(self._read_manifest(parent)['files'].values()):
+                try:
+                    stat = os.stat(self.blob_path(digest))
+                    known[(stat.st_dev, stat.st_ino)] = digest
+                except FileNotFoundError:
+                    pass
+
+        var_info = Varpack._read_json(staging)
+        filenames = sorted(f for f in Varpack._var_info_files(var_info) if os.path.isfile(os.path.join(staging, f)))
+        # files left over in the staging folder (e.g. linked from the parent but no longer used) are removed
+        for filename in set(os.listdir(staging)) - set(filenames) - {JSON_FILENAME, BINARY_INDEX_FILENAME}:
+            os.remove(os.path.join(staging, filename))
+
+        def store(filename):
+            path = os.path.join(staging, filename)
+            stat = os.stat(path)
+            if (stat.st_dev, stat.st_ino) in known:
+                return known[(stat.st_dev, stat.st_ino)]
+
+            digest = file_digest(path)
+            blob = self.blob_path(digest)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            if not os.path.isfile(blob):
+                fastcopy.copy_file(path, blob, hardlink=True)
+                os.chmod(blob, 0o444)
+            fastcopy.copy_file(blob, path, hardlink=True)
+            return digest
+
+        files = dict()
+        for filename, (digest, error) in zip(filenames, _run_parallel([functools.partial(store, filename)
+                                                                       for filename in filenames], workers)):
+            if error is not None:
+                raise error
+            files[filename] = digest
+        return files
+
+    def load(self, tag=None, numpy_mmap_mode='r', **kwargs):
+        """
+        Load a version, its arrays are memory-mapped from the blobs.
+        :param tag: tag of the version. Default: the newest version.
+        :param numpy_mmap_mode: 'r' or 'c', the files of a version must not be modified in place. To save changes,
+                                save the pack as a new version with save().
+        :param kwargs: key-value arguments passed to Varpack.load().
+        :return: Varpack attached to the folder of the version.
+        """
+        assert numpy_mmap_mode in ['r', 'c'], "numpy_mmap_mode must be 'r' or 'c'."
+        if tag is None:
+            tag = self.latest_tag()
+            if tag is None:
+                raise ValueError('The store %s has no versions.' % self.root)
+        if not os.path.isfile(os.path.join(self.version_path(tag), MANIFEST_FILENAME)):
+            raise ValueError('Version %s does not exist.' % tag)
+        return Varpack(self.version_path(tag), numpy_mmap_mode=numpy_mmap_mode, **kwargs)
+
+    def remove(self, tag):
+        """
+        Remove a version. Its blobs are removed by gc() if no other version uses them.
+        """
+        with _folder_lock(self.root):
+            if not os.path.isfile(os.path.join(self.version_path(tag), MANIFEST_FILENAME)):
+                raise ValueError('Version %s does not exist.' % tag)
+            # the manifest is removed first, so that an interrupted removal does not leave a partial version
+            os.remove(os.path.join(self.version_path(tag), MANIFEST_FILENAME))
+            shutil.rmtree(self.version_path(tag))
+
+    def prune(self, keep_last=None, keep_tags=None, dry_run=False):
+        """
+        Remove the older versions and the blobs that are no longer used.
+        :param keep_last: number of newest versions to keep.
+        :param keep_tags: tags of versions to keep regardless of their age. At least one of keep_last and keep_tags
+                          must be given, so that prune() never removes all the versions by default.
+        :param dry_run: only return the tags of the versions that would be removed.
+        :return: list of the removed tags.
+        """
+        if keep_last is None and keep_tags is None:
+            raise ValueError('prune() needs keep_last or keep_tags.')
+        keep_tags = set() if keep_tags is None else set(keep_tags)
+        with _folder_lock(self.root):
+            tags = [manifest['tag'] for manifest in self.list_versions()]
+            if keep_last is not None and keep_last > 0:
+                keep_tags |= set(tags[-keep_last:])
+            removed_tags = [tag for tag in tags if tag not in keep_tags]
+            if not dry_run:
+                for tag in removed_tags:
+                    self.remove(tag)
+                self.gc()
+        return removed_tags
+
+    def gc(self, dry_run=False):
+        """
+        Remove the blobs that are not used by any version, and staging folders left over by interrupted saves.
+        :param dry_run: only return the blobs that would be removed.
+        :return: list of the digests of the removed blobs.
+        """
+        with _folder_lock(self.root):
+            used = set()
+            for manifest in self.list_versions():
+                used.update(manifest['files'].values())
+
+            unused = list()
+            blobs_folder = os.path.join(self.root, BLOBS_FOLDER)
+            for prefix in sorted(os.listdir(blobs_folder)):
+                for digest in sorted(os.listdir(os.path.join(blobs_folder, prefix))):
+                    if digest not in used:
+                        unused.append(digest)
+
+            if not dry_run:
+                for digest in unused:
+                    os.remove(self.blob_path(digest))
+                staging = os.path.join(self.root, STAGING_FOLDER)
+                for folder in os.listdir(staging):
+                    shutil.rmtree(os.path.join(staging, folder), ignore_errors=True)
+        return unused